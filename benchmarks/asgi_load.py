@@ -0,0 +1,193 @@
+"""
+Load test of the image endpoints under WSGI threads (gunicorn, one worker) against ASGI (uvicorn, one worker).
+
+Opens --clients concurrent slow clients, each trickling an upload to the server (or reading a download slowly
+with --scenario download), and meanwhile measures the latency of fast requests listing the images.
+Under WSGI every slow client holds one of the --threads threads, so the fast requests queue behind them;
+under ASGI the slow clients are coroutines waiting on the event loop.
+Runs against a throwaway test database; needs `pip install gunicorn uvicorn`.
+
+    python benchmarks/asgi_load.py --clients 200 --threads 16
+"""
+import argparse
+import asyncio
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.core.files.base import ContentFile  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from PIL import Image  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from image_hosting.blobs import store_blob  # noqa: E402
+from image_hosting.models import User, UploadedFile  # noqa: E402
+
+SERVERS = {
+    'wsgi': (['gunicorn', 'core.wsgi:application', '--workers', '1', '--worker-class', 'gthread',
+              '--threads', '{threads}', '--bind', '127.0.0.1:{port}', '--timeout', '300'], '/images/'),
+    'asgi': (['uvicorn', 'core.asgi:application', '--workers', '1', '--port', '{port}', '--log-level', 'warning'],
+             '/async/images/'),
+}
+
+
+def make_image(size):
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 64).convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def write_settings(directory, module, database, media_root):
+    """
+    Writes the settings module of the servers: the given options of the default database
+    (e.g. the benchmark's test database) and the media directory.
+    """
+    with open(os.path.join(directory, f'{module}.py'), 'w') as settings:
+        settings.write(f"from {os.environ['DJANGO_SETTINGS_MODULE']} import *  # noqa\n"
+                       f"DATABASES['default'].update({database!r})\n"
+                       f"MEDIA_ROOT = {media_root!r}\n"
+                       "RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'\n"
+                       "DEBUG = False\n"
+                       "ALLOWED_HOSTS = ['*']\n")
+
+
+def start_server(command, port, settings_dir, module='bench_settings'):
+    """
+    Starts the server command (with `{port}` to fill in) on the settings module and waits until it listens.
+    """
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': module,
+           'PYTHONPATH': os.pathsep.join([settings_dir, ROOT, os.environ.get('PYTHONPATH', '')])}
+    process = subprocess.Popen([part.format(port=port) for part in command], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{command[0]} did not start")
+
+
+async def http(port, method, path, token, body=b'', content_type=None, chunk=None, delay=0.0, read_delay=0.0):
+    """
+    Sends a request, trickling the body in `chunk` sized pieces every `delay` seconds,
+    and reads the response in `chunk` sized pieces every `read_delay` seconds. Returns the status.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    headers = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1", f"Authorization: Token {token}",
+               f"Content-Length: {len(body)}", "Connection: close"]
+    if content_type:
+        headers.append(f"Content-Type: {content_type}")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+    chunk = chunk or len(body) or 1
+    for start in range(0, len(body), chunk):
+        writer.write(body[start:start + chunk])
+        await writer.drain()
+        if delay:
+            await asyncio.sleep(delay)
+
+    status_line = await reader.readline()
+    while await reader.read(chunk if read_delay else 65536):
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def run_load(port, prefix, token, file_id, args, upload):
+    body = encode_multipart(BOUNDARY, {'new_file': ContentFile(upload, name='bench.png')})
+
+    async def slow_client():
+        if args.scenario == 'upload':
+            return await http(port, 'POST', prefix, token, body, MULTIPART_CONTENT, chunk=args.chunk, delay=args.delay)
+        return await http(port, 'GET', f"{prefix}{file_id}/file/", token, chunk=args.chunk, read_delay=args.delay)
+
+    async def probe():
+        started = time.perf_counter()
+        status = await http(port, 'GET', prefix, token)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    slow = [asyncio.create_task(slow_client()) for _ in range(args.clients)]
+    await asyncio.sleep(0.5)
+    latencies = []
+    while not all(task.done() for task in slow) and len(latencies) < args.probes:
+        latency, status = await probe()
+        latencies.append(latency)
+    statuses = await asyncio.gather(*slow, return_exceptions=True)
+    return time.perf_counter() - started, latencies, statuses
+
+
+def report(kind, elapsed, latencies, statuses):
+    ok = sum(1 for status in statuses if status in (200, 201))
+    latencies = sorted(latencies) or [float('nan')]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"  {kind}: {ok}/{len(statuses)} slow requests ok in {elapsed:.1f} s, "
+          f"{len(latencies)} fast requests p50 {statistics.median(latencies) * 1000:.0f} ms p99 {p99 * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=200, help="Concurrent slow clients.")
+    parser.add_argument('--threads', type=int, default=16, help="Threads of the WSGI worker.")
+    parser.add_argument('--scenario', choices=('upload', 'download'), default='upload')
+    parser.add_argument('--size', type=int, default=256, help="Width and height of the image sent or read.")
+    parser.add_argument('--chunk', type=int, default=16 * 1024, help="Bytes per write or read of a slow client.")
+    parser.add_argument('--delay', type=float, default=0.05, help="Seconds between the writes or reads.")
+    parser.add_argument('--probes', type=int, default=200, help="Maximum fast requests per server.")
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as settings_dir, \
+                override_settings(MEDIA_ROOT=media_root):
+            write_settings(settings_dir, 'bench_settings', {'NAME': connection.settings_dict['NAME']}, media_root)
+            upload = make_image(args.size)
+
+            user = User.objects.create_user('bench', password='bench', tier=User.UserTiers.PREMIUM)
+            token = Token.objects.create(user=user).key
+            blob = store_blob(ContentFile(upload, name='bench.png'), UploadedFile.ValidFileFormat.PNG)
+            file = UploadedFile.objects.create(name='bench.png', created_by=user, blob=blob, image_url=blob.name,
+                                               file_format=UploadedFile.ValidFileFormat.PNG)
+
+            print(f"{args.clients} slow {args.scenario}s of {len(upload) // 1024} KB "
+                  f"({args.chunk // 1024} KB every {args.delay * 1000:.0f} ms), WSGI with {args.threads} threads")
+            for kind in args.servers:
+                port = free_port()
+                command = [part.replace('{threads}', str(args.threads)) for part in SERVERS[kind][0]]
+                server = start_server(command, port, settings_dir)
+                try:
+                    result = asyncio.run(run_load(port, SERVERS[kind][1], token, file.pk, args, upload))
+                    report(kind, *result)
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
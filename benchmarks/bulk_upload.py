@@ -0,0 +1,102 @@
+"""
+Compares the upload throughput of one request per file (POST /images/) against the bulk endpoint
+(POST /images/bulk/), and the same for deletes. Runs against a throwaway test database.
+
+    python benchmarks/bulk_upload.py --files 500 --batch 100
+
+Thumbnail rendering is left to the database queue so only the request path is measured.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from PIL import Image  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from image_hosting.models import User, UploadedFile  # noqa: E402
+
+
+def make_uploads(count):
+    uploads = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        Image.effect_noise((64, 64), 64).convert('RGB').save(buffer, format='PNG')
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def client_for(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+    return client
+
+
+def single_upload(client, uploads, batch):
+    for content in uploads:
+        client.post(reverse('UploadedFile-list'),
+                    {'new_file': SimpleUploadedFile('bench.png', content, content_type='image/png')}, format='multipart')
+
+
+def bulk_upload(client, uploads, batch):
+    for start in range(0, len(uploads), batch):
+        new_files = [SimpleUploadedFile('bench.png', content, content_type='image/png') for content in uploads[start:start + batch]]
+        client.post(reverse('UploadedFile-bulk'), {'new_files': new_files}, format='multipart')
+
+
+def single_delete(client, ids, batch):
+    for file_id in ids:
+        client.delete(reverse('UploadedFile-detail', kwargs={'pk': file_id}))
+
+
+def bulk_delete(client, ids, batch):
+    for start in range(0, len(ids), batch):
+        client.post(reverse('UploadedFile-bulk_delete'), {'ids': ids[start:start + batch]}, format='json')
+
+
+def measure(name, func, client, items, batch):
+    started = time.perf_counter()
+    func(client, items, batch)
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<14} {len(items) / elapsed:8.1f} files/s  ({elapsed:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, BULK_MAX_ITEMS=args.batch,
+                                  RENDITION_BACKEND='image_hosting.renditions.DatabaseQueueBackend'):
+            uploads = make_uploads(args.files)
+            print(f"{args.files} files, batches of {args.batch}")
+            for name, upload, delete in (('single', single_upload, single_delete), ('bulk', bulk_upload, bulk_delete)):
+                user = User.objects.create_user(f'bench-{name}', password='bench')
+                client = client_for(user)
+                measure(f'{name} upload', upload, client, uploads, args.batch)
+                ids = list(UploadedFile.objects.filter(created_by=user).values_list('id', flat=True))
+                measure(f'{name} delete', delete, client, ids, args.batch)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
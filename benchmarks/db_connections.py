@@ -0,0 +1,101 @@
+"""
+Requests/s and latency of GET /images/<id>/ under gunicorn (gunicorn.conf.py) when every request opens
+a new database connection (the default, CONN_MAX_AGE=0) against persistent connections with health checks,
+and optionally through pgbouncer. Runs against a throwaway test database; needs `pip install gunicorn`.
+
+    python benchmarks/db_connections.py --clients 32 --seconds 10
+    python benchmarks/db_connections.py --pgbouncer localhost:6432
+
+The pgbouncer must point at the same Postgres server, which serves the test database created here.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from asgi_load import ROOT, free_port, http, start_server, write_settings
+
+from django.db import connection
+from django.test.utils import setup_test_environment
+from rest_framework.authtoken.models import Token
+
+from image_hosting.models import User, UploadedFile
+
+COMMAND = ['gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), 'core.wsgi:application',
+           '--bind', '127.0.0.1:{port}', '--access-logfile', '/dev/null']
+
+
+def configurations(args):
+    yield 'new connection per request', {'CONN_MAX_AGE': 0}
+    yield 'persistent connections', {'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True}
+    if args.pgbouncer:
+        host, port = args.pgbouncer.split(':')
+        yield 'pgbouncer', {'HOST': host, 'PORT': port, 'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True,
+                            'DISABLE_SERVER_SIDE_CURSORS': True}
+
+
+async def run_load(port, path, token, clients, seconds):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if await http(port, 'GET', path, token) != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors
+
+
+def report(name, latencies, errors, seconds):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"  {name:<28} {len(latencies) / seconds:8.1f} req/s  p50 {statistics.median(latencies) * 1000:6.1f} ms  "
+          f"p99 {p99 * 1000:6.1f} ms  errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32, help="Concurrent clients.")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn worker processes.")
+    parser.add_argument('--threads', type=int, default=8, help="Threads per worker.")
+    parser.add_argument('--pgbouncer', help="host:port of a pgbouncer in front of the same Postgres.")
+    args = parser.parse_args()
+
+    os.environ.update(GUNICORN_WORKERS=str(args.workers), GUNICORN_THREADS=str(args.threads))
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as settings_dir:
+            user = User.objects.create_user('bench', password='bench', tier=User.UserTiers.PREMIUM)
+            token = Token.objects.create(user=user).key
+            file = UploadedFile.objects.create(name='bench.png', created_by=user, image_url='bench.png',
+                                               file_format=UploadedFile.ValidFileFormat.PNG)
+
+            print(f"{args.clients} clients for {args.seconds:.0f} s, {args.workers} workers x {args.threads} threads")
+            for index, (name, database) in enumerate(configurations(args)):
+                module = f'bench_settings_{index}'
+                write_settings(settings_dir, module, {'NAME': connection.settings_dict['NAME'], **database}, media_root)
+                port = free_port()
+                server = start_server(COMMAND, port, settings_dir, module)
+                try:
+                    # warm up the workers (imports, tier and token caches)
+                    asyncio.run(run_load(port, f'/images/{file.pk}/', token, args.clients, 1))
+                    latencies, errors = asyncio.run(run_load(port, f'/images/{file.pk}/', token, args.clients, args.seconds))
+                    report(name, latencies, errors, args.seconds)
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Query plan audit of every endpoint of image_hosting/urls.py.
+
+Seeds the data of the regression harness (regression.py) in a throwaway database, sends the request of each of its
+scenarios and runs EXPLAIN (ANALYZE on PostgreSQL) on the queries it ran, reporting the sequential scans.
+Exits with an error if any is found. Run it against the production database engine before adding a query:
+
+    python benchmarks/explain_queries.py [--images 200] [--only images_list link_use_legacy] [--plans]
+
+tests/test_query_plans.py runs the audit as part of the test suite.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+import django
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment  # noqa: E402
+
+from benchmarks.regression import SCENARIOS, World, benchmark_settings, send, send_asgi  # noqa: E402
+
+# the tier table is read whole on purpose, see tiers.py
+ALLOWED_SCANS = {'image_hosting_tier'}
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on "?(\w+)"?'),
+    # SQLite: "SCAN <table>" reads every row, "SCAN <table> USING INDEX" or "SEARCH <table> ..." do not
+    'sqlite': re.compile(r'^SCAN "?(\w+)"?(?: AS \w+)?$'),
+}
+
+
+def explain(sql):
+    """
+    Plan of the statement, one line per node. On PostgreSQL it is run (EXPLAIN ANALYZE) with sequential scans
+    disabled, so a sequential scan left in the plan means no index can serve the query, whatever the table size.
+    The statement is rolled back.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ANALYZE ' + sql)
+            plan = [row[0] for row in cursor.fetchall()]
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        transaction.set_rollback(True)
+    return plan
+
+
+def top_level(sql):
+    """
+    The statement without its subqueries (nor any parenthesized expression).
+    """
+    while True:
+        stripped = re.sub(r'\([^()]*\)', '', sql)
+        if stripped == sql:
+            return sql
+        sql = stripped
+
+
+def sequential_scans(sql, plan, vendor):
+    """
+    Tables the plan reads every row of, except ALLOWED_SCANS.
+    SQLite shows a walk of a table in primary key order as a scan too: one stopped by the LIMIT of an unfiltered
+    page (e.g. the first page of the users) reads no more rows than an index would, so it is not reported.
+    """
+    pattern = SEQ_SCAN_PATTERNS[vendor]
+    tables = {match.group(1) for line in plan for match in [pattern.search(line.strip())] if match} - ALLOWED_SCANS
+    if vendor == 'sqlite' and len(tables) == 1:
+        statement = top_level(sql)
+        if (' LIMIT ' in statement and ' WHERE ' not in statement and ' JOIN ' not in statement
+                and not any('TEMP B-TREE FOR ORDER BY' in line for line in plan)):
+            tables = set()
+    return sorted(tables)
+
+
+def audit(images, names=None):
+    """
+    Seeds the data of the regression harness in the current database and sends the request of each of its
+    scenarios (all of them, or those named), explaining every query the request ran.
+    Returns {scenario: [(sql, plan, sequential scans)]}.
+    """
+    if connection.vendor not in SEQ_SCAN_PATTERNS:
+        raise ValueError(f"Query plans of {connection.vendor} are not supported")
+    world = World(images)
+    if connection.vendor == 'postgresql':
+        # fresh statistics of the seeded tables for the planner. SQLite is left without statistics: it then
+        # assumes large tables, instead of preferring scans of the few rows seeded
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    results = {}
+    for scenario in SCENARIOS:
+        if names is not None and scenario.name not in names:
+            continue
+        asgi = scenario.url_name.startswith('async_')
+        client = world.client(scenario.user, asgi)
+        call = scenario.prepare(world)
+        with CaptureQueriesContext(connection) as queries:
+            send_asgi(client, call) if asgi else send(client, call)
+        statements = [query['sql'] for query in queries.captured_queries if query['sql'].lstrip().upper().startswith(EXPLAINED)]
+        results[scenario.name] = []
+        for sql in statements:
+            plan = explain(sql)
+            results[scenario.name].append((sql, plan, sequential_scans(sql, plan, connection.vendor)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200, help="Images per seeded user.")
+    parser.add_argument('--only', nargs='+', choices=[scenario.name for scenario in SCENARIOS])
+    parser.add_argument('--plans', action='store_true', help="Print the plan of every query.")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as directory, override_settings(**benchmark_settings(directory)):
+            results = audit(args.images, args.only)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    flagged = 0
+    for name, queries in results.items():
+        scans = sorted({table for _, _, tables in queries for table in tables})
+        print(f"{name:<26} {len(queries):>3} queries  " + (f"SEQ SCAN {', '.join(scans)}" if scans else "ok"))
+        for sql, plan, tables in queries:
+            if tables or args.plans:
+                flagged += bool(tables)
+                print(f"    {sql}")
+                print('\n'.join(f"      {line}" for line in plan))
+
+    if flagged:
+        sys.exit(f"{flagged} quer{'y' if flagged == 1 else 'ies'} with sequential scans")
+    print("No sequential scans")
+
+
+if __name__ == '__main__':
+    main()
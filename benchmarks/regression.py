@@ -0,0 +1,396 @@
+"""
+Query count, latency and memory regression check of every endpoint of image_hosting/urls.py.
+
+Seeds a user of each tier (and an admin) owning --images images, then sends each request of SCENARIOS
+--iterations times through the test clients (the async endpoints through the ASGI handler), recording
+the most queries a request ran, the latency percentiles and the peak memory Python allocated for one request.
+The results are compared with the baselines stored in benchmarks/baselines.json: more queries than the baseline
+fail, and so do latencies (p95) and memory above the baseline by more than --tolerance.
+Runs against a throwaway test database.
+
+    python benchmarks/regression.py                    # compare with the baselines
+    python benchmarks/regression.py --images 10 200    # also check the counts do not grow with the images
+    python benchmarks/regression.py --update           # store the current results as the baselines
+
+Latencies depend on the machine: record the baselines on the machine that runs the check.
+tests/test_regression.py checks the query counts (only) as part of the test suite.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+import django
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.core.files.base import ContentFile  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment  # noqa: E402
+from django.urls import URLResolver, reverse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from PIL import Image  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from image_hosting import urls  # noqa: E402
+from image_hosting.blobs import store_blob  # noqa: E402
+from image_hosting.links import create_link  # noqa: E402
+from image_hosting.models import Blob, TempUrl, UploadedFile, UploadSession, User, randomString  # noqa: E402
+from image_hosting.metadata import read_metadata  # noqa: E402
+from image_hosting.renditions import render_renditions  # noqa: E402
+from tests.asgi_client import Client as ASGIClient  # noqa: E402
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# a request of a scenario: `data` and `extra` are passed on to the test client
+Call = namedtuple('Call', 'method path data extra', defaults=(None, {}))
+Scenario = namedtuple('Scenario', 'name url_name user status prepare')
+
+
+def make_png(size=64):
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 64).convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class World:
+    """
+    The seeded data: a user of each tier (and an admin), each owning `images` images sharing one stored
+    blob and its thumbnails, and the clients of the users.
+    """
+
+    def __init__(self, images):
+        self.png = make_png()
+        self.users = {
+            'basic': User.objects.create_user('bench-basic', password='bench', tier=User.UserTiers.BASIC),
+            'premium': User.objects.create_user('bench-premium', password='bench', tier=User.UserTiers.PREMIUM),
+            'enterprise': User.objects.create_user('bench-enterprise', password='bench', tier=User.UserTiers.ENTERPRISE),
+            'admin': User.objects.create_superuser('bench-admin', password='bench'),
+        }
+        self.tokens = {name: Token.objects.create(user=user).key for name, user in self.users.items()}
+
+        self.blob = store_blob(ContentFile(self.png, name='bench.png'), UploadedFile.ValidFileFormat.PNG)
+        self.metadata = read_metadata(ContentFile(self.png), self.blob.sha256)
+        first = UploadedFile.objects.create(name='bench.png', created_by=self.users['premium'], blob=self.blob,
+                                            image_url=self.blob.name, file_format=UploadedFile.ValidFileFormat.PNG,
+                                            **self.metadata)
+        render_renditions(first.pk)
+        first.refresh_from_db()
+        self.renditions = first.renditions
+        self.files = {name: [first] if name == 'premium' else [] for name in self.users}
+        for name, user in self.users.items():
+            self.files[name] += UploadedFile.objects.bulk_create(
+                self.file(user) for _ in range(images - len(self.files[name])))
+        Blob.objects.filter(pk=self.blob.pk).update(ref_count=UploadedFile.objects.filter(blob=self.blob).count())
+        self.legacy_token = TempUrl.objects.create(user=self.users['enterprise'], related_file=self.files['enterprise'][0],
+                                                   token=randomString(), expiry_date=self.future()).token
+
+    @staticmethod
+    def future():
+        return timezone.now() + datetime.timedelta(days=1)
+
+    def file(self, user):
+        return UploadedFile(name='bench.png', created_by=user, blob=self.blob, image_url=self.blob.name,
+                            file_format=UploadedFile.ValidFileFormat.PNG,
+                            rendition_status=UploadedFile.RenditionStatus.READY, renditions=self.renditions, **self.metadata)
+
+    def new_file(self, user_name):
+        """
+        A new image of the user, for the requests that consume one.
+        """
+        blob = store_blob(ContentFile(self.png, name='bench.png'), UploadedFile.ValidFileFormat.PNG, sha256=self.blob.sha256)
+        file = self.file(self.users[user_name])
+        file.blob = blob
+        file.save()
+        return file
+
+    def upload(self, content=None):
+        return SimpleUploadedFile('bench.png', content or self.png, content_type='image/png')
+
+    def new_session(self, user_name, received=False):
+        session = UploadSession.objects.create(user=self.users[user_name], name='bench.png', size=len(self.png))
+        if received:
+            os.makedirs(os.path.dirname(session.staging_path), exist_ok=True)
+            with open(session.staging_path, 'wb') as staged:
+                staged.write(self.png)
+            UploadSession.objects.filter(pk=session.pk).update(received=len(self.png),
+                                                               file_format=UploadedFile.ValidFileFormat.PNG)
+        return session
+
+    def client(self, user_name, asgi=False):
+        token = self.tokens.get(user_name)
+        if asgi:
+            return ASGIClient(token=token)
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+
+def chunk(world):
+    session = world.new_session('premium')
+    return Call('PUT', reverse('UploadSession-detail', kwargs={'pk': session.pk}), world.png,
+                {'content_type': 'application/octet-stream', 'HTTP_CONTENT_RANGE': f'bytes 0-{len(world.png) - 1}/{len(world.png)}'})
+
+
+def signed_token(world, user_name='enterprise'):
+    return create_link(world.files[user_name][0].pk, 300)[1]
+
+
+SCENARIOS = [
+    Scenario('api_root', 'api-root', 'basic', 200, lambda w: Call('GET', reverse('api-root'))),
+    Scenario('images_list', 'UploadedFile-list', 'premium', 200, lambda w: Call('GET', reverse('UploadedFile-list'))),
+    Scenario('images_list_filtered', 'UploadedFile-list', 'premium', 200,
+             lambda w: Call('GET', reverse('UploadedFile-list') + '?orientation=square&min_width=32')),
+    Scenario('images_upload', 'UploadedFile-list', 'premium', 201,
+             lambda w: Call('POST', reverse('UploadedFile-list'), {'new_file': w.upload()}, {'format': 'multipart'})),
+    Scenario('images_bulk_upload', 'UploadedFile-bulk', 'premium', 207,
+             lambda w: Call('POST', reverse('UploadedFile-bulk'), {'new_files': [w.upload() for _ in range(5)]},
+                            {'format': 'multipart'})),
+    Scenario('images_bulk_delete', 'UploadedFile-bulk_delete', 'premium', 207,
+             lambda w: Call('POST', reverse('UploadedFile-bulk_delete'), {'ids': [w.new_file('premium').pk for _ in range(5)]},
+                            {'format': 'json'})),
+    Scenario('image_detail', 'UploadedFile-detail', 'premium', 200,
+             lambda w: Call('GET', reverse('UploadedFile-detail', kwargs={'pk': w.files['premium'][0].pk}))),
+    Scenario('image_replace', 'UploadedFile-detail', 'premium', 200,
+             lambda w: Call('PUT', reverse('UploadedFile-detail', kwargs={'pk': w.new_file('premium').pk}),
+                            {'new_file': w.upload()}, {'format': 'multipart'})),
+    Scenario('image_replace_content', 'UploadedFile-detail', 'premium', 200,
+             lambda w: Call('PUT', reverse('UploadedFile-detail', kwargs={'pk': w.new_file('premium').pk}),
+                            {'new_file': w.upload(make_png())}, {'format': 'multipart'})),
+    Scenario('image_delete', 'UploadedFile-detail', 'premium', 200,
+             lambda w: Call('DELETE', reverse('UploadedFile-detail', kwargs={'pk': w.new_file('premium').pk}))),
+    Scenario('image_original', 'UploadedFile-file', 'enterprise', 200,
+             lambda w: Call('GET', reverse('UploadedFile-file', kwargs={'pk': w.files['enterprise'][0].pk}))),
+    Scenario('image_thumbnail', 'UploadedFile-file', 'premium', 200,
+             lambda w: Call('GET', reverse('UploadedFile-file', kwargs={'pk': w.files['premium'][0].pk}) + '?size=200')),
+    Scenario('image_render', 'UploadedFile-render', 'enterprise', 200,
+             lambda w: Call('GET', reverse('UploadedFile-render', kwargs={'pk': w.files['enterprise'][0].pk}) + '?w=320&h=240')),
+    Scenario('users_list', 'User-list', 'admin', 200, lambda w: Call('GET', reverse('User-list'))),
+    Scenario('users_list_counts', 'User-list', 'admin', 200, lambda w: Call('GET', reverse('User-list') + '?counts=1')),
+    Scenario('user_detail', 'User-detail', 'admin', 200,
+             lambda w: Call('GET', reverse('User-detail', kwargs={'pk': w.users['premium'].pk}))),
+    Scenario('upload_session_create', 'UploadSession-list', 'premium', 201,
+             lambda w: Call('POST', reverse('UploadSession-list'), {'name': 'bench.png', 'size': len(w.png)}, {'format': 'json'})),
+    Scenario('upload_session_status', 'UploadSession-detail', 'premium', 200,
+             lambda w: Call('GET', reverse('UploadSession-detail', kwargs={'pk': w.new_session('premium').pk}))),
+    Scenario('upload_session_chunk', 'UploadSession-detail', 'premium', 200, chunk),
+    Scenario('upload_session_cancel', 'UploadSession-detail', 'premium', 200,
+             lambda w: Call('DELETE', reverse('UploadSession-detail', kwargs={'pk': w.new_session('premium').pk}))),
+    Scenario('upload_session_finalize', 'UploadSession-finalize', 'premium', 201,
+             lambda w: Call('POST', reverse('UploadSession-finalize', kwargs={'pk': w.new_session('premium', received=True).pk}))),
+    Scenario('link_generate', 'generate_link', 'enterprise', 201,
+             lambda w: Call('GET', reverse('generate_link', kwargs={'file_id': w.files['enterprise'][0].pk}))),
+    Scenario('link_use', 'use_link', 'enterprise', 302,
+             lambda w: Call('GET', reverse('use_link', kwargs={'token': signed_token(w)}))),
+    Scenario('link_use_legacy', 'use_link', 'enterprise', 302,
+             lambda w: Call('GET', reverse('use_link', kwargs={'token': w.legacy_token}))),
+    Scenario('link_revoke', 'revoke_link', 'enterprise', 200,
+             lambda w: Call('POST', reverse('revoke_link', kwargs={'token': signed_token(w)}))),
+    Scenario('async_images_list', 'async_images', 'premium', 200, lambda w: Call('GET', reverse('async_images'))),
+    Scenario('async_images_upload', 'async_images', 'premium', 201,
+             lambda w: Call('POST', reverse('async_images'), {'new_file': w.upload()})),
+    Scenario('async_image_detail', 'async_image_detail', 'premium', 200,
+             lambda w: Call('GET', reverse('async_image_detail', kwargs={'pk': w.files['premium'][0].pk}))),
+    Scenario('async_image_file', 'async_image_file', 'enterprise', 200,
+             lambda w: Call('GET', reverse('async_image_file', kwargs={'pk': w.files['enterprise'][0].pk}))),
+    Scenario('async_link_generate', 'async_generate_link', 'enterprise', 201,
+             lambda w: Call('GET', reverse('async_generate_link', kwargs={'file_id': w.files['enterprise'][0].pk}))),
+    Scenario('async_link_use', 'async_use_link', 'enterprise', 302,
+             lambda w: Call('GET', reverse('async_use_link', kwargs={'token': signed_token(w)}))),
+    Scenario('login_page', 'login', None, 200, lambda w: Call('GET', reverse('rest_framework:login'))),
+    Scenario('logout', 'logout', None, 200, lambda w: Call('GET', reverse('rest_framework:logout'))),
+]
+
+
+def route_names(patterns=urls.urlpatterns):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def uncovered_routes():
+    """
+    Names of the routes of image_hosting/urls.py no scenario requests.
+    """
+    return route_names() - {scenario.url_name for scenario in SCENARIOS}
+
+
+def benchmark_settings(directory):
+    """
+    Settings of the run: files under the directory, thumbnails left to the database queue
+    so that only the request path is measured, files streamed by Django, and no limit on the upload
+    sessions the iterations leave open.
+    """
+    return {
+        'MEDIA_ROOT': os.path.join(directory, 'media'),
+        'UPLOAD_SESSION_DIR': os.path.join(directory, 'upload_sessions'),
+        'UPLOAD_SESSION_MAX_OPEN': sys.maxsize,
+        'RENDER_CACHE_DIR': os.path.join(directory, 'render_cache'),
+        'RENDITION_BACKEND': 'image_hosting.renditions.DatabaseQueueBackend',
+        'RENDER_WORKERS': 0,
+        'MEDIA_ACCEL_BACKEND': '',
+    }
+
+
+def send(client, call):
+    response = getattr(client, call.method.lower())(call.path, **({'data': call.data} if call.data is not None else {}),
+                                                      **call.extra)
+    if hasattr(response, 'streaming_content'):
+        b''.join(response.streaming_content)
+    return response
+
+
+def send_asgi(client, call):
+    if call.method == 'POST':
+        return client.post(call.path, call.data)
+    return client.get(call.path)
+
+
+def run_scenario(world, scenario, iterations):
+    """
+    Sends the request of the scenario once to warm up the caches, then `iterations` times measuring it,
+    and once more under tracemalloc.
+    """
+    asgi = scenario.url_name.startswith('async_')
+    client = world.client(scenario.user, asgi)
+
+    def request():
+        call = scenario.prepare(world)
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = send_asgi(client, call) if asgi else send(client, call)
+        elapsed = time.perf_counter() - started
+        if response.status_code != scenario.status:
+            raise AssertionError(f"{scenario.name}: {call.method} {call.path} answered {response.status_code}, "
+                                 f"expected {scenario.status}")
+        return len(queries), elapsed
+
+    request()
+    counts, latencies = zip(*(request() for _ in range(iterations)))
+
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    latencies = sorted(latencies)
+    return {
+        'queries': max(counts),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(images, iterations, names=None):
+    """
+    Seeds the data and runs the scenarios (all of them, or those named), returning the results by scenario.
+    """
+    world = World(images)
+    return {scenario.name: run_scenario(world, scenario, iterations)
+            for scenario in SCENARIOS if names is None or scenario.name in names}
+
+
+def compare(results, baselines, tolerance, slack_ms=2.0):
+    """
+    Regressions of the results against the baselines, as messages. Latencies must also exceed
+    the baseline by `slack_ms`, so that the noise of sub-millisecond endpoints does not fail the check.
+    """
+    failures = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            failures.append(f"{name}: no baseline, run with --update")
+            continue
+        if result['queries'] > baseline['queries']:
+            failures.append(f"{name}: {result['queries']} queries, baseline {baseline['queries']}")
+        if result['p95_ms'] > max(baseline['p95_ms'] * (1 + tolerance), baseline['p95_ms'] + slack_ms):
+            failures.append(f"{name}: p95 {result['p95_ms']} ms, baseline {baseline['p95_ms']} ms")
+        if result['peak_kb'] > baseline['peak_kb'] * (1 + tolerance):
+            failures.append(f"{name}: peak {result['peak_kb']} KB, baseline {baseline['peak_kb']} KB")
+    return failures
+
+
+def load_baselines(path=BASELINES):
+    with open(path) as file:
+        return json.load(file)
+
+
+def report(images, results):
+    print(f"{images} images per user")
+    print(f"  {'endpoint':<26} {'queries':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak KB':>9}")
+    for name, result in results.items():
+        print(f"  {name:<26} {result['queries']:>7} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['peak_kb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, nargs='+', help="Images per user; several values run several times "
+                                                              "(default: the baselines').")
+    parser.add_argument('--iterations', type=int, default=30, help="Measured requests per endpoint.")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed latency and memory growth (0.5 = 50%%).")
+    parser.add_argument('--slack-ms', type=float, default=2.0, help="Latency growth always allowed.")
+    parser.add_argument('--only', nargs='+', choices=[scenario.name for scenario in SCENARIOS])
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--update', action='store_true', help="Store the results as the baselines.")
+    args = parser.parse_args()
+
+    uncovered = uncovered_routes()
+    if uncovered:
+        sys.exit(f"Routes without a scenario: {', '.join(sorted(uncovered))}")
+    stored = load_baselines(args.baselines) if os.path.exists(args.baselines) else {'images': 50, 'endpoints': {}}
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    failures = []
+    try:
+        for images in args.images or [stored['images']]:
+            with tempfile.TemporaryDirectory() as directory, override_settings(**benchmark_settings(directory)):
+                results = run(images, args.iterations, args.only)
+            report(images, results)
+            if args.update:
+                stored = {'images': images, 'endpoints': {**stored['endpoints'], **results}}
+            else:
+                failures += [f"[{images} images] {failure}" for failure in compare(results, stored['endpoints'], args.tolerance, args.slack_ms)]
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            old_name = connection.creation.create_test_db(verbosity=0)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.update:
+        with open(args.baselines, 'w') as file:
+            json.dump(stored, file, indent=2)
+            file.write('\n')
+        print(f"Baselines stored in {args.baselines}")
+    elif failures:
+        print('\n'.join(["Regressions:"] + [f"  {failure}" for failure in failures]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
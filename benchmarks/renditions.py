@@ -0,0 +1,86 @@
+"""
+Compares rendering the thumbnails of one upload with the imagekit specs (one decode per size)
+against the single-decode rendition engine.
+
+    python benchmarks/renditions.py --width 4000 --height 3000 --runs 10
+
+Reports the number of image decodes and the CPU time per upload for each path.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.core.files import File  # noqa: E402
+from imagekit.processors import ResizeToFill  # noqa: E402
+from imagekit.specs import ImageSpec  # noqa: E402
+from PIL import Image, ImageFile  # noqa: E402
+
+from image_hosting.renditions import render_thumbnails  # noqa: E402
+
+SIZES = [(200, 200), (400, 400)]
+decodes = 0
+_load = ImageFile.ImageFile.load
+
+
+def counting_load(self):
+    global decodes
+    if self.tile:
+        decodes += 1
+    return _load(self)
+
+
+ImageFile.ImageFile.load = counting_load
+
+
+def make_source(width, height, format):
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+def imagekit_path(data):
+    for width, height in SIZES:
+        spec = type('Spec', (ImageSpec,), {'processors': [ResizeToFill(width, height)],
+                                           'format': 'JPEG', 'options': {'quality': 60}})
+        spec(source=File(io.BytesIO(data), name='source')).generate()
+
+
+def engine_path(data):
+    render_thumbnails(io.BytesIO(data), SIZES, format='JPEG', options={'quality': 60})
+
+
+def measure(path, data, runs):
+    global decodes
+    decodes = 0
+    started = time.process_time()
+    for _ in range(runs):
+        path(data)
+    return decodes / runs, (time.process_time() - started) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    for format in ('JPEG', 'PNG'):
+        data = make_source(args.width, args.height, format)
+        print(f"{format} {args.width}x{args.height} ({len(data) / 1e6:.1f} MB), sizes {SIZES}")
+        for name, path in (('imagekit', imagekit_path), ('engine', engine_path)):
+            decode_count, cpu = measure(path, data, args.runs)
+            print(f"  {name:<9} decodes/upload: {decode_count:.0f}  cpu/upload: {cpu * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
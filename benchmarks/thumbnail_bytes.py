@@ -0,0 +1,93 @@
+"""
+Compares the bytes a client downloads for the thumbnails of one page of the image list
+in each thumbnail encoding: the JPEG every client gets and the WebP/AVIF variants served
+to the clients accepting them.
+
+    python benchmarks/thumbnail_bytes.py --images 50 --sizes 200 400
+    python benchmarks/thumbnail_bytes.py --source ~/Pictures
+
+Without --source the images are synthetic photo-like scenes (gradients, shapes and grain);
+real photos give more representative numbers. Reports the bytes per thumbnail, per list page
+(UploadedFileCursorPagination.page_size images, one thumbnail of each size) and the encoding time.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from image_hosting.pagination import UploadedFileCursorPagination  # noqa: E402
+from image_hosting.renditions import THUMBNAIL_FORMAT, THUMBNAIL_OPTIONS, THUMBNAIL_VARIANTS, encode, resize_thumbnails  # noqa: E402
+
+
+def make_scene(seed, width, height):
+    rng = random.Random(seed)
+    top, bottom = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(2)]
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.composite(Image.new('RGB', (width, height), top), Image.new('RGB', (width, height), bottom), gradient)
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(20, width // 4)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(6))
+    grain = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, grain, 0.12)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def sources(args):
+    if args.source:
+        names = sorted(name for name in os.listdir(args.source)
+                       if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))[:args.images]
+        for name in names:
+            with open(os.path.join(args.source, name), 'rb') as file:
+                yield file.read()
+    else:
+        for seed in range(args.images):
+            yield make_scene(seed, 1600, 1200)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 400])
+    parser.add_argument('--source', help="directory of images to use instead of synthetic ones")
+    args = parser.parse_args()
+
+    encodings = {'jpeg': (THUMBNAIL_FORMAT, THUMBNAIL_OPTIONS), **THUMBNAIL_VARIANTS}
+    totals = {name: 0 for name in encodings}
+    seconds = {name: 0.0 for name in encodings}
+    thumbnails = 0
+    for data in sources(args):
+        for _, thumbnail in resize_thumbnails(io.BytesIO(data), [(size, size) for size in args.sizes]):
+            thumbnails += 1
+            for name, (pillow_format, options) in encodings.items():
+                started = time.perf_counter()
+                totals[name] += encode(thumbnail, pillow_format, options).size
+                seconds[name] += time.perf_counter() - started
+
+    if not thumbnails:
+        sys.exit("No images")
+    page_size = UploadedFileCursorPagination.page_size
+    per_page_factor = page_size * len(args.sizes) / thumbnails
+    print(f"{thumbnails} thumbnails (sizes {args.sizes}), list page of {page_size} images")
+    print(f"  {'format':<8} {'bytes/thumb':>12} {'KB/page':>10} {'vs jpeg':>8} {'encode ms':>10}")
+    for name in encodings:
+        print(f"  {name:<8} {totals[name] / thumbnails:>12.0f} {totals[name] * per_page_factor / 1024:>10.1f} "
+              f"{totals[name] / totals['jpeg']:>8.0%} {seconds[name] / thumbnails * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,35 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+from image_hosting.media import AsyncFileResponse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGI handler, sending the chunks of an AsyncFileResponse as they are read on the thread pool:
+    Django 4.1 iterates streaming responses on the event loop.
+    """
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncFileResponse):
+            return await super().send_response(response, send)
+
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        async for part in response.chunks():
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+django.setup(set_prefix=False)
+application = ASGIHandler()
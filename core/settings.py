@@ -78,7 +78,7 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'image_hosting.authentication.CachedTokenAuthentication',
     ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -86,33 +86,28 @@ REST_FRAMEWORK = {
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-# FOR DOCKER USE
-'''
+# Defaults to the local database; docker-compose sets the POSTGRES_* variables.
+# DB_CONN_MAX_AGE keeps each connection open for that many seconds instead of reconnecting on every request,
+# checked before reuse when DB_CONN_HEALTH_CHECKS is on. Set DB_POOLER=pgbouncer when connecting through
+# pgbouncer in transaction pooling mode (see docker-compose.prod.yml).
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.environ.get('POSTGRES_NAME', 'image_hosting_db'),
         'USER': os.environ.get('POSTGRES_USER', 'django_user'),
-        'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
-        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
-        'PORT': 5432,
-    }
-}
-'''
-# FOR LOCAL USE
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'image_hosting_db',
-        'USER': 'django_user',
-        'PASSWORD': 'postgres',
-        'HOST': 'localhost',
-        'PORT': '',
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'postgres'),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '') == '1',
         'TEST': {
             'NAME': 'test_db',
         },
     }
 }
+if os.environ.get('DB_POOLER') == 'pgbouncer':
+    # server-side cursors do not survive pgbouncer handing the connection to another client between transactions
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
 
 
 # Password validation
@@ -158,3 +153,106 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Object storage of the originals and thumbnails, see image_hosting/object_storage.py
+# Setting S3_BUCKET stores them in that bucket of an S3-compatible service instead of MEDIA_ROOT.
+# The credentials default to boto3's (AWS_ACCESS_KEY_ID, instance roles, ...); the media URLs are
+# S3_MEDIA_URL + name, e.g. a CDN in front of the bucket.
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID') or None
+S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY') or None
+S3_ADDRESSING_STYLE = os.environ.get('S3_ADDRESSING_STYLE', 'auto')
+S3_MEDIA_URL = os.environ.get('S3_MEDIA_URL', MEDIA_URL)
+# HTTP connections kept open per process; at least S3_MULTIPART_CONCURRENCY times the concurrent uploads
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+S3_MULTIPART_CONCURRENCY = int(os.environ.get('S3_MULTIPART_CONCURRENCY', 4))
+S3_READ_CHUNK_SIZE = int(os.environ.get('S3_READ_CHUNK_SIZE', 256 * 1024))
+if S3_BUCKET:
+    DEFAULT_FILE_STORAGE = 'image_hosting.object_storage.S3Storage'
+
+# Seconds the files left without references by a deletion or replacement are kept before
+# `manage.py collect_orphans` deletes them, see image_hosting/orphans.py
+STORAGE_GC_GRACE = int(os.environ.get('STORAGE_GC_GRACE', 24 * 60 * 60))
+
+# Thumbnail rendering, see image_hosting/renditions.py
+# Use 'image_hosting.renditions.DatabaseQueueBackend' together with `manage.py render_pending`
+# to render on a separate host instead of the local worker pool.
+RENDITION_BACKEND = os.environ.get('RENDITION_BACKEND', 'image_hosting.renditions.ProcessPoolBackend')
+RENDITION_WORKERS = int(os.environ.get('RENDITION_WORKERS', 2))
+# budgets of the worker processes rendering them, see image_hosting/workers.py (0 for no limit):
+# address space of each worker in bytes, and seconds per file
+RENDITION_MEMORY_LIMIT = int(os.environ.get('RENDITION_MEMORY_LIMIT', 2 * 1024 * 1024 * 1024))
+RENDITION_TIME_LIMIT = int(os.environ.get('RENDITION_TIME_LIMIT', 120))
+# Files still processing RENDITION_CLAIM_TIMEOUT seconds after a worker claimed them (the worker was killed or
+# redeployed) are put back in the queue by `manage.py render_pending`, up to RENDITION_MAX_ATTEMPTS times, then failed.
+# The timeout must exceed the time a worker takes over a whole batch.
+RENDITION_CLAIM_TIMEOUT = int(os.environ.get('RENDITION_CLAIM_TIMEOUT', 30 * 60))
+RENDITION_MAX_ATTEMPTS = int(os.environ.get('RENDITION_MAX_ATTEMPTS', 3))
+
+# Pixels of the largest image any process decodes, whatever the tier (which sets its own limits of the uploads,
+# Tier.max_pixels and Tier.max_file_size, see validate_image_limits in image_hosting/serializers.py)
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 100_000_000))
+
+# Seconds the account tiers are cached in each process, see image_hosting/tiers.py
+TIER_CACHE_TIMEOUT = int(os.environ.get('TIER_CACHE_TIMEOUT', 60))
+
+# On-the-fly renders of /images/<id>/render/, cached on disk, see image_hosting/render_cache.py
+# The least recently used renders are evicted once the cache holds more than RENDER_CACHE_MAX_BYTES.
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(BASE_DIR, 'render_cache'))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+RENDER_CACHE_SWEEP_INTERVAL = int(os.environ.get('RENDER_CACHE_SWEEP_INTERVAL', 60))
+# the renders are decoded on RENDER_WORKERS worker processes of each web process, under the budgets of
+# RENDITION_MEMORY_LIMIT and RENDITION_TIME_LIMIT; 0 decodes them in the web process (tests, debugging)
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 1))
+# internal nginx location of RENDER_CACHE_DIR when MEDIA_ACCEL_BACKEND is 'nginx'
+RENDER_CACHE_ACCEL_PREFIX = os.environ.get('RENDER_CACHE_ACCEL_PREFIX', '/protected-renders/')
+
+# Resumable chunked uploads, see UploadSessionViewset
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', os.path.join(BASE_DIR, 'upload_sessions'))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 100 * 1024 * 1024))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get('UPLOAD_CHUNK_MAX_SIZE', 8 * 1024 * 1024))
+# seconds after which an unfinished upload session expires, reaped by `manage.py reap_uploads`
+UPLOAD_SESSION_MAX_AGE = int(os.environ.get('UPLOAD_SESSION_MAX_AGE', 24 * 60 * 60))
+# unexpired upload sessions a user can have open at once
+UPLOAD_SESSION_MAX_OPEN = int(os.environ.get('UPLOAD_SESSION_MAX_OPEN', 10))
+
+# Maximum number of files or ids per bulk upload/delete request
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 100))
+
+# Hand-off of the file transfers of /images/<id>/file/ to the front server, see image_hosting/media.py
+# '' streams from Django, 'nginx' uses X-Accel-Redirect, 'sendfile' uses X-Sendfile
+MEDIA_ACCEL_BACKEND = os.environ.get('MEDIA_ACCEL_BACKEND', '')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Keys signing the expiring links by key id, see image_hosting/links.py
+# EXPIRING_LINK_KEYS="<id>:<secret>,<id>:<secret>"; new links are signed with EXPIRING_LINK_KEY_ID,
+# links signed with the other keys stay valid until they expire, so a retired key can be removed afterwards.
+EXPIRING_LINK_KEYS = dict(key.split(':', 1) for key in os.environ['EXPIRING_LINK_KEYS'].split(',')) \
+    if os.environ.get('EXPIRING_LINK_KEYS') else {'default': SECRET_KEY}
+EXPIRING_LINK_KEY_ID = os.environ.get('EXPIRING_LINK_KEY_ID') or next(iter(EXPIRING_LINK_KEYS))
+
+# Cache of the authentication, the image payloads and the expiring links, see image_hosting/caching.py
+# In-process LRU by default (LocMemCache evicts the least recently used entries); set REDIS_URL when running
+# several processes, so every process sees the invalidations (otherwise they may serve stale entries for CACHE_TIMEOUT).
+# The local rendition workers of ProcessPoolBackend need none: the web process invalidates their files itself.
+CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', 60))
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'TIMEOUT': CACHE_TIMEOUT,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': CACHE_TIMEOUT,
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
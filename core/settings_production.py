@@ -0,0 +1,45 @@
+"""
+Production profile, selected with DJANGO_SETTINGS_MODULE=core.settings_production.
+
+Everything that differs per deployment comes from the environment; see core/settings.py for the rest
+and gunicorn.conf.py for the server.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+# Keys of the expiring links, as in settings.py, whose default is its development SECRET_KEY, which is public:
+# without EXPIRING_LINK_KEYS the links are signed with the production secret
+EXPIRING_LINK_KEYS = dict(key.split(':', 1) for key in os.environ['EXPIRING_LINK_KEYS'].split(',')) \
+    if os.environ.get('EXPIRING_LINK_KEYS') else {'default': SECRET_KEY}
+EXPIRING_LINK_KEY_ID = os.environ.get('EXPIRING_LINK_KEY_ID') or next(iter(EXPIRING_LINK_KEYS))
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+# behind a proxy terminating TLS (nginx, a load balancer)
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+STATIC_ROOT = os.environ.get('STATIC_ROOT', '/code/static')
+
+# Persistent connections: each worker thread keeps its connection for DB_CONN_MAX_AGE seconds and checks it
+# before reusing it after a request, so a restarted database only costs a reconnect.
+# Through pgbouncer (DB_POOLER=pgbouncer) the pooler holds the server connections instead.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('DJANGO_LOG_LEVEL', 'INFO'),
+    },
+}
@@ -0,0 +1,30 @@
+"""
+Gunicorn configuration of the production server, driven by the environment:
+
+    gunicorn -c gunicorn.conf.py core.wsgi:application
+
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker with core.asgi:application serves the async views
+(see image_hosting/async_views.py) instead; use DB_CONN_MAX_AGE=0 with it, since Django does not reuse
+connections across ASGI requests, and pool them with pgbouncer.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# processes x threads is the number of requests served at once, each thread holding its own
+# persistent database connection (or pgbouncer client connection)
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# recycle the workers now and then, staggered, to bound the growth of long-lived processes
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
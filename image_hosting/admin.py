@@ -1,7 +1,12 @@
 from django.contrib import admin
 
-from .models import UploadedFile, User, TempUrl
+from .models import UploadedFile, User, TempUrl, Tier, UploadSession, Blob, OrphanFile, StorageScan
 
 admin.site.register(User)
 admin.site.register(UploadedFile)
 admin.site.register(TempUrl)
+admin.site.register(Tier)
+admin.site.register(UploadSession)
+admin.site.register(Blob)
+admin.site.register(OrphanFile)
+admin.site.register(StorageScan)
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ImageHostingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'image_hosting'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Pillow warns above this many pixels and refuses to open images of twice as many
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,326 @@
+"""
+Async-native (ASGI) versions of the image and expiring link endpoints, mounted under /async/.
+
+Served by an ASGI server (e.g. `uvicorn core.asgi:application`), a request only holds a thread while it
+runs a query or touches the storage: the upload body is received by the event loop, multipart parsing,
+hashing and image validation run on the default thread pool, and the queries use Django's async ORM.
+A slow upload or download therefore costs a coroutine instead of a worker thread.
+
+The responses are the same as those of the DRF views in views.py, which they share their helpers with.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import Http404, HttpResponseNotAllowed, HttpResponseNotModified, HttpResponseRedirect, JsonResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, ValidationError
+from rest_framework.request import Request
+
+from . import caching
+from .blobs import hash_file, store_blob
+from .links import SCOPE_DETAIL, SCOPE_FILE, SCOPES, ExpiredLink, InvalidLink, RevokedLink, aresolve_link, create_link
+from .media import AsyncFileResponse, not_modified, serve_file
+from .metadata import read_metadata
+from .models import UploadedFile
+from .pagination import UploadedFileCursorPagination
+from .renditions import enqueue_renditions, negotiate_rendition
+from .serializers import ExpiringLinkSerializer, FileSerializer, validate_file_name, validate_image_file, validate_image_format, validate_image_limits
+from .tiers import aget_tier
+from .views import TempUrlViewset, conditional_response, filter_images, library_etag, payload_variant, rendition_etag
+
+
+def error(message, status_code):
+    return JsonResponse({"error": message}, status=status_code)
+
+
+async def authenticate(request):
+    """
+    The user of the `Authorization: Token <key>` header, read from the cache like CachedTokenAuthentication.
+    Raises AuthenticationFailed, or NotAuthenticated without the header.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        raise NotAuthenticated()
+    if len(auth) != 2:
+        raise AuthenticationFailed('Invalid token header.')
+
+    key = auth[1]
+    user = await caching.aget_token_user(key)
+    if user is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        user = token.user
+        if user.is_active:
+            await caching.aset_token_user(key, user)
+    if not user.is_active:
+        raise AuthenticationFailed('User inactive or deleted.')
+    return user
+
+
+def token_authenticated(*methods):
+    """
+    Decorates an async view: restricts it to the given methods and authenticates the user (request.user),
+    and turns the DRF exceptions and Http404 into the JSON responses of the DRF views.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            try:
+                request.user = await authenticate(request)
+                await aget_tier(request.user.tier)
+                return await view(request, *args, **kwargs)
+            except APIException as e:
+                response = JsonResponse({"detail": e.detail}, status=e.status_code)
+                if e.status_code == status.HTTP_401_UNAUTHORIZED:
+                    response['WWW-Authenticate'] = 'Token'
+                return response
+            except (Http404, ObjectDoesNotExist):
+                return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # token authentication, like the DRF views
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def drf_request(request):
+    """
+    DRF request around the Django request, for the serializers and the paginator.
+    """
+    wrapped = Request(request)
+    wrapped.user = request.user
+    return wrapped
+
+
+@token_authenticated('GET', 'POST')
+async def images(request):
+    if request.method == 'POST':
+        return await upload(request)
+    return await image_list(request)
+
+
+async def image_list(request):
+    """
+    Async version of UploadedFileViewset.list.
+    """
+    etag = library_etag(request)
+    if not_modified(request, etag):
+        return conditional_response(request, HttpResponseNotModified(), etag)
+
+    wrapped = drf_request(request)
+    queryset = UploadedFile.objects.filter(created_by__id=request.user.id).select_related('created_by')
+    try:
+        queryset = filter_images(queryset, request.GET)
+    except ValueError as e:
+        return error(str(e), status.HTTP_400_BAD_REQUEST)
+    paginator = UploadedFileCursorPagination()
+    page = await paginator.apaginate_queryset(queryset, wrapped)
+
+    variants = {image.pk: payload_variant(request, image.last_edited) for image in page}
+    payloads = await caching.aget_payloads(variants)
+    missing = [image for image in page if image.pk not in payloads]
+    if missing:
+        serializer = FileSerializer(missing, context={"request": wrapped}, many=True)
+        rendered = {image.pk: dict(data) for image, data in zip(missing, serializer.data)}
+        await caching.aset_payloads({pk: (variants[pk], data) for pk, data in rendered.items()})
+        payloads.update(rendered)
+
+    body = {'next': paginator.get_next_link(), 'results': [payloads[image.pk] for image in page]}
+    return conditional_response(request, JsonResponse(body), etag)
+
+
+def _validate_upload(new_file):
+    """
+    Validates the name and the image like FileSerializer does in UploadedFileViewset.post, raising a ValidationError
+    with the errors of each field. Returns the SHA-256 of the file.
+    """
+    errors = {}
+    for field, validate, value in (('name', validate_file_name, new_file.name), ('image_url', validate_image_file, new_file)):
+        try:
+            validate(value)
+        except ValidationError as e:
+            errors[field] = e.detail
+    if errors:
+        raise ValidationError(errors)
+    return hash_file(new_file)
+
+
+def _create_file(user, new_file, file_format, sha256):
+    with transaction.atomic():
+        blob = store_blob(new_file, file_format, sha256=sha256)
+        instance = UploadedFile.objects.create(name=new_file.name, created_by=user, file_format=file_format,
+                                               blob=blob, image_url=blob.name, **read_metadata(new_file, sha256))
+    enqueue_renditions(instance)
+    return instance
+
+
+async def upload(request):
+    """
+    Async version of UploadedFileViewset.post.
+    The body was already received by the event loop; parsing, validating and hashing the upload run
+    on the thread pool, storing it in the thread of the ORM since it happens under the blob's row lock.
+    """
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    new_file = files.get('new_file')
+    if new_file is None:
+        return error("No file was submitted as 'new_file'", status.HTTP_400_BAD_REQUEST)
+
+    try:
+        file_format = validate_image_format(new_file.content_type)
+    except Exception as e:
+        return error(str(e), status.HTTP_400_BAD_REQUEST)
+
+    tier = await aget_tier(request.user.tier)
+    try:
+        file_format = await sync_to_async(validate_image_limits, thread_sensitive=False)(new_file, tier)
+    except ValidationError as e:
+        return error(e.detail[0], status.HTTP_400_BAD_REQUEST)
+
+    try:
+        sha256 = await sync_to_async(_validate_upload, thread_sensitive=False)(new_file)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+    instance = await sync_to_async(_create_file)(request.user, new_file, file_format, sha256)
+    serializer = FileSerializer(instance, context={"request": drf_request(request)})
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@token_authenticated('GET')
+async def image_detail(request, pk):
+    """
+    Async version of UploadedFileViewset.retrieve.
+    """
+    queryset = UploadedFile.objects.filter(pk=pk, created_by__id=request.user.id)
+    last_edited = await queryset.values_list('last_edited', flat=True).aget()
+    etag = library_etag(request, pk, last_edited)
+    if not_modified(request, etag):
+        return conditional_response(request, HttpResponseNotModified(), etag)
+
+    variant = payload_variant(request, last_edited)
+    payload = (await caching.aget_payloads({pk: variant})).get(pk)
+    if payload is None:
+        image_instance = await queryset.select_related('created_by').aget()
+        payload = dict(FileSerializer(image_instance, context={"request": drf_request(request)}).data)
+        await caching.aset_payloads({pk: (variant, payload)})
+
+    return conditional_response(request, JsonResponse(payload), etag)
+
+
+@token_authenticated('GET')
+async def image_file(request, pk):
+    """
+    Async version of UploadedFileViewset.download.
+    The storage is queried on the thread pool; the file itself is handed off to the front server or streamed
+    as an AsyncFileResponse, whose chunks are read on the thread pool and sent by the event loop
+    (see core.asgi.ASGIHandler), so a slow download holds a thread only while a chunk is read.
+    """
+    tier = await aget_tier(request.user.tier)
+    token = request.GET.get('token')
+    queryset = UploadedFile.objects.select_related('blob')
+    if token:
+        if not tier.expiring_link:
+            return error("Given account tier does not support this feature", status.HTTP_403_FORBIDDEN)
+        link, response = await link_or_error(token)
+        if response is not None:
+            return response
+        if link.scope != SCOPE_FILE:
+            return error("This url does not give access to the file", status.HTTP_403_FORBIDDEN)
+        if link.file_id != pk:
+            raise Http404
+        image_instance = await queryset.aget(pk=pk)
+    else:
+        image_instance = await queryset.aget(pk=pk, created_by__id=request.user.id)
+
+    storage = image_instance.image_url.storage
+    size = request.GET.get('size')
+    if size is None:
+        if not tier.original_link and not token:
+            return error("Given account tier does not support this feature", status.HTTP_403_FORBIDDEN)
+        name = image_instance.image_url.name
+        if image_instance.blob is not None:
+            etag = image_instance.blob.sha256
+        else:
+            size_bytes = await sync_to_async(storage.size, thread_sensitive=False)(name)
+            modified = await sync_to_async(storage.get_modified_time, thread_sensitive=False)(name)
+            etag = f"{size_bytes:x}-{int(modified.timestamp()):x}"
+    else:
+        if not size.isdigit() or int(size) not in tier.thumbnail_sizes:
+            return error(f"Thumbnail size {size} is not available for the account tier", status.HTTP_403_FORBIDDEN)
+        rendition = image_instance.renditions.get(size)
+        if rendition is None:
+            return error("Thumbnail not rendered yet", status.HTTP_404_NOT_FOUND)
+        rendition = negotiate_rendition(rendition, request.META.get('HTTP_ACCEPT'))
+        name = rendition['name']
+        etag = rendition_etag(rendition)
+
+    response = await sync_to_async(serve_file, thread_sensitive=False)(request, storage, name, etag,
+                                                                      file_response=AsyncFileResponse)
+    if size is not None:
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+async def link_or_error(token):
+    """
+    Like views.get_link: the link of the token, or the error response. Needs no query for signed links.
+    """
+    try:
+        return await aresolve_link(token), None
+    except ExpiredLink:
+        return None, error("This url has expired", status.HTTP_403_FORBIDDEN)
+    except RevokedLink:
+        return None, error("This url has been revoked", status.HTTP_403_FORBIDDEN)
+    except InvalidLink:
+        raise Http404
+
+
+@token_authenticated('GET')
+async def generate_link(request, file_id):
+    """
+    Async version of TempUrlViewset.generate_link.
+    """
+    if not (await aget_tier(request.user.tier)).expiring_link:
+        return error("Given account tier does not support this feature", status.HTTP_403_FORBIDDEN)
+    if not await UploadedFile.objects.filter(pk=file_id, created_by_id=request.user.id).aexists():
+        raise Http404
+
+    link_time = int(request.GET.get('time', 300))
+    if link_time < TempUrlViewset.min_duration or link_time > TempUrlViewset.max_duration:
+        return error(f"Time requested: {link_time}. Allowed range: {TempUrlViewset.min_duration}-{TempUrlViewset.max_duration}",
+                     status.HTTP_400_BAD_REQUEST)
+
+    scope = request.GET.get('scope', SCOPE_DETAIL)
+    if scope not in SCOPES:
+        return error(f"Invalid scope: {scope}. Allowed: {', '.join(SCOPES)}", status.HTTP_400_BAD_REQUEST)
+
+    link, token = create_link(file_id, link_time, scope=scope)
+    serializer = ExpiringLinkSerializer({'id': link.id, 'token': token, 'expiry_date': link.expiry_date},
+                                        context={"request": request})
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@token_authenticated('GET')
+async def use_link(request, token):
+    """
+    Async version of TempUrlViewset.use. Legacy (TempUrl) tokens are resolved in the thread of the ORM.
+    """
+    if not (await aget_tier(request.user.tier)).expiring_link:
+        return error("Given account tier does not support this feature", status.HTTP_403_FORBIDDEN)
+
+    link, response = await link_or_error(token)
+    if response is not None:
+        return response
+
+    if link.scope == SCOPE_FILE:
+        return HttpResponseRedirect(f"{reverse('async_image_file', args=[link.file_id])}?token={token}")
+    return HttpResponseRedirect(reverse('async_image_detail', args=[link.file_id]))
@@ -0,0 +1,20 @@
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import caching
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication reading the token and its user from the cache, see caching.py.
+    Deleted tokens and changed or deleted users are dropped from the cache by signals.
+    """
+
+    def authenticate_credentials(self, key):
+        user = caching.get_token_user(key)
+        if user is not None:
+            return user, Token(key=key, user=user)
+
+        user, token = super().authenticate_credentials(key)
+        caching.set_token_user(key, user)
+        return user, token
@@ -0,0 +1,130 @@
+"""
+Content-addressed storage of the uploaded originals.
+
+Every distinct content is stored once, under a name derived from its SHA-256, and shared by all the
+UploadedFiles with the same bytes. Blob.ref_count tracks how many files use it; when the last one is
+deleted the original and its thumbnails are recorded as orphans, removed from the storage by the collector
+(see orphans.py).
+"""
+import hashlib
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import caching
+from .models import Blob, TempUrl, UploadedFile, User
+from .orphans import record_orphans
+from .renditions import rendition_names
+
+storage = UploadedFile._meta.get_field('image_url').storage
+
+EXTENSIONS = {
+    UploadedFile.ValidFileFormat.PNG: '.png',
+    UploadedFile.ValidFileFormat.JPEG: '.jpg',
+    UploadedFile.ValidFileFormat.WEBP: '.webp',
+}
+
+
+def hash_file(file):
+    """
+    SHA-256 of the file, read chunk by chunk.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, file_format):
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{EXTENSIONS.get(file_format, '')}"
+
+
+def _add_reference(sha256):
+    """
+    Locks the blob with the given SHA-256 and takes a reference to it. None if there is no such blob.
+    """
+    blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+    if blob is not None:
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        blob.refresh_from_db()
+    return blob
+
+
+def store_blob(file, file_format, sha256=None):
+    """
+    Returns the blob holding the content of the given file, storing the content only if it is new,
+    and takes a reference to it. `sha256` skips hashing the file again when the caller already did.
+    """
+    sha256 = sha256 or hash_file(file)
+    with transaction.atomic():
+        blob = _add_reference(sha256)
+        if blob is not None:
+            return blob
+
+        # a concurrent upload of the same bytes may insert the row first: the unique sha256 makes this insert
+        # wait for its transaction, then fail if it committed, and this upload references its blob instead
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.create(sha256=sha256, name=blob_name(sha256, file_format), size=file.size, ref_count=1)
+        except IntegrityError:
+            return _add_reference(sha256)
+
+        # only the upload that created the row writes the file
+        name = storage.save(blob.name, file)
+        if name != blob.name:
+            Blob.objects.filter(pk=blob.pk).update(name=name)
+            blob.name = name
+        return blob
+
+
+def release_blob(blob_id, rendition_names=(), references=1):
+    """
+    Drops references to the blob. The last reference deletes the blob and records its original and the given
+    thumbnail files as orphans.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > references:
+            Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - references)
+            return
+        blob.delete()
+        record_orphans([blob.name, *rendition_names])
+
+
+def delete_uploaded_files(queryset):
+    """
+    Deletes the uploaded files of the queryset and their legacy links (TempUrl) with one DELETE ... RETURNING
+    per table, instead of fetching the files and cascading through them one by one. Then does what the
+    post_delete signals would: invalidates the cached payloads, links and ETags, and releases the blobs (files
+    uploaded before the blobs leave their own files as orphans).
+    Returns the ids of the deleted files.
+    """
+    with transaction.atomic():
+        tokens = TempUrl.objects.filter(related_file__in=queryset.values('pk')).delete_returning('token')
+        rows = queryset.delete_returning('id', 'created_by_id', 'blob_id', 'image_url', 'renditions')
+
+        # files sharing a blob release it at once
+        references, names, orphans = Counter(), defaultdict(set), []
+        for _, _, blob_id, image_url, renditions in rows:
+            if blob_id is not None:
+                references[blob_id] += 1
+                names[blob_id].update(rendition_names(renditions))
+            else:
+                orphans.extend([image_url, *rendition_names(renditions)])
+        for blob_id, count in references.items():
+            release_blob(blob_id, sorted(names[blob_id]), count)
+        record_orphans(orphans)
+
+        for token, in tokens:
+            caching.invalidate_link(token)
+        for file_id, *_ in rows:
+            caching.invalidate_payload(file_id)
+        for user_id in {user_id for _, user_id, *_ in rows}:
+            User.bump_library_version(user_id)
+    return [file_id for file_id, *_ in rows]
+
@@ -0,0 +1,112 @@
+"""
+Caching of the hot read paths in the Django cache (`settings.CACHES`): an in-process LRU by default,
+Redis when `REDIS_URL` is set.
+
+- token authentication: token -> user id and user id -> user, so authenticated requests need no query
+  (see authentication.py);
+- the serialized payload of each uploaded file, for the variant (last edit, tier, ...) it was rendered for;
+- the lookups of the legacy expiring links (see links.py).
+
+Entries are deleted write-through by the model signals (see signals.py) and by the queryset updates
+that bypass them (User.bump_library_version, the rendition status updates).
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _delete(key):
+    # again once the transaction commits, in case a concurrent request cached the old rows meanwhile
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def token_key(key):
+    # the raw token never becomes part of a cache key
+    return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def payload_key(file_id):
+    return f'file-payload:{file_id}'
+
+
+def link_key(token):
+    return f'legacy-link:{hashlib.sha256(token.encode()).hexdigest()}'
+
+
+def get_token_user(key):
+    """
+    The cached user authenticated by the token key, None if either entry is missing.
+    """
+    user_id = cache.get(token_key(key))
+    if user_id is None:
+        return None
+    return cache.get(user_key(user_id))
+
+
+def set_token_user(key, user):
+    cache.set_many({token_key(key): user.pk, user_key(user.pk): user})
+
+
+async def aget_token_user(key):
+    user_id = await cache.aget(token_key(key))
+    if user_id is None:
+        return None
+    return await cache.aget(user_key(user_id))
+
+
+async def aset_token_user(key, user):
+    await cache.aset_many({token_key(key): user.pk, user_key(user.pk): user})
+
+
+def invalidate_user(user_id):
+    _delete(user_key(user_id))
+
+
+def invalidate_token(key):
+    _delete(token_key(key))
+
+
+def _select_payloads(variants, cached):
+    payloads = {}
+    for file_id, variant in variants.items():
+        entry = cached.get(payload_key(file_id))
+        if entry is not None and entry[0] == variant:
+            payloads[file_id] = entry[1]
+    return payloads
+
+
+def get_payloads(variants):
+    """
+    Cached payloads of the files in the {file id: variant} mapping, {file id: payload} for the hits.
+    Only the last variant of each file is kept, a payload cached for another variant is a miss.
+    """
+    return _select_payloads(variants, cache.get_many([payload_key(file_id) for file_id in variants]))
+
+
+async def aget_payloads(variants):
+    return _select_payloads(variants, await cache.aget_many([payload_key(file_id) for file_id in variants]))
+
+
+def set_payloads(payloads):
+    """
+    Caches the {file id: (variant, payload)} mapping.
+    """
+    cache.set_many({payload_key(file_id): entry for file_id, entry in payloads.items()})
+
+
+async def aset_payloads(payloads):
+    await cache.aset_many({payload_key(file_id): entry for file_id, entry in payloads.items()})
+
+
+def invalidate_payload(file_id):
+    _delete(payload_key(file_id))
+
+
+def invalidate_link(token):
+    _delete(link_key(token))
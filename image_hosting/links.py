@@ -0,0 +1,133 @@
+"""
+Stateless expiring links.
+
+A link token carries the file id, the expiry, the scope of the link and a random link id, signed with
+HMAC (django.core.signing) by one of `settings.EXPIRING_LINK_KEYS`. The token starts with the id of the key
+that signed it, so keys can be rotated: new links are signed with `settings.EXPIRING_LINK_KEY_ID` and links
+signed with any other configured key stay valid until they expire.
+Resolving a link needs no database access; revoked links are kept in the cache until they expire.
+
+Tokens of the former TempUrl table (no key id) are still resolved from the database (then the cache)
+until they expire.
+"""
+import datetime
+import secrets
+import time
+from collections import namedtuple
+
+import pytz
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from .caching import link_key
+from .models import TempUrl
+
+SCOPE_DETAIL = 'detail'
+SCOPE_FILE = 'file'
+SCOPES = (SCOPE_DETAIL, SCOPE_FILE)
+
+Link = namedtuple('Link', ['id', 'file_id', 'scope', 'expiry_date'])
+
+
+class InvalidLink(Exception):
+    pass
+
+
+class ExpiredLink(InvalidLink):
+    pass
+
+
+class RevokedLink(InvalidLink):
+    pass
+
+
+def _signer(key_id):
+    return signing.Signer(key=settings.EXPIRING_LINK_KEYS[key_id], salt=f'image_hosting.links.{key_id}', sep='.')
+
+
+def create_link(file_id, seconds, scope=SCOPE_DETAIL):
+    """
+    Returns the Link and the token of a new link to the file, valid for the given number of seconds.
+    """
+    expires = int(time.time()) + seconds
+    link_id = secrets.token_urlsafe(8)
+    key_id = settings.EXPIRING_LINK_KEY_ID
+    token = _signer(key_id).sign_object({'f': file_id, 'e': expires, 's': scope, 'n': link_id})
+    link = Link(link_id, file_id, scope, datetime.datetime.fromtimestamp(expires, tz=pytz.utc))
+    return link, f'{key_id}.{token}'
+
+
+def resolve_link(token):
+    """
+    Returns the Link of a token, or raises InvalidLink (or its subclasses ExpiredLink and RevokedLink).
+    """
+    if not is_signed(token):
+        return _resolve_legacy_link(token)
+    link = _verify(token)
+    if cache.get(_revocation_key(link.id)):
+        raise RevokedLink(token)
+    return link
+
+
+async def aresolve_link(token):
+    """
+    Async version of resolve_link: the legacy tokens are resolved in the thread of the ORM and the
+    revocation list is read with the async cache API, so the event loop is never blocked.
+    """
+    if not is_signed(token):
+        return await sync_to_async(_resolve_legacy_link)(token)
+    link = _verify(token)
+    if await cache.aget(_revocation_key(link.id)):
+        raise RevokedLink(token)
+    return link
+
+
+def is_signed(token):
+    """
+    Whether the token is a signed link, the others being tokens of the former TempUrl table.
+    """
+    return '.' in token
+
+
+def _verify(token):
+    key_id, _, signed = token.partition('.')
+    if key_id not in settings.EXPIRING_LINK_KEYS:
+        raise InvalidLink(token)
+
+    try:
+        payload = _signer(key_id).unsign_object(signed)
+    except signing.BadSignature:
+        raise InvalidLink(token)
+
+    if payload['e'] < time.time():
+        raise ExpiredLink(token)
+    return Link(payload['n'], payload['f'], payload['s'], datetime.datetime.fromtimestamp(payload['e'], tz=pytz.utc))
+
+
+def revoke_link(link):
+    """
+    Adds the link to the revocation list until it expires.
+    """
+    remaining = (link.expiry_date - datetime.datetime.now(tz=pytz.utc)).total_seconds()
+    if remaining > 0:
+        cache.set(_revocation_key(link.id), True, timeout=int(remaining) + 1)
+
+
+def _revocation_key(link_id):
+    return f'expiring-link-revoked:{link_id}'
+
+
+def _resolve_legacy_link(token):
+    link = cache.get(link_key(token))
+    if link is None:
+        temp_url = TempUrl.objects.filter(token=token).first()
+        if temp_url is None:
+            raise InvalidLink(token)
+        link = Link(f'legacy-{temp_url.pk}', temp_url.related_file_id, SCOPE_DETAIL, temp_url.expiry_date)
+        cache.set(link_key(token), link)
+
+    if datetime.datetime.now().replace(tzinfo=pytz.utc) > link.expiry_date:
+        raise ExpiredLink(token)
+    return link
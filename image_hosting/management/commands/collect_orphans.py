@@ -0,0 +1,67 @@
+import datetime
+import logging
+import time
+
+import pytz
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from image_hosting import orphans
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Deletes from the storage the files left without references for longer than the grace period, "
+            "in bounded batches, and reports the bytes reclaimed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=settings.STORAGE_GC_GRACE,
+                            help="Seconds a file stays orphaned before it is deleted.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between batches.")
+        parser.add_argument('--reconcile', action='store_true',
+                            help="First scan the storage for files the database does not reference, resuming the last scan.")
+        parser.add_argument('--scan-limit', type=int, default=10000, help="Files checked per run by --reconcile.")
+        parser.add_argument('--loop', action='store_true', help="Keep collecting as files are orphaned.")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds to sleep between runs.")
+
+    def reconcile(self, limit):
+        scan = orphans.reconcile(limit)
+        logger.info("Reconciled the storage", extra={'scan': scan.pk, 'files_scanned': scan.scanned,
+                                                     'files_orphaned': scan.orphaned, 'finished': bool(scan.finished_at)})
+        self.stdout.write(
+            f"Scan {scan.pk}: {scan.scanned} file(s) checked, {scan.orphaned} orphaned, "
+            + ("finished" if scan.finished_at else f"resumes after {scan.cursor}"))
+
+    def collect(self, grace, batch_size, pause):
+        # the orphans claimed or left by this pass are orphaned after it started, so it goes through each at most once
+        started = datetime.datetime.now(tz=pytz.utc)
+        claimed = deleted = reclaimed = failed = batches = 0
+        while True:
+            rows, files, size, failures = orphans.collect(grace, batch_size, now=started)
+            if not rows:
+                break
+            claimed += rows
+            deleted += files
+            reclaimed += size
+            failed += failures
+            batches += 1
+            if rows < batch_size:
+                break
+            time.sleep(pause)
+
+        logger.info("Collected orphaned files", extra={'orphans_claimed': claimed, 'files_deleted': deleted,
+                                                       'bytes_reclaimed': reclaimed, 'failures': failed, 'batches': batches})
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} orphaned file(s) in {batches} batch(es), reclaimed {reclaimed} bytes "
+            f"({reclaimed / 1024 / 1024:.1f} MB), {failed} failed"))
+
+    def handle(self, *args, **options):
+        while True:
+            if options['reconcile']:
+                self.reconcile(options['scan_limit'])
+            self.collect(options['grace'], options['batch_size'], options['pause'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from image_hosting import caching
+from image_hosting.blobs import hash_file
+from image_hosting.metadata import read_metadata
+from image_hosting.models import UploadedFile, User
+
+FIELDS = ['width', 'height', 'orientation', 'color_mode', 'file_size', 'sha256']
+
+
+class Command(BaseCommand):
+    help = "Reads the metadata of the uploaded files uploaded before it was extracted at upload time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        updated = failed = 0
+        last_id = 0
+        while True:
+            batch = list(UploadedFile.objects.filter(width__isnull=True, id__gt=last_id)
+                         .select_related('blob').order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            changed = []
+            for instance in batch:
+                try:
+                    with instance.image_url.open('rb') as file:
+                        sha256 = instance.blob.sha256 if instance.blob is not None else hash_file(file)
+                        metadata = read_metadata(file, sha256)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"file {instance.id}: {e}")
+                    continue
+                for field, value in metadata.items():
+                    setattr(instance, field, value)
+                changed.append(instance)
+            UploadedFile.objects.bulk_update(changed, FIELDS)
+            # bulk_update sends no post_save signals
+            for instance in changed:
+                caching.invalidate_payload(instance.pk)
+            for user_id in {instance.created_by_id for instance in changed}:
+                User.bump_library_version(user_id)
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Extracted the metadata of {updated} file(s), {failed} failed"))
@@ -0,0 +1,66 @@
+import datetime
+import logging
+import time
+
+import pytz
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from image_hosting.models import TempUrl
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired temporary urls in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between batches.")
+        parser.add_argument('--loop', action='store_true', help="Keep reaping as links expire.")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds to sleep between runs.")
+
+    def reap_batch(self, batch_size):
+        """
+        Deletes one batch of expired links in its own short transaction.
+        Rows locked by another instance are skipped. Returns the number of rows deleted and the
+        seconds the transaction held its locks.
+        """
+        now = datetime.datetime.now(tz=pytz.utc)
+        started = time.monotonic()
+        with transaction.atomic():
+            ids = list(TempUrl.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(expiry_date__lt=now)
+                       .order_by('expiry_date')
+                       .values_list('id', flat=True)[:batch_size])
+            deleted, _ = TempUrl.objects.filter(id__in=ids).delete()
+        return deleted, time.monotonic() - started
+
+    def reap(self, batch_size, pause):
+        reaped = batches = 0
+        lock_time = max_lock_time = 0.0
+        while True:
+            deleted, seconds = self.reap_batch(batch_size)
+            if not deleted:
+                break
+            reaped += deleted
+            batches += 1
+            lock_time += seconds
+            max_lock_time = max(max_lock_time, seconds)
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+
+        logger.info("Reaped expired links", extra={'rows_reaped': reaped, 'batches': batches,
+                                                   'lock_time': lock_time, 'max_lock_time': max_lock_time})
+        self.stdout.write(self.style.SUCCESS(
+            f"Reaped {reaped} expired link(s) in {batches} batch(es), "
+            f"lock time {lock_time * 1000:.1f} ms (max {max_lock_time * 1000:.1f} ms per batch)"))
+
+    def handle(self, *args, **options):
+        while True:
+            self.reap(options['batch_size'], options['pause'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,96 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from image_hosting.models import UploadSession
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Deletes the expired upload sessions with their staged bytes in bounded batches, "
+            "and the staged files left without a session.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between batches.")
+        parser.add_argument('--loop', action='store_true', help="Keep reaping as uploads expire.")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds to sleep between runs.")
+
+    def remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def reap_batch(self, batch_size):
+        """
+        Deletes one batch of expired sessions in its own short transaction, then their staged files.
+        Rows locked by another instance are skipped. Returns the number of sessions and bytes deleted.
+        """
+        with transaction.atomic():
+            sessions = list(UploadSession.objects
+                            .select_for_update(skip_locked=True)
+                            .filter(created__lt=UploadSession.expiry_cutoff())
+                            .order_by('created')[:batch_size])
+            UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+        return len(sessions), sum(self.remove(session.staging_path) for session in sessions)
+
+    def sweep(self):
+        """
+        Deletes the staged files older than the sessions can live whose session is gone, e.g. with its user.
+        Returns the number of files and bytes deleted.
+        """
+        try:
+            entries = [entry for entry in os.scandir(settings.UPLOAD_SESSION_DIR)
+                       if entry.name.endswith('.part') and entry.is_file()]
+        except FileNotFoundError:
+            return 0, 0
+        cutoff = UploadSession.expiry_cutoff().timestamp()
+        stale = {}
+        for entry in entries:
+            try:
+                session_id = UploadSession._meta.pk.to_python(entry.name[:-len('.part')])
+            except ValidationError:
+                # not staged by a session, left alone
+                continue
+            if entry.stat().st_mtime < cutoff:
+                stale[session_id] = entry.path
+        live = set(UploadSession.objects.filter(pk__in=stale).values_list('pk', flat=True))
+        removed = [self.remove(path) for session_id, path in stale.items() if session_id not in live]
+        return len(removed), sum(removed)
+
+    def reap(self, batch_size, pause):
+        reaped = batches = reclaimed = 0
+        while True:
+            deleted, size = self.reap_batch(batch_size)
+            if not deleted:
+                break
+            reaped += deleted
+            reclaimed += size
+            batches += 1
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+        strays, size = self.sweep()
+        reclaimed += size
+
+        logger.info("Reaped expired upload sessions", extra={'sessions_reaped': reaped, 'batches': batches,
+                                                             'stray_files': strays, 'bytes_reclaimed': reclaimed})
+        self.stdout.write(self.style.SUCCESS(
+            f"Reaped {reaped} expired upload session(s) in {batches} batch(es) and {strays} stray file(s), "
+            f"reclaimed {reclaimed} bytes ({reclaimed / 1024 / 1024:.1f} MB)"))
+
+    def handle(self, *args, **options):
+        while True:
+            self.reap(options['batch_size'], options['pause'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
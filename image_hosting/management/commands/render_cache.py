@@ -0,0 +1,31 @@
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from image_hosting import render_cache
+
+
+class Command(BaseCommand):
+    help = "Reports the hit/miss metrics and the size of the cache of on-the-fly renders, or sweeps or clears it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweep', action='store_true', help="Evict the least recently used renders over the bound.")
+        parser.add_argument('--clear', action='store_true', help="Delete every render.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            shutil.rmtree(settings.RENDER_CACHE_DIR, ignore_errors=True)
+        elif options['sweep']:
+            render_cache.sweep()
+
+        entries = render_cache.scan(settings.RENDER_CACHE_DIR)
+        metrics = render_cache.metrics()
+        requests = metrics['hits'] + metrics['misses'] + metrics['coalesced']
+        hit_ratio = (metrics['hits'] + metrics['coalesced']) / requests if requests else 0.0
+        self.stdout.write(
+            f"{len(entries)} renders, {sum(size for _, size, _ in entries)} of {settings.RENDER_CACHE_MAX_BYTES} bytes\n"
+            f"hits {metrics['hits']}, misses {metrics['misses']}, coalesced {metrics['coalesced']}, "
+            f"hit ratio {hit_ratio:.1%}\n"
+            f"evictions {metrics['evictions']} ({metrics['evicted_bytes']} bytes)"
+        )
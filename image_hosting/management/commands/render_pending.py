@@ -0,0 +1,86 @@
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from image_hosting import workers
+from image_hosting.models import UploadedFile
+from image_hosting.renditions import RENDER_TASK, claim, mark_failed, requeue_stale, start_workers
+
+
+class Command(BaseCommand):
+    help = "Renders the thumbnails of all the uploaded files that are still pending."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new uploads.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep between polls.")
+        parser.add_argument('--workers', type=int, default=0,
+                            help="Render on this many worker processes, each under the memory and time budgets of "
+                                 "RENDITION_MEMORY_LIMIT and RENDITION_TIME_LIMIT (default: render in this process, "
+                                 "under the same budgets).")
+
+    def claim_batch(self, batch_size):
+        """
+        Marks a batch of pending files as processing. Locked rows are skipped, so several
+        instances of this command can share the queue. Files left processing by a killed worker
+        are put back in the queue first.
+        """
+        requeued, failed = requeue_stale(settings.RENDITION_CLAIM_TIMEOUT, settings.RENDITION_MAX_ATTEMPTS)
+        if requeued or failed:
+            self.stdout.write(f"{requeued} interrupted file(s) requeued, {failed} failed")
+        with transaction.atomic():
+            ids = list(UploadedFile.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(rendition_status=UploadedFile.RenditionStatus.PENDING)
+                       .order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            claim(ids)
+        return ids
+
+    def render_batch(self, ids, executor):
+        """
+        Renders the files, on the worker processes if any, otherwise in this process under the same budgets.
+        A file whose worker dies (e.g. killed by the OOM killer) is marked as failed, so it is not picked up again.
+        Returns whether the pool broke.
+        """
+        if executor is None:
+            with workers.budget(settings.RENDITION_MEMORY_LIMIT, settings.RENDITION_TIME_LIMIT):
+                for file_id in ids:
+                    self.stdout.write(f"file {file_id}: {workers.run(RENDER_TASK, file_id)}")
+            return False
+
+        futures = [(file_id, executor.submit(workers.run, RENDER_TASK, file_id)) for file_id in ids]
+        broken = False
+        for file_id, future in futures:
+            try:
+                status = future.result()
+            except BrokenProcessPool:
+                broken = True
+                mark_failed(file_id)
+                status = UploadedFile.RenditionStatus.FAILED
+            self.stdout.write(f"file {file_id}: {status}")
+        return broken
+
+    def handle(self, *args, **options):
+        executor = start_workers(options['workers']) if options['workers'] > 0 else None
+        rendered = 0
+        try:
+            while True:
+                ids = self.claim_batch(options['batch_size'])
+                if self.render_batch(ids, executor):
+                    executor.shutdown(wait=False)
+                    executor = start_workers(options['workers'])
+                rendered += len(ids)
+
+                if not ids:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} file(s)"))
@@ -0,0 +1,133 @@
+"""
+Serving of the stored images once the view has authorized the request.
+
+The bytes never go through Python when a front server is configured (`settings.MEDIA_ACCEL_BACKEND`):
+'nginx' hands the transfer off with X-Accel-Redirect to the internal location `settings.MEDIA_ACCEL_PREFIX`,
+'sendfile' with X-Sendfile (Apache mod_xsendfile, lighttpd), which needs the files on the local file system
+rather than in object storage (see object_storage.py). Otherwise a FileResponse streams the file,
+which WSGI servers with a sendfile-backed `wsgi.file_wrapper` (e.g. gunicorn) send with os.sendfile.
+The async views stream an AsyncFileResponse instead, whose reads run on the thread pool.
+Range requests (a single range), ETag and If-None-Match are honoured on every path.
+"""
+import mimetypes
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import parse_etags, quote_etag
+
+range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    File object limited to `length` bytes from its current position.
+    Keeps `fileno` so a sendfile-backed file wrapper can still send the range without copying.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class AsyncFileResponse(FileResponse):
+    """
+    FileResponse for the async views: core.asgi.ASGIHandler sends its chunks as they are read on the thread pool,
+    where Django 4.1 would iterate the file on the event loop, blocking it during every read of the disk or of
+    the object storage.
+    """
+
+    async def chunks(self):
+        read = sync_to_async(self.file_to_stream.read, thread_sensitive=False)
+        while chunk := await read(self.block_size):
+            yield chunk
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) of a single byte range request, None to serve the whole file
+    (no header or several ranges) and raises ValueError when the range cannot be satisfied.
+    """
+    match = range_pattern.match(header or '')
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range: the last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    return bool(if_none_match) and (if_none_match.strip() == '*' or quote_etag(etag) in parse_etags(if_none_match))
+
+
+def serve_file(request, storage, name, etag, accel_prefix=None, file_response=FileResponse):
+    """
+    Response sending the stored file with the given name. `accel_prefix` is the internal location
+    of the storage for nginx, MEDIA_ACCEL_PREFIX by default; `file_response` the class of the responses
+    streaming the file from Django (AsyncFileResponse in the async views).
+    """
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if not_modified(request, etag):
+        response = HttpResponse(status=304)
+        response['ETag'] = quote_etag(etag)
+        return response
+
+    backend = settings.MEDIA_ACCEL_BACKEND
+    if backend == 'nginx':
+        # nginx answers Range requests itself on internal redirects; the header is a URI, so the name is quoted
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (accel_prefix or settings.MEDIA_ACCEL_PREFIX) + filepath_to_uri(name)
+    elif backend == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = storage.path(name)
+    else:
+        response = _file_response(request, storage, name, content_type, file_response)
+
+    response['ETag'] = quote_etag(etag)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _file_response(request, storage, name, content_type, file_response):
+    size = storage.size(name)
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = storage.open(name, 'rb')
+    if byte_range is None:
+        return file_response(file, content_type=content_type)
+
+    start, end = byte_range
+    file.seek(start)
+    response = file_response(RangeFile(file, end - start + 1), status=206, content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
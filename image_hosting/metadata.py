@@ -0,0 +1,73 @@
+"""
+Metadata of the uploaded images, read at upload time from the header of the file.
+
+Pillow parses the header when an image is opened and only decodes the pixels when they are accessed,
+so the dimensions, color mode and EXIF orientation are known without decoding the image.
+They are stored in indexed columns of UploadedFile, so clients get them without downloading the original
+and the list can be filtered on them (see views.filter_images).
+"""
+from PIL import Image
+
+from .models import UploadedFile
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientations displayed rotated by 90 degrees, i.e. with the width and height swapped
+TRANSPOSED = {5, 6, 7, 8}
+
+
+def exif_orientation(image):
+    """
+    EXIF orientation of the opened image, 1 (as stored) when it has none. Only looks at the EXIF
+    found in the header: PNG files may keep it after the pixels, where it is ignored.
+    """
+    data = image.info.get('exif')
+    if not data:
+        return 1
+    exif = Image.Exif()
+    try:
+        exif.load(data)
+    except Exception:
+        # malformed EXIF does not make the image invalid
+        return 1
+    return exif.get(ORIENTATION_TAG, 1)
+
+
+def orientation_of(width, height):
+    if width > height:
+        return UploadedFile.Orientation.LANDSCAPE
+    if width < height:
+        return UploadedFile.Orientation.PORTRAIT
+    return UploadedFile.Orientation.SQUARE
+
+
+def read_dimensions(file):
+    """
+    (width, height) the header of the image in the file declares, as stored (before any EXIF rotation).
+    Like any Image.open, raises Image.DecompressionBombError beyond twice Image.MAX_IMAGE_PIXELS.
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        size = image.size
+    file.seek(0)
+    return size
+
+
+def read_metadata(file, sha256):
+    """
+    Metadata fields of UploadedFile for the image in the file, given the SHA-256 of its content.
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        color_mode = image.mode
+        if exif_orientation(image) in TRANSPOSED:
+            width, height = height, width
+    file.seek(0)
+    return {
+        'width': width,
+        'height': height,
+        'orientation': orientation_of(width, height),
+        'color_mode': color_mode,
+        'file_size': file.size,
+        'sha256': sha256,
+    }
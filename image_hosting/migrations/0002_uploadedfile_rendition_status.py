@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='rendition_status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Processing', 'Processing'), ('Ready', 'Ready'), ('Failed', 'Failed')], default='Pending', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='tempurl',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expiry_links', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:53
+
+from django.db import migrations, models
+import image_hosting.models
+
+
+BUILT_IN_TIERS = [
+    {'name': 'Basic', 'thumbnail_sizes': [200], 'original_link': False, 'expiring_link': False},
+    {'name': 'Premium', 'thumbnail_sizes': [200, 400], 'original_link': True, 'expiring_link': False},
+    {'name': 'Enterprise', 'thumbnail_sizes': [200, 400], 'original_link': True, 'expiring_link': True},
+]
+
+
+def create_built_in_tiers(apps, schema_editor):
+    Tier = apps.get_model('image_hosting', 'Tier')
+    for tier in BUILT_IN_TIERS:
+        Tier.objects.get_or_create(name=tier['name'], defaults=tier)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0002_uploadedfile_rendition_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=12, unique=True)),
+                ('thumbnail_sizes', models.JSONField(blank=True, default=list, validators=[image_hosting.models.validate_thumbnail_sizes])),
+                ('original_link', models.BooleanField(default=False)),
+                ('expiring_link', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='tier',
+            field=models.CharField(default='Basic', max_length=12),
+        ),
+        migrations.RunPython(create_built_in_tiers, migrations.RunPython.noop),
+    ]
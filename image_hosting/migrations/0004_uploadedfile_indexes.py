@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0003_tier'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['created_by', 'id'], name='uploadedfile_owner_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['created_by', '-date_started', '-id'], name='uploadedfile_owner_date_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+def requeue_rendered_files(apps, schema_editor):
+    # files rendered before the manifest existed have nothing to build their urls from;
+    # `manage.py render_pending` renders them again and fills it in
+    UploadedFile = apps.get_model('image_hosting', 'UploadedFile')
+    UploadedFile.objects.filter(rendition_status='Ready').update(rendition_status='Pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0004_uploadedfile_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(requeue_rendered_files, migrations.RunPython.noop),
+    ]
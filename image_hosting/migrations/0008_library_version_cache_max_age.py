@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0007_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='library_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0008_library_version_cache_max_age'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tempurl',
+            name='expiry_date',
+            field=models.DateTimeField(blank=True, db_index=True),
+        ),
+    ]
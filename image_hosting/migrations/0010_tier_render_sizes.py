@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:27
+
+from django.db import migrations, models
+import image_hosting.models
+
+
+ENTERPRISE_RENDER_SIZES = [[100, 100], [320, 240], [640, 480], [800, 600], [1024, 768], [1280, 720], [1920, 1080]]
+
+
+def enable_enterprise_renders(apps, schema_editor):
+    Tier = apps.get_model('image_hosting', 'Tier')
+    Tier.objects.filter(name='Enterprise').update(render_sizes=ENTERPRISE_RENDER_SIZES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0009_tempurl_expiry_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='render_sizes',
+            field=models.JSONField(blank=True, default=list, validators=[image_hosting.models.validate_render_sizes]),
+        ),
+        migrations.RunPython(enable_enterprise_renders, migrations.RunPython.noop),
+    ]
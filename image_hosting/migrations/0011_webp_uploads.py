@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0010_tier_render_sizes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadedfile',
+            name='file_format',
+            field=models.CharField(choices=[('PNG', 'Png'), ('JPEG', 'Jpeg'), ('WEBP', 'Webp')], default='PNG', max_length=5),
+        ),
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='file_format',
+            field=models.CharField(blank=True, choices=[('PNG', 'Png'), ('JPEG', 'Jpeg'), ('WEBP', 'Webp')], max_length=5),
+        ),
+    ]
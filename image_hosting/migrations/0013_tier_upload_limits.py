@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+# (max_pixels, max_file_size) of the paid tiers, Basic keeps the defaults
+UPLOAD_LIMITS = {
+    'Premium': (50_000_000, 25 * 1024 * 1024),
+    'Enterprise': (100_000_000, 100 * 1024 * 1024),
+}
+
+
+def set_upload_limits(apps, schema_editor):
+    Tier = apps.get_model('image_hosting', 'Tier')
+    for name, (max_pixels, max_file_size) in UPLOAD_LIMITS.items():
+        Tier.objects.filter(name=name).update(max_pixels=max_pixels, max_file_size=max_file_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0012_uploadedfile_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='max_file_size',
+            field=models.PositiveBigIntegerField(default=10485760),
+        ),
+        migrations.AddField(
+            model_name='tier',
+            name='max_pixels',
+            field=models.PositiveBigIntegerField(default=25000000),
+        ),
+        migrations.RunPython(set_upload_limits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:49
+
+import random
+import string
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def regenerate_duplicate_tokens(apps, schema_editor):
+    # tokens were never checked for collisions; keep the oldest link of each duplicated token
+    TempUrl = apps.get_model('image_hosting', 'TempUrl')
+    duplicated = TempUrl.objects.values('token').annotate(links=Count('id')).filter(links__gt=1).values_list('token', flat=True)
+    for token in list(duplicated):
+        for link in TempUrl.objects.filter(token=token).order_by('id')[1:]:
+            link.token = ''.join(random.choice(string.ascii_lowercase) for _ in range(20))
+            link.save(update_fields=['token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0013_tier_upload_limits'),
+    ]
+
+    operations = [
+        migrations.RunPython(regenerate_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tempurl',
+            name='token',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(condition=models.Q(('rendition_status', 'Pending')), fields=['id'], name='uploadedfile_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0015_orphan_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='rendition_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='rendition_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(condition=models.Q(('rendition_status', 'Processing')), fields=['rendition_claimed_at'], name='uploadedfile_processing_idx'),
+        ),
+    ]
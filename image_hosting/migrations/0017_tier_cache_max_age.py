@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 12:41
+
+from django.db import migrations
+
+
+# seconds clients reuse the image metadata of the built-in tiers before revalidating it: the paid tiers see
+# new uploads and finished thumbnails sooner, Basic polls less often
+CACHE_MAX_AGES = {
+    'Basic': 60,
+    'Premium': 30,
+    'Enterprise': 10,
+}
+
+
+def set_cache_max_ages(apps, schema_editor):
+    Tier = apps.get_model('image_hosting', 'Tier')
+    for name, cache_max_age in CACHE_MAX_AGES.items():
+        # leaves the values already edited in the admin
+        Tier.objects.filter(name=name, cache_max_age=0).update(cache_max_age=cache_max_age)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_hosting', '0016_rendition_claims'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_cache_max_ages, migrations.RunPython.noop),
+    ]
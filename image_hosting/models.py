@@ -1,11 +1,17 @@
+import datetime
+import os
 import random
 import string
 from uuid import uuid4
 
+import pytz
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from imagekit.models import ImageSpecField
-from imagekit.processors import ResizeToFill
+from django.core.exceptions import ValidationError
+from django.db import connections, models, transaction
+from django.db.models import sql
+
+from . import caching
 
 
 def get_thumb_image_path():
@@ -19,16 +25,157 @@ def randomString(stringLength=20):
     return ''.join(random.choice(letters) for i in range(stringLength))
 
 
+def validate_thumbnail_sizes(value):
+    if not isinstance(value, list) or not all(isinstance(size, int) and size > 0 for size in value):
+        raise ValidationError("Thumbnail sizes must be a list of positive integers")
+
+
+def validate_render_sizes(value):
+    if not isinstance(value, list) or not all(
+            isinstance(size, list) and len(size) == 2 and all(isinstance(side, int) and side > 0 for side in size)
+            for size in value):
+        raise ValidationError("Render sizes must be a list of [width, height] pairs of positive integers")
+
+
+class ReturningQuerySet(models.QuerySet):
+    """
+    QuerySet with update() and delete() variants returning the rows they change, in a single
+    UPDATE/DELETE ... RETURNING statement on the databases supporting it (PostgreSQL, SQLite 3.35+).
+    Like update(), neither sends signals nor updates auto_now fields.
+    """
+
+    def _execute_returning(self, query, fields):
+        connection = connections[self.db]
+        compiler = query.get_compiler(self.db)
+        compiler.pre_sql_setup()
+        statement, params = compiler.as_sql()
+        columns = [field.get_col(self.model._meta.db_table) for field in fields]
+        converters = [connection.ops.get_db_converters(column) + column.get_db_converters(connection) for column in columns]
+        returning = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{statement} RETURNING {returning}', params)
+            rows = cursor.fetchall()
+        converted = []
+        for row in rows:
+            values = []
+            for value, column, column_converters in zip(row, columns, converters):
+                for converter in column_converters:
+                    value = converter(value, column, connection)
+                values.append(value)
+            converted.append(values)
+        return converted
+
+    def update_returning(self, **fields):
+        """
+        Updates the rows like update() and returns them as instances.
+        """
+        if not connections[self.db].features.can_return_columns_from_insert:
+            with transaction.atomic(using=self.db):
+                ids = list(self.select_for_update().values_list('pk', flat=True))
+                self.model._base_manager.using(self.db).filter(pk__in=ids).update(**fields)
+                return list(self.model._base_manager.using(self.db).filter(pk__in=ids))
+
+        query = self.query.chain(sql.UpdateQuery)
+        query.add_update_values(fields)
+        query.annotations = {}
+        concrete_fields = self.model._meta.concrete_fields
+        names = [field.attname for field in concrete_fields]
+        return [self.model.from_db(self.db, names, values) for values in self._execute_returning(query, concrete_fields)]
+
+    def delete_returning(self, *field_names):
+        """
+        Deletes the rows without fetching them first nor cascading to their relations (see Collector),
+        returning the given fields of each as a tuple.
+        """
+        if not connections[self.db].features.can_return_columns_from_insert:
+            with transaction.atomic(using=self.db):
+                rows = list(self.select_for_update().values_list('pk', *field_names))
+                self.model._base_manager.using(self.db).filter(pk__in=[row[0] for row in rows])._raw_delete(self.db)
+            return [row[1:] for row in rows]
+
+        query = self.query.clone()
+        query.__class__ = sql.DeleteQuery
+        fields = [self.model._meta.get_field(name) for name in field_names]
+        return [tuple(values) for values in self._execute_returning(query, fields)]
+
+
+class Tier(models.Model):
+    """
+    Account tier and the features it grants. Tiers are edited in the admin, no deploy needed.
+    """
+    name = models.CharField(max_length=12, unique=True)
+    thumbnail_sizes = models.JSONField(default=list, blank=True, validators=[validate_thumbnail_sizes])
+    original_link = models.BooleanField(default=False)
+    expiring_link = models.BooleanField(default=False)
+    # seconds clients may reuse image metadata before revalidating it with its ETag
+    cache_max_age = models.PositiveIntegerField(default=0)
+    # [width, height] sizes the images can be rendered at on the fly, see UploadedFileViewset.render_image
+    render_sizes = models.JSONField(default=list, blank=True, validators=[validate_render_sizes])
+    # largest uploads accepted, checked before the image is decoded (see serializers.validate_image_limits)
+    max_pixels = models.PositiveBigIntegerField(default=25_000_000)
+    max_file_size = models.PositiveBigIntegerField(default=10 * 1024 * 1024)
+
+    def __str__(self):
+        return self.name
+
+
 class User(AbstractUser):
     """
     Customization of the User object in order to include the tier field.
+    The tier is the name of a Tier; the built-in ones are listed in UserTiers.
     """
     class UserTiers(models.TextChoices):
         BASIC = "Basic"
         PREMIUM = "Premium"
         ENTERPRISE = "Enterprise"
 
-    tier = models.CharField(max_length=12, choices=UserTiers.choices, default=UserTiers.BASIC)
+    tier = models.CharField(max_length=12, default=UserTiers.BASIC)
+    # bumped on every change to the user's files, see the ETags of UploadedFileViewset
+    library_version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def bump_library_version(cls, user_id):
+        cls.objects.filter(pk=user_id).update(library_version=models.F('library_version') + 1)
+        caching.invalidate_user(user_id)
+
+
+class Blob(models.Model):
+    """
+    Stored content of an uploaded original, shared by every uploaded file with the same bytes (see blobs.py).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.sha256} ({self.ref_count} references)'
+
+
+class OrphanFile(models.Model):
+    """
+    File of the storage no longer referenced by any uploaded file, deleted by `manage.py collect_orphans`
+    once its grace period is over (see orphans.py).
+    """
+    name = models.CharField(max_length=255, unique=True)
+    orphaned_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class StorageScan(models.Model):
+    """
+    Progress of a reconciliation of the storage against the database, resumed from `cursor` (the last file checked).
+    """
+    cursor = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    scanned = models.PositiveIntegerField(default=0)
+    orphaned = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'scan {self.pk} at {self.cursor or "start"}'
 
 
 class UploadedFile(models.Model):
@@ -38,6 +185,18 @@ class UploadedFile(models.Model):
     class ValidFileFormat(models.TextChoices):
         PNG = "PNG"
         JPEG = "JPEG"
+        WEBP = "WEBP"
+
+    class RenditionStatus(models.TextChoices):
+        PENDING = "Pending"
+        PROCESSING = "Processing"
+        READY = "Ready"
+        FAILED = "Failed"
+
+    class Orientation(models.TextChoices):
+        LANDSCAPE = "landscape"
+        PORTRAIT = "portrait"
+        SQUARE = "square"
 
     name = models.CharField(max_length=50, blank=False, null=False)
     created_by = models.ForeignKey(User,  related_name='images', on_delete=models.CASCADE)
@@ -45,18 +204,92 @@ class UploadedFile(models.Model):
     date_started = models.DateField(auto_now_add=True)
     last_edited = models.DateField(auto_now=True)
     image_url = models.ImageField(upload_to='images/', blank=False, null=False)
-    image_thumbnail200 = ImageSpecField(source='image_url', processors=[ResizeToFill(200, 200)], format='JPEG', options={'quality': 60})
-    image_thumbnail400 = ImageSpecField(source='image_url', processors=[ResizeToFill(400, 400)], format='JPEG', options={'quality': 60})
+    blob = models.ForeignKey(Blob, related_name='files', null=True, blank=True, on_delete=models.PROTECT)
+    rendition_status = models.CharField(max_length=10, default=RenditionStatus.PENDING, choices=RenditionStatus.choices)
+    # when a worker last started rendering the file, and how many times; see renditions.requeue_stale
+    rendition_claimed_at = models.DateTimeField(null=True, blank=True)
+    rendition_attempts = models.PositiveSmallIntegerField(default=0)
+    # generated thumbnails by size: {"200": {"name": ..., "width": ..., "height": ..., "bytes": ..., "variants": {...}}}
+    renditions = models.JSONField(default=dict, blank=True)
+    # read from the header of the original at upload time, see metadata.py; the size is as displayed (EXIF rotation applied)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    orientation = models.CharField(max_length=9, blank=True, choices=Orientation.choices)
+    color_mode = models.CharField(max_length=8, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+
+    objects = ReturningQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_by', 'id'], name='uploadedfile_owner_id_idx'),
+            # keyset pagination of a user's files, see pagination.py
+            models.Index(fields=['created_by', '-date_started', '-id'], name='uploadedfile_owner_date_idx'),
+            # filters of the list, see views.filter_images
+            models.Index(fields=['created_by', 'orientation', '-date_started', '-id'], name='uploadedfile_owner_orient_idx'),
+            models.Index(fields=['created_by', 'width'], name='uploadedfile_owner_width_idx'),
+            models.Index(fields=['created_by', 'height'], name='uploadedfile_owner_height_idx'),
+            models.Index(fields=['created_by', 'sha256'], name='uploadedfile_owner_sha256_idx'),
+            # references of the legacy originals, checked by the orphan collector
+            models.Index(fields=['image_url'], name='uploadedfile_image_url_idx'),
+            # the queue of render_pending: only the few files still pending are indexed
+            models.Index(fields=['id'], name='uploadedfile_pending_idx',
+                         condition=models.Q(rendition_status='Pending')),
+            # the files left processing by a worker that died, see renditions.requeue_stale
+            models.Index(fields=['rendition_claimed_at'], name='uploadedfile_processing_idx',
+                         condition=models.Q(rendition_status='Processing')),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class UploadSession(models.Model):
+    """
+    Resumable upload of a file sent in chunks. The received bytes are staged on local disk
+    (`settings.UPLOAD_SESSION_DIR`) until the upload is finalized into an UploadedFile.
+    A session expires `settings.UPLOAD_SESSION_MAX_AGE` seconds after it was created,
+    and `manage.py reap_uploads` deletes it with its staged bytes.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='upload_sessions', on_delete=models.CASCADE)
+    name = models.CharField(max_length=50, blank=False, null=False)
+    file_format = models.CharField(max_length=5, blank=True, choices=UploadedFile.ValidFileFormat.choices)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @staticmethod
+    def expiry_cutoff():
+        """
+        Sessions created before it are expired.
+        """
+        return datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+
+    @property
+    def expires(self):
+        return self.created + datetime.timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+
+    @property
+    def expired(self):
+        return self.created < self.expiry_cutoff()
+
+    @property
+    def staging_path(self):
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f'{self.id}.part')
+
+    def __str__(self):
+        return f'{self.name} - {self.received}/{self.size} bytes'
+
+
 class TempUrl(models.Model):
     user = models.ForeignKey(User, related_name='expiry_links', on_delete=models.CASCADE)
     related_file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE)
-    token = models.CharField(max_length=255)
-    expiry_date = models.DateTimeField(blank=True)
+    token = models.CharField(max_length=255, unique=True)
+    expiry_date = models.DateTimeField(blank=True, db_index=True)
+
+    objects = ReturningQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
         if not self.token:
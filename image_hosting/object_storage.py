@@ -0,0 +1,245 @@
+"""
+S3-compatible object storage of the originals and thumbnails (AWS S3, MinIO, Ceph, ...), used instead of
+MEDIA_ROOT when `settings.S3_BUCKET` is set, so that every node of the deployment sees the same files.
+
+Uploads stream from the uploaded file: files above S3_MULTIPART_THRESHOLD are sent as a multipart upload
+of S3_MULTIPART_CHUNKSIZE parts, S3_MULTIPART_CONCURRENCY of them at once, so at most that many parts
+are held in memory. Reads stream the object with ranged GETs from the position of the file, so Range
+requests and Pillow only transfer what they read. Each process keeps a single client, whose HTTP
+connections (up to S3_MAX_POOL_CONNECTIONS) are reused across requests and threads.
+"""
+import io
+import mimetypes
+import os
+import threading
+from urllib.parse import urljoin
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+NOT_FOUND = ('404', 'NoSuchKey', 'NotFound')
+
+
+def not_found(error):
+    return error.response.get('Error', {}).get('Code') in NOT_FOUND
+
+
+class ObjectReader(io.RawIOBase):
+    """
+    Seekable, read only view of an object. Reading streams the object from the current position with
+    a ranged GET; seeking elsewhere drops the stream and the next read starts a new one.
+    """
+
+    def __init__(self, storage, name, size=None):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self._size = size
+        self.position = 0
+        self.body = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self.storage.size(self.name)
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        else:
+            position = self.size + offset
+        if position != self.position:
+            self._drop()
+            self.position = position
+        return self.position
+
+    def readinto(self, buffer):
+        if self._size is not None and self.position >= self._size:
+            return 0
+        if self.body is None:
+            try:
+                response = self.storage.client.get_object(Bucket=self.storage.bucket, Key=self.name,
+                                                          Range=f'bytes={self.position}-')
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return 0
+                raise
+            self._size = int(response['ContentRange'].rsplit('/', 1)[1])
+            self.body = response['Body']
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def _drop(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def close(self):
+        self._drop()
+        super().close()
+
+
+class ObjectFile(File):
+    """
+    Stored object opened for reading, buffered by io.BufferedReader.
+    """
+
+    def __init__(self, storage, name):
+        self.reader = ObjectReader(storage, name)
+        super().__init__(io.BufferedReader(self.reader, buffer_size=storage.read_chunk_size), name)
+        self.mode = 'rb'
+
+    @property
+    def size(self):
+        return self.reader.size
+
+
+class UploadSource:
+    """
+    The file being saved, as handed to boto3. boto3 closes the files it uploads, but this one belongs to
+    the caller of Storage.save, who may still read it afterwards (e.g. metadata.py), so closing is left to them.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def close(self):
+        pass
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Storage of the files in a bucket, under the same names the file system storage would use.
+    The arguments default to the S3_* settings.
+    """
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None, access_key_id=None, secret_access_key=None,
+                 addressing_style=None, base_url=None):
+        self.bucket = bucket or settings.S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.S3_ENDPOINT_URL
+        self.region = region or settings.S3_REGION
+        self.access_key_id = access_key_id or settings.S3_ACCESS_KEY_ID
+        self.secret_access_key = secret_access_key or settings.S3_SECRET_ACCESS_KEY
+        self.addressing_style = addressing_style or settings.S3_ADDRESSING_STYLE
+        self.base_url = base_url or settings.S3_MEDIA_URL
+        self.read_chunk_size = settings.S3_READ_CHUNK_SIZE
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+            use_threads=settings.S3_MULTIPART_CONCURRENCY > 1,
+        )
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Client of the process, created on first use: clients and their pooled connections
+        must not be shared with processes forked afterwards (e.g. the rendition workers).
+        """
+        if self._client_pid != os.getpid():
+            with self._lock:
+                if self._client_pid != os.getpid():
+                    self._client = boto3.session.Session().client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                        config=Config(
+                            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                            retries={'max_attempts': 3, 'mode': 'standard'},
+                            s3={'addressing_style': self.addressing_style},
+                            # checksums only where S3 requires them: several S3-compatible stores
+                            # reject the aws-chunked trailing checksums sent by default
+                            request_checksum_calculation='when_required',
+                            response_checksum_validation='when_required',
+                        ),
+                    )
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def _head(self, name):
+        return self.client.head_object(Bucket=self.bucket, Key=name)
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("Stored objects can only be opened for reading")
+        return ObjectFile(self, name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek') and (not hasattr(content, 'seekable') or content.seekable()):
+            content.seek(0)
+        content_type = getattr(content, 'content_type', None) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(UploadSource(content), self.bucket, name, ExtraArgs={'ContentType': content_type},
+                                   Config=self.transfer_config)
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except ClientError as e:
+            if not_found(e):
+                return False
+            raise
+        return True
+
+    def listdir(self, path):
+        prefix = path.strip('/') + '/' if path.strip('/') else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            directories.extend(entry['Prefix'][len(prefix):].rstrip('/') for entry in page.get('CommonPrefixes', []))
+            files.extend(entry['Key'][len(prefix):] for entry in page.get('Contents', []))
+        return directories, files
+
+    def size(self, name):
+        try:
+            return self._head(name)['ContentLength']
+        except ClientError as e:
+            if not_found(e):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def get_modified_time(self, name):
+        try:
+            modified = self._head(name)['LastModified']
+        except ClientError as e:
+            if not_found(e):
+                raise FileNotFoundError(name) from e
+            raise
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def url(self, name):
+        return urljoin(self.base_url, filepath_to_uri(name))
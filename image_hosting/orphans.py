@@ -0,0 +1,170 @@
+"""
+Garbage collection of the storage.
+
+Django leaves the files of deleted rows in the storage. The files a deletion or a replacement leaves without
+references (the original of a released blob or of a legacy upload, and its thumbnails) are recorded as OrphanFiles
+in the same transaction, and `manage.py collect_orphans` deletes them once STORAGE_GC_GRACE seconds have passed,
+so that the responses and caches still serving them are not cut short. Files left behind otherwise (by a crash,
+or by the code before this module) are found by reconciling the storage against the database, a resumable scan.
+"""
+import datetime
+import functools
+import itertools
+import logging
+import operator
+import os
+
+import pytz
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Blob, OrphanFile, StorageScan, UploadedFile
+from .renditions import THUMBNAIL_DIR
+
+logger = logging.getLogger(__name__)
+
+storage = UploadedFile._meta.get_field('image_url').storage
+
+# originals: blobs.py stores them under blobs/, the uploads before it under images/
+ORIGINAL_DIRS = ('blobs', 'images')
+# thumbnails, under <dir>/<name of the original without extension>/; CACHE/images holds those rendered by imagekit
+# before renditions.py
+THUMBNAIL_DIRS = (THUMBNAIL_DIR, 'CACHE/images')
+
+
+def record_orphans(names):
+    """
+    Records the files as orphans, collected after the grace period. Call it in the transaction dropping the
+    references: a rollback then forgets them too.
+    """
+    if names:
+        OrphanFile.objects.bulk_create([OrphanFile(name=name) for name in names], ignore_conflicts=True)
+
+
+def source_stem(name):
+    """
+    Name without extension of the original a thumbnail was rendered from, None if the file is not a thumbnail.
+    """
+    for directory in THUMBNAIL_DIRS:
+        if name.startswith(directory + '/'):
+            return os.path.dirname(name[len(directory) + 1:])
+    return None
+
+
+def referenced(names):
+    """
+    Those of the files still referenced: the originals of a blob or an uploaded file, and the thumbnails of
+    those originals. Two queries at most, whatever the number of files.
+    """
+    stems = {name: source_stem(name) for name in names}
+    originals = {name for name, stem in stems.items() if stem is None}
+    sources = {stem for stem in stems.values() if stem}
+
+    live = set()
+    # blob names start with the SHA-256, which is indexed
+    shas = {os.path.basename(name)[:64] for name in originals | sources if name.startswith('blobs/')}
+    if shas:
+        live.update(Blob.objects.filter(sha256__in=shas).values_list('name', flat=True))
+    conditions = [Q(image_url__startswith=stem + '.') for stem in sources if not stem.startswith('blobs/')]
+    legacy = [name for name in originals if not name.startswith('blobs/')]
+    if legacy:
+        conditions.append(Q(image_url__in=legacy))
+    if conditions:
+        live.update(UploadedFile.objects.filter(functools.reduce(operator.or_, conditions))
+                    .values_list('image_url', flat=True))
+
+    live_stems = {os.path.splitext(name)[0] for name in live}
+    return {name for name, stem in stems.items() if (name in live if stem is None else stem in live_stems)}
+
+
+def collect(grace, batch_size, now=None):
+    """
+    Deletes from the storage one batch of the files orphaned more than `grace` seconds before `now` (by default the
+    current time). The batch is claimed in a short transaction, skipping the orphans locked by another collector:
+    the files referenced again are dropped from the orphans, and the others get the current time as orphaned_at,
+    so that no other collector (nor a later batch of the same pass) takes them. The storage is called after the
+    transaction. A file that cannot be deleted is left as an orphan, retried after another grace period.
+    Returns the number of orphans claimed, the files deleted, the bytes reclaimed and the failures.
+    """
+    claimed_at = datetime.datetime.now(tz=pytz.utc)
+    cutoff = (now or claimed_at) - datetime.timedelta(seconds=grace)
+    with transaction.atomic():
+        orphans = list(OrphanFile.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(orphaned_at__lte=cutoff)
+                       # the thumbnails are recorded after their original: deleting them first, a new upload of the
+                       # same content cannot reuse the name of the original while its old thumbnails are deleted
+                       .order_by('orphaned_at', '-id')
+                       .values_list('id', 'name')[:batch_size])
+        live = referenced([name for _, name in orphans])
+        OrphanFile.objects.filter(id__in=[orphan_id for orphan_id, name in orphans if name in live]).delete()
+        OrphanFile.objects.filter(id__in=[orphan_id for orphan_id, name in orphans if name not in live]).update(
+            orphaned_at=claimed_at)
+
+    done, deleted, reclaimed, failed = [], 0, 0, 0
+    for orphan_id, name in orphans:
+        if name in live:
+            continue
+        try:
+            size = storage.size(name)
+            storage.delete(name)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # e.g. a permission error, or an S3 error other than a missing object
+            logger.exception("Could not delete %s", name)
+            failed += 1
+            continue
+        else:
+            deleted += 1
+            reclaimed += size
+        done.append(orphan_id)
+    OrphanFile.objects.filter(id__in=done).delete()
+    return len(orphans), deleted, reclaimed, failed
+
+
+def walk(directory, after=()):
+    """
+    Names of the files under the directory, depth first in name order, skipping those up to the `after` path
+    (split on '/') without listing the directories before it.
+    """
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    entries = sorted([(name, True) for name in directories] + [(name, False) for name in files])
+    for name, is_directory in entries:
+        path = f'{directory}/{name}'
+        parts = tuple(path.split('/'))
+        if is_directory:
+            if parts >= after[:len(parts)]:
+                yield from walk(path, after)
+        elif parts > after:
+            yield path
+
+
+def reconcile(limit, batch_size=500):
+    """
+    Checks up to `limit` files of the storage against the database, resuming the scan in progress (or starting
+    a new one), and records those without references as orphans. Returns the scan.
+    """
+    scan = StorageScan.objects.filter(finished_at__isnull=True).order_by('id').last() or StorageScan.objects.create()
+    after = tuple(scan.cursor.split('/')) if scan.cursor else ()
+    roots = sorted((tuple(root.split('/')) for root in ORIGINAL_DIRS + THUMBNAIL_DIRS))
+    files = itertools.islice(itertools.chain.from_iterable(
+        walk('/'.join(root), after) for root in roots if root >= after[:len(root)]), limit)
+
+    checked = 0
+    while batch := list(itertools.islice(files, batch_size)):
+        orphaned = set(batch) - referenced(batch)
+        with transaction.atomic():
+            record_orphans(sorted(orphaned))
+            scan.cursor = batch[-1]
+            scan.scanned += len(batch)
+            scan.orphaned += len(orphaned)
+            scan.save(update_fields=['cursor', 'scanned', 'orphaned'])
+        checked += len(batch)
+    if checked < limit:
+        scan.finished_at = datetime.datetime.now(tz=pytz.utc)
+        scan.save(update_fields=['finished_at'])
+    return scan
@@ -0,0 +1,82 @@
+import base64
+import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class UploadedFileCursorPagination(BasePagination):
+    """
+    Keyset pagination of the uploaded files, newest first.
+    The cursor holds the (date_started, id) of the last file of the page, so fetching any page
+    is a single index range scan no matter how many files the user owns.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-date_started', '-id')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, instance):
+        position = f"{instance.date_started.isoformat()}:{instance.id}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            date_started, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+            return datetime.date.fromisoformat(date_started), int(file_id)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            date_started, file_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(date_started__lt=date_started) | Q(date_started=date_started, id__lt=file_id))
+
+        # one extra row tells whether there is a next page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the users listed to the admins, by id.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    ordering = 'id'
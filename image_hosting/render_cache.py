@@ -0,0 +1,175 @@
+"""
+On-disk cache of the on-the-fly renders of /images/<id>/render/ (see UploadedFileViewset.render_image).
+
+Renders are stored under `settings.RENDER_CACHE_DIR` by a key derived from the source content and the render
+parameters, so files with the same content share them and they never need invalidating.
+The cache is bounded by `settings.RENDER_CACHE_MAX_BYTES` with least recently used eviction: hits refresh the
+modification time of the file, and once the bytes written since the last sweep may have pushed the total over
+the bound (or every RENDER_CACHE_SWEEP_INTERVAL seconds) a sweep deletes the oldest files down to LOW_WATERMARK
+of it. Sweeps scan the directory, so they account for the files written by every process sharing it.
+
+Concurrent requests for the same render within a process wait for the first one instead of rendering again.
+Across processes the file is written under a temporary name and renamed into place, so a duplicate render
+only costs the work. Hits, misses, coalesced requests and evictions are counted in the cache
+(shared by the processes with Redis), see `manage.py render_cache`.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+HIT, MISS, COALESCED = 'hit', 'miss', 'coalesced'
+METRICS = ('hits', 'misses', 'coalesced', 'evictions', 'evicted_bytes')
+LOW_WATERMARK = 0.9
+TEMP_PREFIX = '.render-'
+
+_lock = threading.Lock()
+_sweep_lock = threading.Lock()
+_inflight = {}
+# per cache directory: bytes found by the last sweep plus those written since, and when it ran
+_usage = {}
+
+
+def render_key(source_id, width, height, fit, fmt):
+    return hashlib.sha256(f'{source_id}:{width}x{height}:{fit}:{fmt}'.encode()).hexdigest()
+
+
+def cache_name(key, extension):
+    return f'{key[:2]}/{key}{extension}'
+
+
+def storage():
+    return FileSystemStorage(location=settings.RENDER_CACHE_DIR)
+
+
+def count(metric, amount=1):
+    key = f'render-cache:{metric}'
+    if not cache.add(key, amount, timeout=None):
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, timeout=None)
+
+
+def metrics():
+    values = cache.get_many([f'render-cache:{metric}' for metric in METRICS])
+    return {metric: values.get(f'render-cache:{metric}', 0) for metric in METRICS}
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=TEMP_PREFIX, delete=False) as temp:
+        temp.write(content)
+    os.replace(temp.name, path)
+
+
+def get_or_render(name, render):
+    """
+    Makes sure the render stored under `name` is in the cache, calling `render()` for its bytes
+    if it is not. Returns whether it was a hit, a miss or waited for a concurrent miss (coalesced).
+    """
+    path = os.path.join(settings.RENDER_CACHE_DIR, name)
+    while True:
+        if _touch(path):
+            count('hits')
+            return HIT
+        with _lock:
+            pending = _inflight.get(name)
+            if pending is None:
+                pending = _inflight[name] = threading.Event()
+                break
+        pending.wait()
+        if _touch(path):
+            count('coalesced')
+            return COALESCED
+        # the render failed: try again, maybe leading the next attempt
+
+    try:
+        content = render()
+        _write(path, content)
+    finally:
+        with _lock:
+            del _inflight[name]
+        pending.set()
+    count('misses')
+    _written(len(content))
+    return MISS
+
+
+def _written(size):
+    root = settings.RENDER_CACHE_DIR
+    with _lock:
+        usage = _usage.get(root)
+        if usage is not None:
+            usage['bytes'] += size
+        due = (usage is None or usage['bytes'] > settings.RENDER_CACHE_MAX_BYTES
+               or time.monotonic() - usage['swept_at'] > settings.RENDER_CACHE_SWEEP_INTERVAL)
+    if due and _sweep_lock.acquire(blocking=False):
+        try:
+            sweep()
+        finally:
+            _sweep_lock.release()
+
+
+def scan(root):
+    """
+    (modification time, size, path) of every render under the directory.
+    """
+    entries = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.startswith(TEMP_PREFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def sweep():
+    """
+    Deletes the least recently used renders until the cache is back under LOW_WATERMARK of its bound,
+    if it went over. Returns the bytes left in the cache.
+    """
+    root = settings.RENDER_CACHE_DIR
+    entries = scan(root)
+    total = sum(size for _, size, _ in entries)
+    evictions = evicted_bytes = 0
+    if total > settings.RENDER_CACHE_MAX_BYTES:
+        target = settings.RENDER_CACHE_MAX_BYTES * LOW_WATERMARK
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evictions += 1
+            evicted_bytes += size
+        logger.info("Evicted %d renders (%d bytes) from %s", evictions, evicted_bytes, root)
+        count('evictions', evictions)
+        count('evicted_bytes', evicted_bytes)
+    with _lock:
+        _usage[root] = {'bytes': total, 'swept_at': time.monotonic()}
+    return total
@@ -0,0 +1,478 @@
+"""
+Background rendering of the thumbnails (renditions) of the uploaded files.
+
+Thumbnails are never generated inside a request. After an upload is committed it is handed to the
+configured rendition backend (`settings.RENDITION_BACKEND`), which renders every thumbnail size offered
+by the tiers and marks the file as ready. Until then the API reports the file as pending together with the final urls.
+Each thumbnail is a JPEG, with WebP/AVIF variants (THUMBNAIL_VARIANTS) served to the clients accepting them.
+"""
+import datetime
+import functools
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytz
+from PIL import Image
+from pilkit.utils import save_image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from . import caching, workers
+from .metadata import read_dimensions
+from .models import UploadedFile, User
+from .tiers import all_thumbnail_sizes
+
+logger = logging.getLogger(__name__)
+
+RENDER_TASK = 'image_hosting.renditions.render_renditions'
+RENDER_ORIGINAL_TASK = 'image_hosting.renditions.render_original'
+THUMBNAIL_DIR = 'CACHE/renditions'
+THUMBNAIL_FORMAT = 'JPEG'
+THUMBNAIL_OPTIONS = {'quality': 60}
+
+MEDIA_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+
+def can_encode(pillow_format):
+    """
+    Whether the installed Pillow can write the format (AVIF needs Pillow 11.3+ or the pillow-avif-plugin).
+    """
+    Image.init()
+    return pillow_format in Image.SAVE
+
+
+# smaller encodings of the thumbnails, rendered next to the JPEG for the clients accepting them, by preference:
+# (Pillow format, save options). Stored as <size>.jpg.<name> so a front server can pick them by Accept too.
+THUMBNAIL_VARIANTS = {name: variant for name, variant in {
+    'avif': ('AVIF', {'quality': 50}),
+    'webp': ('WEBP', {'quality': 60, 'method': 4}),
+}.items() if can_encode(variant[0])}
+
+# formats of the on-the-fly renders: (Pillow format, extension, save options)
+RENDER_FORMATS = {name: render_format for name, render_format in {
+    'jpeg': ('JPEG', '.jpg', {'quality': 80}),
+    'png': ('PNG', '.png', {'optimize': True}),
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', '.avif', {'quality': 60}),
+}.items() if can_encode(render_format[0])}
+# picked from the Accept header when the render request names no format, by preference
+RENDER_NEGOTIATED = tuple(name for name in ('avif', 'webp') if name in RENDER_FORMATS)
+RENDER_FITS = ('cover', 'contain')
+
+
+def rendition_name(source_name, size):
+    """
+    Storage name of the square thumbnail of the given size for the source file.
+    """
+    return f"{THUMBNAIL_DIR}/{os.path.splitext(source_name)[0]}/{size}.jpg"
+
+
+def variant_name(name, variant):
+    return f"{name}.{variant}"
+
+
+def rendition_names(renditions):
+    """
+    Storage names of every thumbnail of a rendition manifest, variants included.
+    """
+    names = []
+    for rendition in renditions.values():
+        names.append(rendition['name'])
+        names.extend(variant['name'] for variant in rendition.get('variants', {}).values())
+    return names
+
+
+def accepted_media_types(accept):
+    """
+    Media types the Accept header lists with a non-zero quality. Wildcards are left out:
+    every client sends */*, so they tell nothing about the formats it can decode.
+    """
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, *parameters = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def negotiate_format(accept, names):
+    """
+    First of the given format names the Accept header lists, None if it lists none of them.
+    """
+    accepted = accepted_media_types(accept)
+    return next((name for name in names if MEDIA_TYPES[name] in accepted), None)
+
+
+def negotiate_rendition(rendition, accept):
+    """
+    The smallest encoding of the thumbnail the client accepts: one of its variants or the JPEG itself.
+    """
+    variants = rendition.get('variants', {})
+    variant = negotiate_format(accept, [name for name in THUMBNAIL_VARIANTS if name in variants])
+    return variants[variant] if variant is not None else rendition
+
+
+def get_rendition_name(instance, size):
+    """
+    Storage name of the thumbnail of the given size of the file, read from its manifest.
+    While the thumbnails are being rendered the name they will get is returned instead;
+    None if the size was never generated for the file.
+    """
+    rendition = instance.renditions.get(str(size))
+    if rendition is not None:
+        return rendition['name']
+    if instance.image_url and instance.rendition_status in (UploadedFile.RenditionStatus.PENDING,
+                                                            UploadedFile.RenditionStatus.PROCESSING):
+        return rendition_name(instance.image_url.name, size)
+    return None
+
+
+def _fill_box(width, height, target_width, target_height):
+    """
+    Centered crop box of a width x height image that has the aspect ratio of the target size.
+    """
+    scale = max(target_width / width, target_height / height)
+    crop_width, crop_height = target_width / scale, target_height / scale
+    left, top = (width - crop_width) / 2, (height - crop_height) / 2
+    return left, top, left + crop_width, top + crop_height
+
+
+def resize_thumbnails(source, sizes):
+    """
+    Yields the source resized to each of the given (width, height) sizes, largest first, cropped to fill
+    like imagekit's ResizeToFill, decoding the source only once.
+    JPEG sources are decoded directly at a reduced scale (DCT-domain downscaling) and each size is derived
+    from the previous, larger thumbnail of the same aspect ratio instead of from the full image.
+    """
+    if not sizes:
+        return
+    sizes = sorted(set(sizes), key=lambda size: size[0] * size[1], reverse=True)
+    image = Image.open(source)
+
+    # ask the decoder for the smallest scale that still covers the largest thumbnail
+    largest_width, largest_height = sizes[0]
+    scale = max(largest_width / image.width, largest_height / image.height)
+    if scale < 1:
+        image.draft(None, (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image.load()
+
+    intermediate = image
+    for width, height in sizes:
+        if intermediate is not image and intermediate.width * height != intermediate.height * width:
+            intermediate = image
+        box = _fill_box(intermediate.width, intermediate.height, width, height)
+        # reducing_gap lets Pillow shrink by an integer factor with reduce() before resampling
+        thumbnail = intermediate.resize((width, height), Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+        yield (width, height), thumbnail
+        intermediate = thumbnail
+
+
+def encode(image, format, options=None):
+    buffer = io.BytesIO()
+    save_image(image, buffer, format, options=options)
+    return ContentFile(buffer.getvalue())
+
+
+def render_thumbnails(source, sizes, format='JPEG', options=None):
+    """
+    Renders thumbnails of the given (width, height) sizes, see resize_thumbnails.
+    Returns a dict mapping each size to a ContentFile.
+    """
+    return {size: encode(thumbnail, format, options) for size, thumbnail in resize_thumbnails(source, sizes)}
+
+
+def render_fitted(source, width, height, fit='cover', format='JPEG', options=None):
+    """
+    Renders the image at the given size, either cropped to fill it like the thumbnails ('cover')
+    or scaled down to fit inside it keeping its aspect ratio ('contain', never enlarged).
+    Returns the encoded bytes.
+    """
+    if fit == 'cover':
+        return render_thumbnails(source, [(width, height)], format, options)[(width, height)].read()
+
+    image = Image.open(source)
+    # thumbnail() asks the JPEG decoder for a reduced scale too
+    image.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return encode(image, format, options).read()
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def render_original(name, max_pixels, width, height, fit='cover', format='JPEG', options=None):
+    """
+    render_fitted of the stored original with the given name, for the render endpoint. The original is only decoded
+    if its header declares at most `max_pixels` (the limit of the tier asking), otherwise ImageTooLarge is raised.
+    """
+    with UploadedFile._meta.get_field('image_url').storage.open(name, 'rb') as source:
+        try:
+            source_width, source_height = read_dimensions(source)
+        except Image.DecompressionBombError:
+            raise ImageTooLarge(f"Image too large: the account tier allows {max_pixels} pixels")
+        if source_width * source_height > max_pixels:
+            raise ImageTooLarge(f"Image too large: {source_width}x{source_height} pixels, "
+                                f"the account tier allows {max_pixels} pixels")
+        return render_fitted(source, width, height, fit, format, options)
+
+
+def _shared_renditions(instance, sizes):
+    """
+    Manifest of a file with the same content (blob) whose thumbnails are already rendered in all the sizes.
+    """
+    if instance.blob_id is None:
+        return None
+    manifests = (UploadedFile.objects
+                 .filter(blob_id=instance.blob_id, rendition_status=UploadedFile.RenditionStatus.READY)
+                 .exclude(pk=instance.pk)
+                 .values_list('renditions', flat=True))
+    for manifest in manifests[:5]:
+        if all(str(size) in manifest for size in sizes):
+            return manifest
+    return None
+
+
+def _update(current, instance, **fields):
+    # the status and thumbnails are part of the file's metadata, so its owner's ETags must change too
+    if current.update(**fields):
+        caching.invalidate_payload(instance.pk)
+        User.bump_library_version(instance.created_by_id)
+
+
+def _store(storage, name, content):
+    if storage.exists(name):
+        storage.delete(name)
+    return {'name': storage.save(name, content), 'bytes': content.size}
+
+
+def render_renditions(file_id):
+    """
+    Renders all the thumbnails of the uploaded file with the given id and stores the outcome
+    in its rendition status, together with the manifest of the generated thumbnails.
+    Files sharing their content with an already rendered file reuse its thumbnails.
+    Returns the new status, or None if the file no longer exists.
+    """
+    instance = UploadedFile.objects.filter(pk=file_id).first()
+    if instance is None:
+        return None
+
+    # a newer upload replacing this file must not have its status overwritten by a stale job
+    current = UploadedFile.objects.filter(pk=file_id, image_url=instance.image_url.name)
+    _update(current, instance, rendition_status=UploadedFile.RenditionStatus.PROCESSING,
+            rendition_claimed_at=datetime.datetime.now(tz=pytz.utc))
+
+    sizes = all_thumbnail_sizes()
+    shared = _shared_renditions(instance, sizes)
+    if shared is not None:
+        _update(current, instance, rendition_status=UploadedFile.RenditionStatus.READY, renditions=shared)
+        return UploadedFile.RenditionStatus.READY
+
+    try:
+        storage = instance.image_url.storage
+        manifest = {}
+        with instance.image_url.open('rb') as source:
+            for (size, _), thumbnail in resize_thumbnails(source, [(size, size) for size in sizes]):
+                name = rendition_name(instance.image_url.name, size)
+                rendition = manifest[str(size)] = _store(storage, name, encode(thumbnail, THUMBNAIL_FORMAT, THUMBNAIL_OPTIONS))
+                rendition.update(width=size, height=size, variants={})
+                for variant, (variant_format, options) in THUMBNAIL_VARIANTS.items():
+                    rendition['variants'][variant] = _store(storage, variant_name(name, variant),
+                                                            encode(thumbnail, variant_format, options))
+    except Exception:
+        logger.exception("Rendering the thumbnails of file %s failed", file_id)
+        _update(current, instance, rendition_status=UploadedFile.RenditionStatus.FAILED)
+        return UploadedFile.RenditionStatus.FAILED
+
+    _update(current, instance, rendition_status=UploadedFile.RenditionStatus.READY, renditions=manifest)
+    return UploadedFile.RenditionStatus.READY
+
+
+class BaseRenditionBackend:
+    """
+    Interface of the rendition backends.
+    """
+
+    def enqueue(self, file_id):
+        raise NotImplementedError
+
+
+class SynchronousBackend(BaseRenditionBackend):
+    """
+    Renders in the calling process once the upload is committed. Meant for tests and local debugging.
+    """
+
+    def enqueue(self, file_id):
+        render_renditions(file_id)
+
+
+def mark_failed(file_id):
+    """
+    Marks the renditions of the file as failed, for a worker that died before it could (e.g. killed by the OOM killer).
+    """
+    instance = UploadedFile.objects.filter(pk=file_id).first()
+    if instance is not None:
+        unfinished = [UploadedFile.RenditionStatus.PENDING, UploadedFile.RenditionStatus.PROCESSING]
+        _update(UploadedFile.objects.filter(pk=file_id, rendition_status__in=unfinished),
+                instance, rendition_status=UploadedFile.RenditionStatus.FAILED)
+
+
+def claim(ids):
+    """
+    Marks the files as processing, claimed now by the calling worker.
+    """
+    UploadedFile.objects.filter(id__in=ids).update(rendition_status=UploadedFile.RenditionStatus.PROCESSING,
+                                                   rendition_claimed_at=datetime.datetime.now(tz=pytz.utc),
+                                                   rendition_attempts=F('rendition_attempts') + 1)
+
+
+def requeue_stale(timeout, max_attempts):
+    """
+    Puts the files claimed more than `timeout` seconds ago and still processing back in the queue: their worker
+    was killed or redeployed before it could finish them. Those claimed `max_attempts` times already are marked
+    as failed instead. Returns the numbers of files requeued and failed.
+    """
+    cutoff = datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(seconds=timeout)
+    stale = UploadedFile.objects.filter(rendition_status=UploadedFile.RenditionStatus.PROCESSING,
+                                        rendition_claimed_at__lt=cutoff)
+    with transaction.atomic():
+        failed = stale.filter(rendition_attempts__gte=max_attempts).update_returning(
+            rendition_status=UploadedFile.RenditionStatus.FAILED)
+        requeued = stale.update_returning(rendition_status=UploadedFile.RenditionStatus.PENDING)
+        # update_returning sends no post_save signal
+        for instance in failed + requeued:
+            caching.invalidate_payload(instance.pk)
+        for user_id in {instance.created_by_id for instance in failed + requeued}:
+            User.bump_library_version(user_id)
+    for instance in failed:
+        logger.error("Rendering the thumbnails of file %s was interrupted %s times", instance.pk, instance.rendition_attempts)
+    return len(requeued), len(failed)
+
+
+def start_workers(max_workers):
+    """
+    Pool of spawned worker processes, each under the budgets of settings.RENDITION_MEMORY_LIMIT and RENDITION_TIME_LIMIT.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=workers.init_worker,
+                               initargs=(settings.RENDITION_MEMORY_LIMIT, settings.RENDITION_TIME_LIMIT))
+
+
+def _render_finished(file_id, future):
+    """
+    Called in the web process once a worker is done with the file. The worker dropped the file's payload and its
+    owner's cached user from its own cache, which is not this process's unless the cache is shared (REDIS_URL):
+    they are dropped here too, so the web process does not keep serving the pending payload and the old ETags.
+    """
+    if future.exception() is not None:
+        logger.error("Rendition worker crashed", exc_info=future.exception())
+        mark_failed(file_id)
+        return
+    owner_id = UploadedFile.objects.filter(pk=file_id).values_list('created_by_id', flat=True).first()
+    caching.invalidate_payload(file_id)
+    if owner_id is not None:
+        caching.invalidate_user(owner_id)
+
+
+_render_pool = {'executor': None}
+_render_pool_lock = threading.Lock()
+
+
+def render_in_worker(*args):
+    """
+    Calls render_original with the arguments on the render workers: `settings.RENDER_WORKERS` processes of the
+    current process, started on the first call, under the budgets of RENDITION_MEMORY_LIMIT and
+    RENDITION_TIME_LIMIT (raising MemoryError and workers.TaskTimeout). With no workers it runs in this process.
+    """
+    if not settings.RENDER_WORKERS:
+        return render_original(*args)
+    with _render_pool_lock:
+        if _render_pool['executor'] is None:
+            _render_pool['executor'] = start_workers(settings.RENDER_WORKERS)
+        executor = _render_pool['executor']
+    try:
+        return executor.submit(workers.run, RENDER_ORIGINAL_TASK, *args).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed by the OOM killer): the next render starts a fresh pool
+        with _render_pool_lock:
+            if _render_pool['executor'] is executor:
+                _render_pool['executor'] = None
+        raise
+
+
+class ProcessPoolBackend(BaseRenditionBackend):
+    """
+    Renders on a pool of local worker processes (`settings.RENDITION_WORKERS`).
+    The workers are spawned on the first upload and reused afterwards.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = start_workers(settings.RENDITION_WORKERS)
+            return self._executor
+
+    def enqueue(self, file_id):
+        try:
+            future = self._get_executor().submit(workers.run, RENDER_TASK, file_id)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OOM killer); start a fresh pool
+            with self._lock:
+                self._executor = None
+            future = self._get_executor().submit(workers.run, RENDER_TASK, file_id)
+        future.add_done_callback(functools.partial(_render_finished, file_id))
+
+
+class DatabaseQueueBackend(BaseRenditionBackend):
+    """
+    Uses the pending files in the database as the queue.
+    Nothing happens in the web process; `python manage.py render_pending` picks the files up.
+    """
+
+    def enqueue(self, file_id):
+        pass
+
+
+_backends = {}
+
+
+def get_backend():
+    path = settings.RENDITION_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def enqueue_renditions(instance):
+    """
+    Schedules the rendering of the thumbnails of the given file once the current transaction commits,
+    so the workers never see an uncommitted row.
+    """
+    file_id = instance.pk
+    transaction.on_commit(lambda: get_backend().enqueue(file_id))
@@ -1,114 +1,290 @@
+import datetime
+
+from PIL import Image
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
 
-from .models import UploadedFile, User, TempUrl
+from . import caching
+from .blobs import hash_file, release_blob, store_blob
+from .metadata import read_dimensions, read_metadata
+from .models import UploadedFile, User, UploadSession
+from .orphans import record_orphans
+from .renditions import get_rendition_name, rendition_names
+from .tiers import get_tier
 
 
 def validate_image_format(content_type):
     """
     Validating the image file format.
-    Currently valid: png, jpeg
+    Currently valid: png, jpeg, webp
     """
 
     if content_type == "image/png":
         return "PNG"
     elif content_type == "image/jpeg":
         return "JPEG"
+    elif content_type == "image/webp":
+        return "WEBP"
     else:
         raise serializers.ValidationError("Invalid file format")
 
 
-class FileSerializer(serializers.ModelSerializer):
+def validate_image_file(file):
     """
-    Serializer of the Uploaded File model
+    Checks that the uploaded file is an image Pillow can open.
     """
-    created_by = serializers.ReadOnlyField(source='created_by.username')
-    created_by_id = serializers.ReadOnlyField(source='created_by.id', required=False, default=None)
+    try:
+        serializers.ImageField().run_validation(file)
+    except DjangoValidationError as e:
+        raise serializers.ValidationError(e.messages)
 
-    class Meta:
-        model = UploadedFile
-        fields = ['id',
-                  'created_by',
-                  'created_by_id',
-                  'name',
-                  'file_format',
-                  'date_started',
-                  'last_edited'
-                  ]
 
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': "PNG",
+    b'\xff\xd8\xff': "JPEG",
+}
 
-class FileBasicSerializer(FileSerializer):
+
+def sniff_image_format(header):
     """
-    Serializer of the Uploaded File model for users at the Basic tier
+    Validating the image file format from the first bytes of the file instead of the declared content type.
+    Currently valid: png, jpeg, webp
     """
+    for signature, file_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return file_format
+    # WebP is a RIFF container: "RIFF", the 4 bytes of its size, then the form type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return "WEBP"
+    raise serializers.ValidationError("Invalid file format")
+
+
+def validate_file_size(size, tier):
+    if size > tier.max_file_size:
+        raise serializers.ValidationError(f"File too large: the account tier allows {tier.max_file_size} bytes")
 
-    image_url = serializers.ImageField(required=True, write_only=True)
-    image_thumbnail200 = serializers.ImageField(read_only=True)
 
-    class Meta(FileSerializer.Meta):
-        fields = FileSerializer.Meta.fields + ['image_url', 'image_thumbnail200',]
+def validate_pixels(width, height, tier):
+    if width * height > tier.max_pixels:
+        raise serializers.ValidationError(f"Image too large: {width}x{height} pixels, "
+                                          f"the account tier allows {tier.max_pixels} pixels")
 
 
-class FilePremiumSerializer(serializers.ModelSerializer):
+def validate_image_limits(file, tier):
     """
-    Serializer of the Uploaded File model for the users in the Premium tier
+    Guard against decompression bombs and oversized files, run before anything decodes the upload:
+    a few KB of PNG can declare a 20000x20000 image that takes GBs of memory to decode.
+    The format is sniffed from the first bytes (the declared content type is not trusted), then the size
+    in bytes and the pixel count declared in the header are checked against the limits of the tier.
+    Returns the sniffed format.
     """
+    validate_file_size(file.size, tier)
+    file.seek(0)
+    file_format = sniff_image_format(file.read(16))
+    try:
+        width, height = read_dimensions(file)
+    except Image.DecompressionBombError:
+        raise serializers.ValidationError(f"Image too large: the account tier allows {tier.max_pixels} pixels")
+    except Exception:
+        raise serializers.ValidationError("Invalid image file")
+    validate_pixels(width, height, tier)
+    file.seek(0)
+    return file_format
+
+
+def validate_file_name(name):
+    """
+    Checks the name of an upload like the `name` field of FileSerializer does (e.g. its length), for the upload
+    paths creating the file without it. Returns the validated name.
+    """
+    return FileSerializer().fields['name'].run_validation(name)
 
-    image_url = serializers.ImageField(required=True)
 
-    image_thumbnail200 = serializers.ImageField(read_only=True)
-    image_thumbnail400 = serializers.ImageField(read_only=True)
+class ThumbnailField(serializers.Field):
+    """
+    Read only url of the thumbnail of the given size.
+    Built from the rendition manifest stored with the file, so the storage is never consulted.
+    """
 
-    class Meta(FileSerializer.Meta):
-        fields = FileSerializer.Meta.fields + ['image_url', 'image_thumbnail200', 'image_thumbnail400', ]
+    def __init__(self, size, **kwargs):
+        self.size = size
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        name = get_rendition_name(instance, self.size)
+        if name is None:
+            return None
+        url = instance.image_url.storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
 
 
-class FileEnterpriseSerializer(serializers.ModelSerializer):
+class FileSerializer(serializers.ModelSerializer):
     """
-    Serializer of the Uploaded File model for the users in Enterprise tier
+    Serializer of the Uploaded File model.
+    The fields depend on the tier of the requesting user: only the thumbnails the tier offers are rendered,
+    and the link to the original image is write only unless the tier allows it.
+    Read requests can narrow the fields down further with the `fields` query parameter.
+    Uploaded images are stored once per distinct content, see blobs.py.
     """
+    created_by = serializers.ReadOnlyField(source='created_by.username')
+    created_by_id = serializers.ReadOnlyField(source='created_by.id', required=False, default=None)
 
-    image_url = serializers.ImageField(required=True)
-
-    image_thumbnail200 = serializers.ImageField(read_only=True)
-    image_thumbnail400 = serializers.ImageField(read_only=True)
+    class Meta:
+        model = UploadedFile
+        fields = ['id',
+                  'created_by',
+                  'created_by_id',
+                  'name',
+                  'file_format',
+                  'date_started',
+                  'last_edited',
+                  'rendition_status',
+                  'width',
+                  'height',
+                  'orientation',
+                  'color_mode',
+                  'file_size',
+                  'sha256',
+                  ]
+        read_only_fields = ['rendition_status', 'width', 'height', 'orientation', 'color_mode', 'file_size', 'sha256']
 
-    class Meta(FileSerializer.Meta):
-        fields = FileSerializer.Meta.fields + ['image_url', 'image_thumbnail200', 'image_thumbnail400', ]
+    def get_tier(self):
+        request = self.context.get('request')
+        return get_tier(request.user.tier if request is not None else None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        tier = self.get_tier()
+
+        fields['image_url'] = serializers.ImageField(required=True, write_only=not tier.original_link)
+        for size in tier.thumbnail_sizes:
+            fields[f'image_thumbnail{size}'] = ThumbnailField(size)
+
+        requested = self.get_requested_fields()
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    def create(self, validated_data):
+        upload = validated_data.pop('image_url')
+        with transaction.atomic():
+            blob = store_blob(upload, validated_data['file_format'])
+            return super().create({**validated_data, **read_metadata(upload, blob.sha256), 'blob': blob, 'image_url': blob.name})
+
+    def replace(self, queryset):
+        """
+        Replaces the file of the queryset (one file of its owner) with the validated upload, in a conditional
+        UPDATE returning the row instead of fetching the file and saving it whole. An upload of the bytes the file
+        already has (same SHA-256) only renames it and keeps its thumbnails; other content points it to the blob
+        of the upload and resets its thumbnails. Returns the file (None if the queryset matches none) and whether
+        its content changed.
+        """
+        upload = self.validated_data['image_url']
+        file_format = self.validated_data['file_format']
+        sha256 = hash_file(upload)
+        fields = {'name': self.validated_data['name'], 'last_edited': datetime.date.today()}
+
+        with transaction.atomic():
+            instance = next(iter(queryset.filter(sha256=sha256).update_returning(**fields)), None)
+            changed = instance is None
+            if changed:
+                previous = queryset.select_for_update().values_list('blob_id', 'image_url', 'renditions').first()
+                if previous is None:
+                    return None, False
+                blob = store_blob(upload, file_format, sha256=sha256)
+                instance, = queryset.update_returning(**fields, **read_metadata(upload, sha256), file_format=file_format,
+                                                      blob=blob, image_url=blob.name, renditions={},
+                                                      rendition_status=UploadedFile.RenditionStatus.PENDING, rendition_attempts=0)
+                previous_blob_id, previous_image_url, previous_renditions = previous
+                if previous_blob_id is not None:
+                    release_blob(previous_blob_id, rendition_names(previous_renditions))
+                else:
+                    record_orphans([previous_image_url, *rendition_names(previous_renditions)])
+
+            # update_returning sends no post_save signal
+            caching.invalidate_payload(instance.pk)
+            User.bump_library_version(instance.created_by_id)
+        return instance, changed
+
+    def get_requested_fields(self):
+        """
+        Sparse fieldset asked for with `?fields=id,name,...` on read requests, None for all fields.
+        """
+        request = self.context.get('request')
+        if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+            return None
+        return set(request.query_params['fields'].split(','))
 
 
 class UserSerializer(serializers.ModelSerializer):
     """
     Serializer of the customized User model
+    The ids of the user's images and expiring links are replaced by their number (`images_count`,
+    `expiry_links_count`, annotated by the view) when the `counts` context flag is set.
     """
 
-    images = serializers.PrimaryKeyRelatedField(many=True, queryset=UploadedFile.objects.all())
-    expiry_links = serializers.PrimaryKeyRelatedField(many=True, queryset=TempUrl.objects.all())
+    images = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    expiry_links = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    images_count = serializers.IntegerField(read_only=True)
+    expiry_links_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'tier', 'images', 'expiry_links']
+        fields = ['id', 'username', 'tier', 'images', 'expiry_links', 'images_count', 'expiry_links_count']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        dropped = ('images', 'expiry_links') if self.context.get('counts') else ('images_count', 'expiry_links_count')
+        for name in dropped:
+            fields.pop(name)
+        return fields
 
 
-class TempUrlSerializer(serializers.ModelSerializer):
+class ExpiringLinkSerializer(serializers.Serializer):
     """
-    Serializer of the TempUrl model
+    Serializer of a signed expiring link, see links.py
     """
 
+    id = serializers.CharField()
     token = serializers.CharField(write_only=True)
+    expiry_date = serializers.DateTimeField()
     temp_url = serializers.SerializerMethodField()
 
-    class Meta:
-        model = TempUrl
-        fields = ['id',
-
-                  'token',
-                  'expiry_date',
-                  'temp_url']
-
     def get_temp_url(self, obj):
         request = self.context.get('request')
 
         app_addr = request.META.get('HTTP_HOST', f"{request.META.get('REMOTE_ADDR')}:{request.META.get('SERVER_PORT')}")
-        _link = f"{request.scheme}://{app_addr}/exp/use/{obj.token}/"
+        _link = f"{request.scheme}://{app_addr}/exp/use/{obj['token']}/"
 
         return _link
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer of the UploadSession model, reporting the progress of the upload
+    """
+
+    progress = serializers.SerializerMethodField()
+    expires = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'name', 'size', 'received', 'progress', 'created', 'expires']
+        read_only_fields = ['received', 'created']
+
+    def validate_size(self, value):
+        max_size = settings.UPLOAD_MAX_SIZE
+        request = self.context.get('request')
+        if request is not None:
+            max_size = min(max_size, get_tier(request.user.tier).max_file_size)
+        if value <= 0 or value > max_size:
+            raise serializers.ValidationError(f"File size must be between 1 and {max_size} bytes")
+        return value
+
+    def get_progress(self, obj):
+        return round(100 * obj.received / obj.size, 1)
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import caching, tiers
+from .blobs import release_blob
+from .models import Tier, TempUrl, UploadedFile, User
+from .orphans import record_orphans
+from .renditions import rendition_names
+
+
+@receiver([post_save, post_delete], sender=Tier)
+def invalidate_tiers(sender, **kwargs):
+    tiers.invalidate()
+
+
+@receiver(post_delete, sender=UploadedFile)
+def release_file_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id, rendition_names(instance.renditions))
+    else:
+        record_orphans([instance.image_url.name, *rendition_names(instance.renditions)])
+
+
+@receiver([post_save, post_delete], sender=UploadedFile)
+def bump_library_version(sender, instance, **kwargs):
+    User.bump_library_version(instance.created_by_id)
+
+
+@receiver([post_save, post_delete], sender=UploadedFile)
+def invalidate_file_payload(sender, instance, **kwargs):
+    caching.invalidate_payload(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    caching.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    caching.invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=TempUrl)
+def invalidate_cached_link(sender, instance, **kwargs):
+    caching.invalidate_link(instance.token)
@@ -0,0 +1,67 @@
+"""
+In-process registry of the account tiers.
+
+The tiers are read from the database at once and cached for `settings.TIER_CACHE_TIMEOUT` seconds.
+Saving or deleting a tier clears the cache of the current process right away (see signals.py),
+other processes pick the change up when their cache expires.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Tier
+
+_cache = {'tiers': None, 'loaded_at': 0.0}
+
+
+def _expired():
+    return _cache['tiers'] is None or time.monotonic() - _cache['loaded_at'] > settings.TIER_CACHE_TIMEOUT
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _get_tiers():
+    tiers = _cache['tiers']
+    if _expired():
+        if tiers is not None and _in_event_loop():
+            # the ORM cannot be used from the event loop: keep the expired tiers until aget_tier reloads them
+            return tiers
+        tiers = {tier.name: tier for tier in Tier.objects.all()}
+        _cache.update(tiers=tiers, loaded_at=time.monotonic())
+    return tiers
+
+
+def get_tier(name):
+    """
+    Returns the tier with the given name. Unknown names get a tier without any features.
+    """
+    return _get_tiers().get(name) or Tier(name=name)
+
+
+async def aget_tier(name):
+    """
+    get_tier for async code: reloads the tiers in a thread when they expired,
+    so the calls to get_tier that follow within the request do not query.
+    """
+    if _expired():
+        await sync_to_async(_get_tiers)()
+    return get_tier(name)
+
+
+def all_thumbnail_sizes():
+    """
+    Every thumbnail size offered by any tier, so a file stays complete when its owner changes tier.
+    """
+    return sorted({size for tier in _get_tiers().values() for size in tier.thumbnail_sizes})
+
+
+def invalidate():
+    _cache['tiers'] = None
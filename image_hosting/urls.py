@@ -1,12 +1,13 @@
 from django.urls import include, path, re_path
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
 
 
 router = routers.DefaultRouter()
 router.register(r'images', viewset=views.UploadedFileViewset, basename='UploadedFile')
 router.register(r'users', viewset=views.UserViewset, basename='User')
+router.register(r'uploads', viewset=views.UploadSessionViewset, basename='UploadSession')
 
 
 # Wiring up the API using automatic URL routing.
@@ -14,7 +15,15 @@ router.register(r'users', viewset=views.UserViewset, basename='User')
 urlpatterns = [
     path('', include(router.urls)),
     re_path(r'^exp/generate/(?P<file_id>[0-9]+)/$', views.TempUrlViewset.as_view({'get': 'generate_link'}), name='generate_link'),
-    re_path(r'^exp/use/(?P<token>[-a-zA-Z0-9_]+)/$', views.TempUrlViewset.as_view({'get': 'use'}), name='use_link'),
+    re_path(r'^exp/use/(?P<token>[-a-zA-Z0-9_.]+)/$', views.TempUrlViewset.as_view({'get': 'use'}), name='use_link'),
+    re_path(r'^exp/revoke/(?P<token>[-a-zA-Z0-9_.]+)/$', views.TempUrlViewset.as_view({'post': 'revoke'}), name='revoke_link'),
+
+    # async (ASGI) versions of the image and expiring link endpoints, see async_views.py
+    path('async/images/', async_views.images, name='async_images'),
+    path('async/images/<int:pk>/', async_views.image_detail, name='async_image_detail'),
+    path('async/images/<int:pk>/file/', async_views.image_file, name='async_image_file'),
+    path('async/exp/generate/<int:file_id>/', async_views.generate_link, name='async_generate_link'),
+    re_path(r'^async/exp/use/(?P<token>[-a-zA-Z0-9_.]+)/$', async_views.use_link, name='async_use_link'),
 
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
@@ -1,43 +1,138 @@
-import datetime
-import pytz
-import operator
-from functools import reduce
-
+import hashlib
+import io
+import os
+import re
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.shortcuts import redirect
-from django.db.models import Q
+from django.http import Http404, QueryDict
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from PIL import Image
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import NotAcceptable, ValidationError
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.response import Response
 from rest_framework import permissions
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 
 
-from .models import UploadedFile, User, TempUrl, randomString
-from .serializers import UserSerializer, validate_image_format, FileBasicSerializer, FilePremiumSerializer, FileEnterpriseSerializer, TempUrlSerializer
+from . import caching, render_cache
+from .blobs import delete_uploaded_files, store_blob
+from .links import SCOPE_DETAIL, SCOPE_FILE, SCOPES, InvalidLink, ExpiredLink, RevokedLink, create_link, resolve_link, revoke_link
+from .media import not_modified, serve_file
+from .metadata import read_dimensions, read_metadata
+from .models import UploadedFile, User, TempUrl, UploadSession
+from .pagination import UploadedFileCursorPagination, UserCursorPagination
+from .renditions import RENDER_FITS, RENDER_FORMATS, RENDER_NEGOTIATED, ImageTooLarge, enqueue_renditions, negotiate_format, negotiate_rendition, render_in_worker
+from .workers import TaskTimeout
+from .serializers import UserSerializer, validate_file_name, validate_image_format, sniff_image_format, validate_image_file, validate_image_limits, validate_pixels, FileSerializer, ExpiringLinkSerializer, UploadSessionSerializer
+from .tiers import get_tier
+
+
+def library_etag(request, *parts):
+    """
+    ETag of image metadata served to the user. It changes whenever any of the user's files changes
+    (library version), with the user's tier definition and with the query parameters.
+    The user row is already loaded by the authentication, so computing it costs no query.
+    """
+    tier = get_tier(request.user.tier)
+    key = [request.user.pk, request.user.library_version, tier.name, tier.thumbnail_sizes, tier.original_link,
+           request.get_full_path(), *parts]
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def payload_variant(request, last_edited):
+    """
+    What the serialized payload of one of the user's files depends on besides the file itself.
+    """
+    tier = get_tier(request.user.tier)
+    return repr((str(last_edited), tier.name, tier.thumbnail_sizes, tier.original_link, request.user.username,
+                 request.get_host(), request.GET.get('fields', '')))
 
 
+def rendition_etag(rendition):
+    return hashlib.sha1(f"{rendition['name']}:{rendition['bytes']}".encode()).hexdigest()
 
-def get_serializer_for_tier(tier):
-    if tier == 'Enterprise':
-        return FileEnterpriseSerializer
-    elif tier == 'Premium':
-        return FilePremiumSerializer
-    else:
-        return FileBasicSerializer
 
+def conditional_response(request, response, etag):
+    response['ETag'] = quote_etag(etag)
+    max_age = get_tier(request.user.tier).cache_max_age
+    response['Cache-Control'] = f'private, max-age={max_age}' if max_age else 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
 
-class MultipleFieldLookupMixin(object):
-    def get_object(self):
-        queryset = self.get_queryset()
-        queryset = self.filter_queryset(queryset)
-        filter = {}
-        for field in self.lookup_fields:
-            filter[field] = self.kwargs[field]
-        q = reduce(operator.or_, (Q(x) for x in filter.items()))
-        return get_object_or_404(queryset, q)
+
+# list query parameters filtering on the image dimensions
+DIMENSION_FILTERS = {
+    'min_width': 'width__gte',
+    'max_width': 'width__lte',
+    'min_height': 'height__gte',
+    'max_height': 'height__lte',
+}
+
+
+def filter_images(queryset, params):
+    """
+    Narrows the user's files down to those matching the metadata filters of the query parameters:
+    `min_width`, `max_width`, `min_height`, `max_height` (pixels), `orientation` and `sha256`,
+    each served by an index on the owner and the column (see UploadedFile.Meta).
+    Raises ValueError with the message for the client when a value is invalid.
+    """
+    filters = {}
+    for param, lookup in DIMENSION_FILTERS.items():
+        value = params.get(param)
+        if value is not None:
+            if not value.isdigit():
+                raise ValueError(f"'{param}' must be a number of pixels")
+            filters[lookup] = int(value)
+    orientation = params.get('orientation')
+    if orientation is not None:
+        if orientation not in UploadedFile.Orientation.values:
+            raise ValueError(f"Invalid orientation: {orientation}. Allowed: {', '.join(UploadedFile.Orientation.values)}")
+        filters['orientation'] = orientation
+    if params.get('sha256'):
+        filters['sha256'] = params['sha256'].lower()
+    return queryset.filter(**filters)
+
+
+class MediaContentNegotiation(DefaultContentNegotiation):
+    """
+    Content negotiation of the endpoints sending images. Only their errors go through a renderer,
+    so an Accept header listing image types alone (e.g. image/webp) falls back to the first renderer
+    instead of failing with 406.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+def get_link(token):
+    """
+    Returns the expiring link of the token and None, or None and the error response
+    for an expired or revoked link. Raises Http404 for an invalid token.
+    """
+    try:
+        return resolve_link(token), None
+    except ExpiredLink:
+        return None, Response({"error": "This url has expired"}, status=status.HTTP_403_FORBIDDEN)
+    except RevokedLink:
+        return None, Response({"error": "This url has been revoked"}, status=status.HTTP_403_FORBIDDEN)
+    except InvalidLink:
+        raise Http404
 
 
 class UploadedFileViewset(viewsets.ViewSet):
@@ -47,26 +142,56 @@ class UploadedFileViewset(viewsets.ViewSet):
 
     def list(self, request):
         """
-        Method that lists all uploaded files for the authenticated user
+        Method that lists the uploaded files of the authenticated user, newest first, one page at a time.
+        Query parameters: `cursor` (from the `next` link), `page_size`, `fields` (comma separated field names)
+        and the metadata filters of filter_images.
+        Answers 304 without querying the files when the `If-None-Match` ETag is still current.
+        The payloads of the files are cached, see caching.py.
         """
-        images = self.queryset.filter(created_by__id=request.user.id)
-        serializer = get_serializer_for_tier(request.user.tier)(images, context={"request": request}, many=True)
+        etag = library_etag(request)
+        if not_modified(request, etag):
+            return conditional_response(request, Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+        images = self.queryset.filter(created_by__id=request.user.id).select_related('created_by')
+        try:
+            images = filter_images(images, request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = UploadedFileCursorPagination()
+        page = paginator.paginate_queryset(images, request, view=self)
+
+        variants = {image.pk: payload_variant(request, image.last_edited) for image in page}
+        payloads = caching.get_payloads(variants)
+        missing = [image for image in page if image.pk not in payloads]
+        if missing:
+            serializer = FileSerializer(missing, context={"request": request}, many=True)
+            rendered = {image.pk: dict(data) for image, data in zip(missing, serializer.data)}
+            caching.set_payloads({pk: (variants[pk], data) for pk, data in rendered.items()})
+            payloads.update(rendered)
 
-        return Response(serializer.data)
+        results = [payloads[image.pk] for image in page]
+        return conditional_response(request, paginator.get_paginated_response(results), etag)
 
     def retrieve(self, request, pk):
         """
         Retrieve the Uploaded image with given id (pk) for authenticated user.
+        Answers 304 without serializing when the `If-None-Match` ETag is still current,
+        otherwise the cached payload is sent if there is one.
         """
-        image_instance = get_object_or_404(self.queryset, pk=pk, created_by__id=request.user.id)
-        serializer = get_serializer_for_tier(request.user.tier)(image_instance, context={"request": request})
+        last_edited = get_object_or_404(self.queryset.values_list('last_edited', flat=True), pk=pk, created_by__id=request.user.id)
+        etag = library_etag(request, pk, last_edited)
+        if not_modified(request, etag):
+            return conditional_response(request, Response(status=status.HTTP_304_NOT_MODIFIED), etag)
 
-        try:
-            print(serializer.data)
-        except Exception as e:
-            print(e)
+        variant = payload_variant(request, last_edited)
+        payload = caching.get_payloads({int(pk): variant}).get(int(pk))
+        if payload is None:
+            image_instance = get_object_or_404(self.queryset, pk=pk, created_by__id=request.user.id)
+            serializer = FileSerializer(image_instance, context={"request": request})
+            payload = dict(serializer.data)
+            caching.set_payloads({image_instance.pk: (variant, payload)})
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return conditional_response(request, Response(payload, status=status.HTTP_200_OK), etag)
 
     def post(self, request):
         """
@@ -80,6 +205,10 @@ class UploadedFileViewset(viewsets.ViewSet):
             file_format = validate_image_format(new_file.content_type)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_format = validate_image_limits(new_file, get_tier(request.user.tier))
+        except ValidationError as e:
+            return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
 
         new_data = {
             "name": new_file.name,
@@ -88,23 +217,27 @@ class UploadedFileViewset(viewsets.ViewSet):
             'created_by': request.user.pk
         }
 
-        serializer = get_serializer_for_tier(request.user.tier)(data=new_data, context={"request": request})
+        serializer = FileSerializer(data=new_data, context={"request": request})
 
         if serializer.is_valid(raise_exception=True):
-            serializer.save(created_by=request.user)
+            instance = serializer.save(created_by=request.user)
+            enqueue_renditions(instance)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def put(self, request, pk):
         """
         Updates the Upload Image object with given id (pk) if exists for authenticated user.
+        The thumbnails are only rendered again if the content of the file changed, see FileSerializer.replace.
         """
-        image_instance = get_object_or_404(self.queryset, pk=pk, created_by__id=request.user.id)
-
         updated_file = request.data.get('new_file')
         try:
             file_format = validate_image_format(updated_file.content_type)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_format = validate_image_limits(updated_file, get_tier(request.user.tier))
+        except ValidationError as e:
+            return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
 
         updated_data = {
             "name": updated_file.name,
@@ -112,28 +245,361 @@ class UploadedFileViewset(viewsets.ViewSet):
             "image_url": updated_file
         }
 
-        serializer = get_serializer_for_tier(request.user.tier)(instance=image_instance, data=updated_data, partial=True, context={"request": request})
+        serializer = FileSerializer(data=updated_data, partial=True, context={"request": request})
         if serializer.is_valid(raise_exception=True):
-            serializer.save(created_by=request.user)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            instance, changed = serializer.replace(self.queryset.filter(pk=pk, created_by__id=request.user.id))
+            if instance is None:
+                raise Http404
+            if changed:
+                enqueue_renditions(instance)
+            instance.created_by = request.user
+            return Response(FileSerializer(instance, context={"request": request}).data, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
         """
         Deletes the Uploaded image object with given id (pk) if exists for authenticated user
         """
-        image_instance = get_object_or_404(self.queryset, pk=pk, created_by__id=request.user.id)
-        image_instance.delete()
+        if not delete_uploaded_files(self.queryset.filter(pk=pk, created_by__id=request.user.id)):
+            raise Http404
 
         return Response({"result": "Image deleted"}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'], url_path='file', url_name='file', content_negotiation_class=MediaContentNegotiation)
+    def download(self, request, pk):
+        """
+        Sends the original image, or its thumbnail with `?size=<size>`, if the user's tier allows it.
+        Thumbnails are sent as WebP or AVIF to the clients accepting them (see renditions.THUMBNAIL_VARIANTS).
+        The original can also be fetched with the `token` of a valid expiring link to the file (`scope=file`).
+        """
+        tier = get_tier(request.user.tier)
+        token = request.query_params.get('token')
+        if token:
+            if not tier.expiring_link:
+                return Response({"error": "Given account tier does not support this feature"},
+                                status=status.HTTP_403_FORBIDDEN)
+            link, error = get_link(token)
+            if error is not None:
+                return error
+            if link.scope != SCOPE_FILE:
+                return Response({"error": "This url does not give access to the file"}, status=status.HTTP_403_FORBIDDEN)
+            if str(link.file_id) != pk:
+                raise Http404
+            image_instance = get_object_or_404(self.queryset.select_related('blob'), pk=pk)
+        else:
+            image_instance = get_object_or_404(self.queryset.select_related('blob'), pk=pk, created_by__id=request.user.id)
+
+        storage = image_instance.image_url.storage
+        size = request.query_params.get('size')
+        if size is None:
+            if not tier.original_link and not token:
+                return Response({"error": "Given account tier does not support this feature"},
+                                status=status.HTTP_403_FORBIDDEN)
+            name = image_instance.image_url.name
+            if image_instance.blob is not None:
+                etag = image_instance.blob.sha256
+            else:
+                etag = f"{storage.size(name):x}-{int(storage.get_modified_time(name).timestamp()):x}"
+        else:
+            if not size.isdigit() or int(size) not in tier.thumbnail_sizes:
+                return Response({"error": f"Thumbnail size {size} is not available for the account tier"},
+                                status=status.HTTP_403_FORBIDDEN)
+            rendition = image_instance.renditions.get(size)
+            if rendition is None:
+                return Response({"error": "Thumbnail not rendered yet"}, status=status.HTTP_404_NOT_FOUND)
+            rendition = negotiate_rendition(rendition, request.META.get('HTTP_ACCEPT'))
+            name = rendition['name']
+            etag = rendition_etag(rendition)
+
+        response = serve_file(request, storage, name, etag)
+        if size is not None:
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    @action(detail=True, methods=['get'], url_path='render', url_name='render', content_negotiation_class=MediaContentNegotiation)
+    def render_image(self, request, pk):
+        """
+        Sends the image rendered at `?w=<width>&h=<height>`, one of the render sizes of the user's tier,
+        cropped to fill the size (`fit=cover`, the default) or fitted inside it (`fit=contain`),
+        in the `fmt` format (jpeg, png, webp or avif), by default the smallest one the client accepts
+        (falling back to jpeg). Renders are cached on disk, see render_cache.py.
+        """
+        tier = get_tier(request.user.tier)
+        width, height = request.query_params.get('w', ''), request.query_params.get('h', '')
+        if not width.isdigit() or not height.isdigit():
+            return Response({"error": "Give the size to render as 'w' and 'h'"}, status=status.HTTP_400_BAD_REQUEST)
+        width, height = int(width), int(height)
+        if [width, height] not in tier.render_sizes:
+            return Response({"error": f"Render size {width}x{height} is not available for the account tier"},
+                            status=status.HTTP_403_FORBIDDEN)
+        fit = request.query_params.get('fit', RENDER_FITS[0])
+        if fit not in RENDER_FITS:
+            return Response({"error": f"Invalid fit: {fit}. Allowed: {', '.join(RENDER_FITS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('fmt')
+        negotiated = fmt is None
+        if negotiated:
+            fmt = negotiate_format(request.META.get('HTTP_ACCEPT'), RENDER_NEGOTIATED) or 'jpeg'
+        if fmt not in RENDER_FORMATS:
+            return Response({"error": f"Invalid format: {fmt}. Allowed: {', '.join(RENDER_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        image_instance = get_object_or_404(self.queryset.select_related('blob'), pk=pk, created_by__id=request.user.id)
+        source_id = image_instance.blob.sha256 if image_instance.blob is not None else image_instance.image_url.name
+        key = render_cache.render_key(source_id, width, height, fit, fmt)
+        pillow_format, extension, options = RENDER_FORMATS[fmt]
+        name = render_cache.cache_name(key, extension)
+
+        def render():
+            return render_in_worker(image_instance.image_url.name, tier.max_pixels, width, height, fit,
+                                    pillow_format, options)
+
+        # a client revalidating its copy needs no render, even if it was evicted since
+        try:
+            outcome = None if not_modified(request, key) else render_cache.get_or_render(name, render)
+        except ImageTooLarge as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except (TaskTimeout, MemoryError, BrokenProcessPool):
+            return Response({"error": "The image cannot be rendered within the limits of the server"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = serve_file(request, render_cache.storage(), name, key, accel_prefix=settings.RENDER_CACHE_ACCEL_PREFIX)
+        if outcome is not None:
+            response['X-Render-Cache'] = outcome
+        if negotiated:
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_upload(self, request):
+        """
+        Creates an uploaded file for each file sent as `new_files`, in a single transaction and insert.
+        Invalid files are reported per item without failing the others.
+        """
+        new_files = request.FILES.getlist('new_files')
+        if not new_files or len(new_files) > settings.BULK_MAX_ITEMS:
+            return Response({"error": f"Send between 1 and {settings.BULK_MAX_ITEMS} files as 'new_files'"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        tier = get_tier(request.user.tier)
+        results = [None] * len(new_files)
+        valid = []
+        for index, new_file in enumerate(new_files):
+            try:
+                validate_file_name(new_file.name)
+                validate_image_format(new_file.content_type)
+                file_format = validate_image_limits(new_file, tier)
+                validate_image_file(new_file)
+            except ValidationError as e:
+                results[index] = {"name": new_file.name, "status": status.HTTP_400_BAD_REQUEST, "error": e.detail[0]}
+            else:
+                valid.append((index, new_file, file_format))
+
+        with transaction.atomic():
+            instances = []
+            for index, new_file, file_format in valid:
+                blob = store_blob(new_file, file_format)
+                instances.append(UploadedFile(name=new_file.name, file_format=file_format, created_by=request.user,
+                                              blob=blob, image_url=blob.name, **read_metadata(new_file, blob.sha256)))
+            instances = UploadedFile.objects.bulk_create(instances)
+            for instance in instances:
+                enqueue_renditions(instance)
+            # bulk_create sends no post_save signals
+            User.bump_library_version(request.user.pk)
+
+        data = FileSerializer(instances, context={"request": request}, many=True).data
+        for (index, new_file, file_format), item in zip(valid, data):
+            results[index] = {"name": new_file.name, "status": status.HTTP_201_CREATED, "image": item}
+
+        return Response({"results": results}, status=status.HTTP_207_MULTI_STATUS)
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete', url_name='bulk_delete', parser_classes=(JSONParser, FormParser))
+    def bulk_delete(self, request):
+        """
+        Deletes the uploaded files of the authenticated user with the given `ids` in a single transaction.
+        """
+        # form data repeats the key, json sends a list
+        if isinstance(request.data, QueryDict):
+            ids = request.data.getlist('ids')
+        elif isinstance(request.data, dict):
+            ids = request.data.get('ids')
+        else:
+            ids = None
+        # a string would be split into its characters
+        if not isinstance(ids, list):
+            return Response({"error": "'ids' must be a list of image ids"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = [int(file_id) for file_id in ids]
+        except (TypeError, ValueError):
+            return Response({"error": "'ids' must be a list of image ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > settings.BULK_MAX_ITEMS:
+            return Response({"error": f"Send between 1 and {settings.BULK_MAX_ITEMS} ids"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        found = set(delete_uploaded_files(self.queryset.filter(created_by__id=request.user.id, id__in=ids)))
+
+        results = [{"id": file_id, "status": status.HTTP_200_OK} if file_id in found
+                   else {"id": file_id, "status": status.HTTP_404_NOT_FOUND, "error": "Not found"}
+                   for file_id in ids]
+        return Response({"results": results}, status=status.HTTP_207_MULTI_STATUS)
+
 
-class TempUrlViewset(MultipleFieldLookupMixin, viewsets.ModelViewSet):
+class UploadSessionViewset(viewsets.ViewSet):
+    """
+    Resumable chunked uploads.
+    Create a session with the file name and size, PUT the bytes in order with a `Content-Range: bytes start-end/size`
+    header (resuming from `received` after a dropped connection) and finalize it into an uploaded image
+    before the session expires.
+    """
+    permission_classes = (IsAuthenticated,)
+    block_size = 64 * 1024
+    content_range_pattern = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def get_session(self, request, pk):
+        return get_object_or_404(UploadSession, pk=pk, user=request.user)
+
+    def expired(self, session):
+        self.discard(session)
+        return Response({"error": "Upload session expired"}, status=status.HTTP_410_GONE)
+
+    def create(self, request):
+        """
+        Starts a new upload session, up to UPLOAD_SESSION_MAX_OPEN unexpired sessions per user
+        """
+        open_sessions = UploadSession.objects.filter(user=request.user, created__gte=UploadSession.expiry_cutoff())
+        if open_sessions.count() >= settings.UPLOAD_SESSION_MAX_OPEN:
+            return Response({"error": f"At most {settings.UPLOAD_SESSION_MAX_OPEN} uploads can be open at once"},
+                            status=status.HTTP_409_CONFLICT)
+        serializer = UploadSessionSerializer(data=request.data, context={"request": request})
+        if serializer.is_valid(raise_exception=True):
+            serializer.save(user=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk):
+        """
+        Reports the progress of the upload session with given id (pk)
+        """
+        return Response(UploadSessionSerializer(self.get_session(request, pk)).data, status=status.HTTP_200_OK)
+
+    def update(self, request, pk):
+        """
+        Appends the chunk in the request body to the upload. The body is streamed to the staging file
+        in small blocks, never held in memory. The first chunk must start with a valid image signature.
+        """
+        session = self.get_session(request, pk)
+        if session.expired:
+            return self.expired(session)
+
+        match = self.content_range_pattern.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if match is None:
+            return Response({"error": "A 'Content-Range: bytes start-end/size' header is required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start, end, size = (int(value) for value in match.groups())
+        length = end - start + 1
+
+        if size != session.size or end >= size or length <= 0:
+            return Response({"error": f"Invalid range for a file of {session.size} bytes"},
+                            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        if start != session.received:
+            return Response({"error": f"Expected the chunk starting at byte {session.received}"},
+                            status=status.HTTP_409_CONFLICT)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response({"error": f"Chunks are limited to {settings.UPLOAD_CHUNK_MAX_SIZE} bytes"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        stream = request.stream
+        first_block = stream.read(min(self.block_size, length)) if stream is not None else b''
+        if start == 0:
+            try:
+                session.file_format = sniff_image_format(first_block)
+                self.check_header(first_block, get_tier(request.user.tier))
+            except ValidationError as e:
+                self.discard(session)
+                return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+        mode = 'r+b' if os.path.exists(session.staging_path) else 'wb'
+        with open(session.staging_path, mode) as staged:
+            # overwrite whatever an interrupted attempt at this chunk left behind
+            staged.seek(start)
+            written = staged.write(first_block)
+            while written < length:
+                block = stream.read(min(self.block_size, length - written))
+                if not block:
+                    break
+                written += staged.write(block)
+            staged.truncate()
+
+        if written < length:
+            return Response({"error": f"Incomplete chunk: received {written} of {length} bytes"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # conditional update, so a concurrent request for the same chunk cannot advance the session twice
+        UploadSession.objects.filter(pk=session.pk, received=start).update(received=end + 1,
+                                                                           file_format=session.file_format)
+        session.refresh_from_db()
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_200_OK)
+
+    def check_header(self, first_block, tier):
+        """
+        Rejects a declared image too large for the tier as soon as its header arrives. Headers that do not
+        fit in the first block (e.g. JPEGs with large EXIF) are checked when the upload is finalized.
+        """
+        try:
+            width, height = read_dimensions(io.BytesIO(first_block))
+        except Image.DecompressionBombError:
+            raise ValidationError(f"Image too large: the account tier allows {tier.max_pixels} pixels")
+        except Exception:
+            return
+        validate_pixels(width, height, tier)
+
+    def destroy(self, request, pk):
+        """
+        Aborts the upload session with given id (pk)
+        """
+        self.discard(self.get_session(request, pk))
+        return Response({"result": "Upload cancelled"}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], url_path='finalize', url_name='finalize')
+    def finalize(self, request, pk):
+        """
+        Turns a completely received upload session into an uploaded image.
+        """
+        session = self.get_session(request, pk)
+        if session.expired:
+            return self.expired(session)
+        if session.received != session.size:
+            return Response({"error": f"Upload incomplete: received {session.received} of {session.size} bytes"},
+                            status=status.HTTP_409_CONFLICT)
+
+        with open(session.staging_path, 'rb') as staged, transaction.atomic():
+            # named like the upload, whose extension validate_image_file checks as in post()
+            source = File(staged, name=session.name)
+            try:
+                validate_image_limits(source, get_tier(request.user.tier))
+                validate_image_file(source)
+            except ValidationError as e:
+                self.discard(session)
+                return Response({"error": e.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+            blob = store_blob(source, session.file_format)
+            instance = UploadedFile.objects.create(name=session.name, file_format=session.file_format, created_by=request.user,
+                                                   blob=blob, image_url=blob.name, **read_metadata(source, blob.sha256))
+        self.discard(session)
+        enqueue_renditions(instance)
+
+        serializer = FileSerializer(instance, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def discard(self, session):
+        if os.path.exists(session.staging_path):
+            os.remove(session.staging_path)
+        session.delete()
+
+
+class TempUrlViewset(viewsets.ViewSet):
     """
     Generic View for creating and using Temporary Urls for Enterprise Users.
+    The links are signed and stateless, see links.py
     """
-    queryset = TempUrl.objects.all()
     permission_classes = [IsAuthenticated, ]
-    lookup_fields = ('file_id', 'token')
     min_duration = 300
     max_duration = 30000
 
@@ -142,27 +608,29 @@ class TempUrlViewset(MultipleFieldLookupMixin, viewsets.ModelViewSet):
         """
         Method that creates a temporary url for an uploaded file for Enterprise Users
         Expects a query parameter for the number of seconds until expiration (between 300 and 30000).
-        If not given, the default is the minimum option
+        If not given, the default is the minimum option.
+        `?scope=file` creates a link to the original image instead of the file information.
         """
 
-        if request.user.tier != 'Enterprise':
+        if not get_tier(request.user.tier).expiring_link:
             return Response({"error": "Given account tier does not support this feature"},
                             status=status.HTTP_403_FORBIDDEN)
-        original_file = get_object_or_404(UploadedFile, pk=file_id)
+        if not UploadedFile.objects.filter(pk=file_id, created_by_id=request.user.id).exists():
+            raise Http404
 
         link_time = int(self.request.query_params.get('time', 300))
         if link_time < self.min_duration or link_time > self.max_duration:
             return Response({"error": f"Time requested: {link_time}. Allowed range: {self.min_duration}-{self.max_duration}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        req = {
-            'token': randomString(stringLength=20),
-            'expiry_date': datetime.datetime.now() + datetime.timedelta(seconds=link_time)
-        }
-        serializer = TempUrlSerializer(data=req, context={"request": request})
+        scope = self.request.query_params.get('scope', SCOPE_DETAIL)
+        if scope not in SCOPES:
+            return Response({"error": f"Invalid scope: {scope}. Allowed: {', '.join(SCOPES)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if serializer.is_valid(raise_exception=True):
-            serializer.save(user=request.user, related_file=original_file)
+        link, token = create_link(int(file_id), link_time, scope=scope)
+        serializer = ExpiringLinkSerializer({'id': link.id, 'token': token, 'expiry_date': link.expiry_date},
+                                            context={"request": request})
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -170,27 +638,77 @@ class TempUrlViewset(MultipleFieldLookupMixin, viewsets.ModelViewSet):
     def use(self, request, token):
         """
         Method that handles a temporary url for an uploaded file for Enterprise Users
-        If the link is still active, it redirects to the file information
+        If the link is still active, it redirects to the file information (or the original image)
         """
-        if request.user.tier != 'Enterprise':
+        if not get_tier(request.user.tier).expiring_link:
             return Response({"error": "Given account tier does not support this feature"},
                             status=status.HTTP_403_FORBIDDEN)
 
-        # check if this is an existing temporary url
-        temp_url = get_object_or_404(self.queryset, token=token)
+        link, error = get_link(token)
+        if error is not None:
+            return error
+
+        if link.scope == SCOPE_FILE:
+            return redirect(f"{reverse('UploadedFile-file', args=[link.file_id])}?token={token}")
+        return redirect('UploadedFile-detail', link.file_id)
 
-        if datetime.datetime.now().replace(tzinfo=pytz.utc) > temp_url.expiry_date:
-            return Response({"error": "This url has expired"},
+    @action(detail=True, methods=['post'], lookup_field='token', name='Revoke Expiry Link', url_name='revoke')
+    def revoke(self, request, token):
+        """
+        Revokes a temporary url of one of the user's files before it expires.
+        """
+        if not get_tier(request.user.tier).expiring_link:
+            return Response({"error": "Given account tier does not support this feature"},
                             status=status.HTTP_403_FORBIDDEN)
 
-        return redirect('UploadedFile-detail', temp_url.related_file_id)
+        link, error = get_link(token)
+        if error is not None:
+            return error
+        if not UploadedFile.objects.filter(pk=link.file_id, created_by_id=request.user.id).exists():
+            raise Http404
+
+        if link.id.startswith('legacy-'):
+            TempUrl.objects.filter(token=token).delete()
+        else:
+            revoke_link(link)
+
+        return Response({"result": "Link revoked"}, status=status.HTTP_200_OK)
+
+
+def count_rows(model, field):
+    """
+    Number of rows of the model pointing to the outer row through `field`, as a correlated subquery:
+    counting both relations with joins would multiply their rows.
+    """
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk'))
+    return Coalesce(Subquery(rows.values('count')), 0)
 
 
 class UserViewset(viewsets.ReadOnlyModelViewSet):
     """
     Generic View for listing the Users.
     Only accessible by admin users currently.
+    Pages of users cost a fixed number of queries: the ids of their images and expiring links are
+    prefetched, or with `?counts=1` only counted, in the same query as the users.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = UserCursorPagination
+
+    def counts_requested(self):
+        return self.request.query_params.get('counts') in ('1', 'true')
+
+    def get_queryset(self):
+        queryset = User.objects.only('id', 'username', 'tier')
+        if self.counts_requested():
+            return queryset.annotate(images_count=count_rows(UploadedFile, 'created_by'),
+                                     expiry_links_count=count_rows(TempUrl, 'user'))
+        return queryset.prefetch_related(
+            Prefetch('images', queryset=UploadedFile.objects.only('id', 'created_by').order_by('id')),
+            Prefetch('expiry_links', queryset=TempUrl.objects.only('id', 'user').order_by('id')),
+        )
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'counts': self.counts_requested()}
+
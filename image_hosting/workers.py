@@ -0,0 +1,87 @@
+"""
+Entry points of the background worker processes.
+
+This module must stay importable before Django is set up: spawned workers unpickle references
+to these functions before anything else runs, so models are only imported lazily.
+
+Each worker runs under a budget, so a hostile image that got past the upload checks fails its own
+render instead of taking the host down: a cap of its address space (allocations beyond it raise
+MemoryError) and a time limit per task (raising TaskTimeout). Both are enforced where the platform
+supports them (POSIX), and disabled by a limit of 0.
+"""
+import contextlib
+import signal
+import warnings
+
+import django
+from django.utils.module_loading import import_string
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_time_limit = 0
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def limit_memory(limit):
+    if resource is None or not limit:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def init_worker(memory_limit=0, time_limit=0):
+    global _time_limit
+    django.setup()
+    limit_memory(memory_limit)
+    _time_limit = time_limit
+    # Pillow only warns between Image.MAX_IMAGE_PIXELS and twice that; a worker refuses to decode those too
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+@contextlib.contextmanager
+def budget(memory_limit=0, time_limit=0):
+    """
+    The budgets of init_worker for the tasks run (with `run`) in the main thread of the current process instead
+    of a worker, e.g. by `manage.py render_pending` without --workers. The previous limits are restored on exit.
+    """
+    global _time_limit
+    previous_memory_limit = resource.getrlimit(resource.RLIMIT_AS) if resource is not None else None
+    previous_time_limit = _time_limit
+    limit_memory(memory_limit)
+    _time_limit = time_limit
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            yield
+    finally:
+        _time_limit = previous_time_limit
+        if previous_memory_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, previous_memory_limit)
+
+
+def _timed_out(signum, frame):
+    raise TaskTimeout(f"Task exceeded its time limit of {_time_limit}s")
+
+
+def run(task_path, *args):
+    """
+    Runs the task with the given dotted path inside the worker, within its time limit.
+    """
+    if not _time_limit or not hasattr(signal, 'setitimer'):
+        return import_string(task_path)(*args)
+    previous = signal.signal(signal.SIGALRM, _timed_out)
+    signal.setitimer(signal.ITIMER_REAL, _time_limit)
+    try:
+        return import_string(task_path)(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
@@ -0,0 +1,81 @@
+"""
+Test client sending requests through the ASGI handler of core/asgi.py like an ASGI server would, see test_async_views.py.
+"""
+import json
+
+from asgiref.sync import async_to_sync
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from rest_framework.authtoken.models import Token
+
+from core.asgi import ASGIHandler
+
+
+class Response:
+
+    def __init__(self, messages):
+        start = messages[0]
+        self.status_code = start['status']
+        self.headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+        self.content = b''.join(message.get('body', b'') for message in messages[1:])
+
+    def __getitem__(self, header):
+        return self.headers[header.lower()]
+
+    @property
+    def url(self):
+        return self.headers['location']
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Client:
+    """
+    Sends requests through the ASGI handler like an ASGI server would, the body in several messages,
+    with the token of the user.
+    """
+
+    def __init__(self, user=None, token=None):
+        if user is not None:
+            token = Token.objects.get_or_create(user=user)[0].key
+        self.headers = {'authorization': f'Token {token}'} if token else {}
+
+    def get(self, url, **headers):
+        return self.request('GET', url, b'', headers)
+
+    def post(self, url, data):
+        return self.request('POST', url, encode_multipart(BOUNDARY, data), {'content-type': MULTIPART_CONTENT})
+
+    def request(self, method, url, body, headers):
+        # the test database connection must survive the request, like with Django's test clients
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            return Response(async_to_sync(self._call)(method, url, body, {**self.headers, **headers}))
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    async def _call(self, method, url, body, headers):
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'content-length', str(len(body)).encode())]
+                       + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        }
+        chunks = [body[i:i + 1024] for i in range(0, len(body), 1024)] or [b'']
+        incoming = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await ASGIHandler()(scope, receive, send)
+        return sent
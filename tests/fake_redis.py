@@ -0,0 +1,141 @@
+"""
+Minimal in-memory server speaking the Redis protocol (RESP2), for testing the Redis cache backend without Redis.
+Implements the commands used by django.core.cache.backends.redis.RedisCache.
+"""
+import socketserver
+import threading
+import time
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.commands = []
+
+    @property
+    def url(self):
+        return f'redis://{self.server_address[0]}:{self.server_address[1]}/0'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b'*'), line
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def write(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, bool):
+            self.wfile.write(b'+OK\r\n' if value else b'$-1\r\n')
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, list):
+            self.wfile.write(b'*%d\r\n' % len(value))
+            for item in value:
+                self.write(item)
+        elif isinstance(value, Exception):
+            self.wfile.write(f'-ERR {value}\r\n'.encode())
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        queued = None
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].decode().upper()
+            if name == 'MULTI':
+                queued = []
+                self.wfile.write(b'+OK\r\n')
+            elif name == 'EXEC':
+                with self.server.lock:
+                    results = [self.execute(command[0].decode().upper(), command[1:]) for command in queued]
+                queued = None
+                self.write(results)
+            elif queued is not None:
+                queued.append(args)
+                self.wfile.write(b'+QUEUED\r\n')
+            else:
+                with self.server.lock:
+                    self.write(self.execute(name, args[1:]))
+
+    def execute(self, name, args):
+        server = self.server
+        server.commands.append(name)
+        if name in ('PING',):
+            return b'PONG'
+        if name in ('CLIENT', 'SELECT'):
+            return True
+        if name == 'GET':
+            return server.data[args[0]] if server.alive(args[0]) else None
+        if name == 'MGET':
+            return [server.data[key] if server.alive(key) else None for key in args]
+        if name == 'SET':
+            key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+            if b'NX' in options and server.alive(key):
+                return False
+            server.data[key] = value
+            server.expires.pop(key, None)
+            if b'EX' in options:
+                server.expires[key] = time.monotonic() + int(args[2 + options.index(b'EX') + 1])
+            return True
+        if name == 'MSET':
+            for key, value in zip(args[::2], args[1::2]):
+                server.data[key] = value
+                server.expires.pop(key, None)
+            return True
+        if name == 'EXPIRE':
+            if not server.alive(args[0]):
+                return 0
+            server.expires[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if name == 'PERSIST':
+            return int(server.expires.pop(args[0], None) is not None)
+        if name == 'DEL':
+            deleted = [key for key in args if server.alive(key)]
+            for key in deleted:
+                server.data.pop(key)
+                server.expires.pop(key, None)
+            return len(deleted)
+        if name == 'EXISTS':
+            return sum(server.alive(key) for key in args)
+        if name == 'INCRBY':
+            if not server.alive(args[0]):
+                return ValueError('no such key')
+            server.data[args[0]] = str(int(server.data[args[0]]) + int(args[1])).encode()
+            return int(server.data[args[0]])
+        if name == 'FLUSHDB':
+            server.data.clear()
+            server.expires.clear()
+            return True
+        return ValueError(f'unknown command {name}')
@@ -0,0 +1,285 @@
+"""
+Minimal S3-compatible server keeping the objects as files under a directory, for testing and developing
+against the object storage (image_hosting/object_storage.py) offline, with path-style addressing.
+Implements the operations the storage uses: Put/Get (with Range)/Head/DeleteObject, ListObjectsV2 and
+the multipart uploads. Authentication is not checked.
+
+    python -m tests.fake_s3 ./s3-data --port 9000 --bucket images
+
+then S3_BUCKET=images S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_ADDRESSING_STYLE=path
+S3_ACCESS_KEY_ID=x S3_SECRET_ACCESS_KEY=x python manage.py runserver
+"""
+import argparse
+import email.utils
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+
+NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, buckets=(), port=0):
+        super().__init__(('127.0.0.1', port), FakeS3Handler)
+        self.root = str(root)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0
+        for bucket in buckets:
+            os.makedirs(os.path.join(self.root, bucket), exist_ok=True)
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def object_path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def upload_dir(self, upload_id):
+        return os.path.join(self.root, '.multipart', upload_id)
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        query = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        with self.server.lock:
+            self.server.requests.append((self.command, key, sorted(query)))
+        if not os.path.isdir(os.path.join(self.server.root, bucket)):
+            return self.error(404, 'NoSuchBucket')
+        return bucket, key, query
+
+    def do_HEAD(self):
+        route = self.route()
+        if route is None:
+            return
+        bucket, key, _ = route
+        path = self.server.object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self.send(404, headers={'Content-Length': '0'})
+        self.send(200, headers=self.object_headers(path, os.path.getsize(path)))
+
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            return
+        bucket, key, query = route
+        if not key:
+            return self.list_objects(bucket, query)
+        path = self.server.object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self.error(404, 'NoSuchKey')
+
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        match = range_pattern.match(self.headers.get('Range', ''))
+        if match:
+            first, last = match.groups()
+            if not first:
+                start = max(size - int(last), 0)
+            else:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if start >= size or start > end:
+                return self.error(416, 'InvalidRange')
+            status = 206
+        headers = self.object_headers(path, end - start + 1)
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        self.send(status, headers=headers)
+        with open(path, 'rb') as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = file.read(min(remaining, 64 * 1024))
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def do_PUT(self):
+        route = self.route()
+        if route is None:
+            return
+        bucket, key, query = route
+        if 'uploadId' in query:
+            upload_dir = self.server.upload_dir(query['uploadId'])
+            if not os.path.isdir(upload_dir):
+                return self.error(404, 'NoSuchUpload')
+            etag = self.receive(os.path.join(upload_dir, str(int(query['partNumber']))))
+        else:
+            path = self.server.object_path(bucket, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            etag = self.receive(path)
+        self.send(200, headers={'ETag': f'"{etag}"', 'Content-Length': '0'})
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            return
+        bucket, key, query = route
+        if 'uploads' in query:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self.server.upload_dir(upload_id))
+            return self.xml('InitiateMultipartUploadResult', Bucket=bucket, Key=key, UploadId=upload_id)
+
+        upload_dir = self.server.upload_dir(query.get('uploadId', ''))
+        if not query.get('uploadId') or not os.path.isdir(upload_dir):
+            return self.error(404, 'NoSuchUpload')
+        document = ElementTree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        numbers = [int(element.text) for element in document.iter() if element.tag.endswith('PartNumber')]
+        path = self.server.object_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digests = b''
+        with open(path, 'wb') as destination:
+            for number in numbers:
+                with open(os.path.join(upload_dir, str(number)), 'rb') as part:
+                    data = part.read()
+                digests += hashlib.md5(data).digest()
+                destination.write(data)
+        shutil.rmtree(upload_dir)
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"'
+        self.xml('CompleteMultipartUploadResult', Bucket=bucket, Key=key, ETag=etag)
+
+    def do_DELETE(self):
+        route = self.route()
+        if route is None:
+            return
+        bucket, key, query = route
+        if 'uploadId' in query:
+            shutil.rmtree(self.server.upload_dir(query['uploadId']), ignore_errors=True)
+        else:
+            path = self.server.object_path(bucket, key)
+            if os.path.isfile(path):
+                os.remove(path)
+        self.send(204)
+
+    def list_objects(self, bucket, query):
+        prefix, delimiter = query.get('prefix', ''), query.get('delimiter', '')
+        after = query.get('continuation-token') or query.get('start-after', '')
+        max_keys = int(query.get('max-keys', 1000))
+        bucket_dir = os.path.join(self.server.root, bucket)
+        keys = sorted(
+            os.path.relpath(os.path.join(directory, name), bucket_dir).replace(os.sep, '/')
+            for directory, _, names in os.walk(bucket_dir) for name in names
+        )
+        contents, prefixes = [], []
+        for key in keys:
+            if not key.startswith(prefix) or key <= after:
+                continue
+            if delimiter and delimiter in key[len(prefix):]:
+                common = prefix + key[len(prefix):].split(delimiter, 1)[0] + delimiter
+                if common not in prefixes:
+                    prefixes.append(common)
+            else:
+                contents.append(key)
+        entries = sorted([(key, False) for key in contents] + [(common, True) for common in prefixes])
+        truncated = len(entries) > max_keys
+        entries = entries[:max_keys]
+
+        root = ElementTree.Element('ListBucketResult', xmlns=NAMESPACE)
+        fields = {'Name': bucket, 'Prefix': prefix, 'KeyCount': len(entries), 'MaxKeys': max_keys,
+                  'IsTruncated': 'true' if truncated else 'false'}
+        if truncated:
+            # the last entry returned; common prefixes sort after all of their keys
+            last, is_prefix = entries[-1]
+            fields['NextContinuationToken'] = last + '\uffff' if is_prefix else last
+        for name, value in fields.items():
+            ElementTree.SubElement(root, name).text = str(value)
+        for name, is_prefix in entries:
+            if is_prefix:
+                ElementTree.SubElement(ElementTree.SubElement(root, 'CommonPrefixes'), 'Prefix').text = name
+                continue
+            path = self.server.object_path(bucket, name)
+            content = ElementTree.SubElement(root, 'Contents')
+            ElementTree.SubElement(content, 'Key').text = name
+            ElementTree.SubElement(content, 'Size').text = str(os.path.getsize(path))
+            ElementTree.SubElement(content, 'LastModified').text = datetime.fromtimestamp(
+                os.path.getmtime(path), timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        self.send_body(200, ElementTree.tostring(root, xml_declaration=True, encoding='utf-8'))
+
+    def receive(self, path):
+        digest = hashlib.md5()
+        remaining = int(self.headers.get('Content-Length', 0))
+        with open(path, 'wb') as file:
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                file.write(chunk)
+                remaining -= len(chunk)
+        return digest.hexdigest()
+
+    def object_headers(self, path, length):
+        return {
+            'Content-Length': str(length),
+            'Last-Modified': email.utils.formatdate(os.path.getmtime(path), usegmt=True),
+            'ETag': f'"{os.path.getsize(path):x}-{int(os.path.getmtime(path) * 1000):x}"',
+            'Accept-Ranges': 'bytes',
+        }
+
+    def xml(self, tag, **fields):
+        root = ElementTree.Element(tag, xmlns=NAMESPACE)
+        for name, value in fields.items():
+            ElementTree.SubElement(root, name).text = str(value)
+        self.send_body(200, ElementTree.tostring(root, xml_declaration=True, encoding='utf-8'))
+
+    def error(self, status, code):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{code}</Message></Error>'
+        self.send_body(status, body.encode())
+
+    def send_body(self, status, body):
+        self.send(status, headers={'Content-Type': 'application/xml', 'Content-Length': str(len(body))})
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help="Directory of the buckets.")
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--bucket', action='append', default=[], help="Bucket to create (repeatable).")
+    args = parser.parse_args()
+    server = FakeS3Server(args.root, args.bucket, args.port)
+    print(f"Serving {args.root} on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,47 @@
+import io
 import tempfile
 import uuid
 import pytest
 from PIL import Image
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
 
+from image_hosting import tiers
 from image_hosting.models import User, UploadedFile, TempUrl
+from tests.fake_redis import FakeRedisServer
+from tests.fake_s3 import FakeS3Server
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # the cache outlives the test transaction and ids are reused, so every test starts empty
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def redis_cache(settings):
+    server = FakeRedisServer().start()
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': server.url}}
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def s3_storage(settings, tmp_path):
+    # the files go to a bucket of a fake S3 server, kept under tmp_path
+    server = FakeS3Server(tmp_path / 's3', buckets=['media']).start()
+    settings.S3_BUCKET = 'media'
+    settings.S3_ENDPOINT_URL = server.url
+    settings.S3_ADDRESSING_STYLE = 'path'
+    settings.S3_ACCESS_KEY_ID = 'test'
+    settings.S3_SECRET_ACCESS_KEY = 'test'
+    settings.DEFAULT_FILE_STORAGE = 'image_hosting.object_storage.S3Storage'
+    yield server
+    server.stop()
 
 
 @pytest.fixture
@@ -74,6 +110,50 @@ def create_file(db, tmp_path_factory):
     return _create
 
 
+@pytest.fixture
+def tier_cache():
+    # the tier cache outlives the test transaction, so drop whatever the test put in it
+    yield
+    tiers.invalidate()
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def render_cache_dir(settings, tmp_path):
+    settings.RENDER_CACHE_DIR = str(tmp_path / 'renders')
+    return tmp_path / 'renders'
+
+
+@pytest.fixture
+def upload_session_dir(settings, tmp_path):
+    settings.UPLOAD_SESSION_DIR = str(tmp_path / 'upload_sessions')
+    return tmp_path / 'upload_sessions'
+
+
+@pytest.fixture
+def create_upload():
+    def _create(extension='png', size=(100, 100)):
+        image = Image.new('RGB', size)
+        buffer = io.BytesIO()
+        if extension == 'png':
+            image.save(buffer, format='PNG')
+            content_type = 'image/png'
+        elif extension == 'webp':
+            image.save(buffer, format='WEBP')
+            content_type = 'image/webp'
+        else:
+            image.save(buffer, format='JPEG')
+            content_type = 'image/jpeg'
+        return SimpleUploadedFile(f'test_file.{extension}', buffer.getvalue(), content_type=content_type)
+
+    return _create
+
+
 @pytest.fixture
 def create_temp_url(db):
     def _create(user, token, file, expiry_date):
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import io
+from unittest import mock
+
+import pytest
+import pytz
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+
+from tests.asgi_client import Client
+from tests.fixtures import *
+from image_hosting.links import create_link, revoke_link
+from image_hosting.models import randomString
+
+
+@pytest.mark.django_db
+class TestAsyncImageViews:
+
+    @pytest.fixture(autouse=True)
+    def synchronous_renditions(self, settings, media_root):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        settings.MEDIA_ACCEL_BACKEND = ''
+
+    def test_unauthenticated(self):
+        response = Client().get(reverse('async_images'))
+
+        assert response.status_code == 401
+        assert response['WWW-Authenticate'] == 'Token'
+
+    def test_invalid_token(self):
+        response = Client(token='invalid').get(reverse('async_images'))
+
+        assert response.status_code == 401
+        assert response.json() == {'detail': 'Invalid token.'}
+
+    def test_upload_list_and_detail(self, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks):
+        client = Client(get_or_create_premium_user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(reverse('async_images'), {'new_file': create_upload('png')})
+        assert response.status_code == 201
+        created = response.json()
+        assert created['rendition_status'] == UploadedFile.RenditionStatus.PENDING
+        file = UploadedFile.objects.get(pk=created['id'])
+        assert file.blob is not None
+        assert file.rendition_status == UploadedFile.RenditionStatus.READY
+
+        response = client.get(reverse('async_images'))
+        assert response.status_code == 200
+        assert [image['id'] for image in response.json()['results']] == [file.pk]
+        assert response.json()['next'] is None
+
+        response = client.get(reverse('async_image_detail', kwargs={'pk': file.pk}))
+        assert response.status_code == 200
+        assert response.json()['image_thumbnail400'].endswith(f"/media/CACHE/renditions/{file.image_url.name[:-4]}/400.jpg")
+
+        response = client.get(reverse('async_image_detail', kwargs={'pk': file.pk}), if_none_match=response['ETag'])
+        assert response.status_code == 304
+
+    def test_upload_invalid_file(self, get_or_create_premium_user):
+        client = Client(get_or_create_premium_user)
+        upload = SimpleUploadedFile('image.png', b'not an image', content_type='image/png')
+
+        response = client.post(reverse('async_images'), {'new_file': upload})
+
+        assert response.status_code == 400
+        assert not UploadedFile.objects.exists()
+
+    def test_upload_long_name(self, get_or_create_premium_user, create_upload, api_client, get_or_create_token):
+        upload = create_upload('png')
+        upload.name = 'a' * 76 + '.png'
+
+        response = Client(get_or_create_premium_user).post(reverse('async_images'), {'new_file': upload})
+
+        assert response.status_code == 400
+        assert response.json() == {'name': ['Ensure this field has no more than 50 characters.']}
+        assert not UploadedFile.objects.exists()
+        # as the synchronous endpoint answers
+        upload.seek(0)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + get_or_create_token(get_or_create_premium_user).key)
+        response = api_client.post(reverse('UploadedFile-list'), {'new_file': upload}, format='multipart')
+        assert (response.status_code, response.json()) == (400, {'name': ['Ensure this field has no more than 50 characters.']})
+
+    def test_other_users_file(self, get_or_create_premium_user, create_file, create_user):
+        client = Client(get_or_create_premium_user)
+        file = create_file('png', create_user(tier='Premium'))
+
+        response = client.get(reverse('async_image_detail', kwargs={'pk': file.pk}))
+
+        assert response.status_code == 404
+
+    def test_signed_file_link(self, get_or_create_enterprise_user, create_upload, django_capture_on_commit_callbacks):
+        user = get_or_create_enterprise_user
+        client = Client(user)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(reverse('async_images'), {'new_file': create_upload('png')})
+        file = UploadedFile.objects.get(pk=response.json()['id'])
+
+        response = client.get(reverse('async_generate_link', kwargs={'file_id': file.pk}) + '?scope=file')
+        assert response.status_code == 201
+        token = response.json()['temp_url'].rstrip('/').rsplit('/', 1)[1]
+
+        response = client.get(reverse('async_use_link', kwargs={'token': token}))
+        assert response.status_code == 302
+
+        response = client.get(response.url)
+        assert response.status_code == 200
+        assert response.content == file.image_url.read()
+        assert response['ETag'] == f'"{file.blob.sha256}"'
+
+    def test_detail_link_refused_on_file(self, get_or_create_enterprise_user, create_file, create_temp_url):
+        user = get_or_create_enterprise_user
+        file = create_file('png', user)
+        _, token = create_link(file.pk, 300)
+        # legacy tokens are resolved from the database, off the event loop
+        legacy = create_temp_url(user=user, token=randomString(), file=file,
+                                 expiry_date=datetime.datetime.now(tz=pytz.utc) + datetime.timedelta(seconds=400))
+
+        for token in (token, legacy.token):
+            response = Client(user).get(reverse('async_image_file', kwargs={'pk': file.pk}) + f'?token={token}')
+
+            assert response.status_code == 403
+            assert response.json() == {'error': 'This url does not give access to the file'}
+
+    def test_revoked_link(self, get_or_create_enterprise_user, create_file):
+        user = get_or_create_enterprise_user
+        file = create_file('png', user)
+        link, token = create_link(file.pk, 300, scope='file')
+        revoke_link(link)
+
+        for url in (reverse('async_use_link', kwargs={'token': token}),
+                    reverse('async_image_file', kwargs={'pk': file.pk}) + f'?token={token}'):
+            response = Client(user).get(url)
+
+            assert response.status_code == 403
+            assert response.json() == {'error': 'This url has been revoked'}
+
+    def test_file_read_off_the_event_loop(self, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks):
+        client = Client(get_or_create_premium_user)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(reverse('async_images'), {'new_file': create_upload('png')})
+        file = UploadedFile.objects.get(pk=response.json()['id'])
+        content = file.image_url.read()
+        reads_on_loop = []
+
+        class CheckedFile(io.FileIO):
+            def read(self, size=-1):
+                try:
+                    asyncio.get_running_loop()
+                    reads_on_loop.append(size)
+                except RuntimeError:
+                    pass
+                return super().read(size)
+
+        url = reverse('async_image_file', kwargs={'pk': file.pk})
+        with mock.patch.object(FileSystemStorage, '_open', lambda storage, name, mode='rb': File(CheckedFile(storage.path(name)))), \
+                mock.patch('django.http.FileResponse.block_size', 64):
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.content == content
+
+            response = client.get(url, range='bytes=10-200')
+            assert response.status_code == 206
+            assert response.content == content[10:201]
+        assert reads_on_loop == []
+
+    def test_thumbnail_negotiated(self, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks):
+        client = Client(get_or_create_premium_user)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(reverse('async_images'), {'new_file': create_upload('png')})
+        url = reverse('async_image_file', kwargs={'pk': response.json()['id']}) + '?size=200'
+
+        response = client.get(url, accept='image/webp,*/*')
+        assert response['Content-Type'] == 'image/webp'
+        assert response['Vary'] == 'Accept'
+
+        response = client.get(url, accept='*/*')
+        assert response['Content-Type'] == 'image/jpeg'
+        assert response['Vary'] == 'Accept'
+
+    def test_expired_link(self, get_or_create_enterprise_user, create_file):
+        user = get_or_create_enterprise_user
+        file = create_file('png', user)
+        link, token = create_link(file.pk, -1)
+
+        response = Client(user).get(reverse('async_use_link', kwargs={'token': token}))
+
+        assert response.status_code == 403
+        assert response.json() == {'error': 'This url has expired'}
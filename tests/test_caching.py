@@ -0,0 +1,217 @@
+import datetime
+from concurrent.futures import Future
+from unittest import mock
+
+import pytest
+import pytz
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.urls import reverse
+
+from tests.fixtures import *
+from image_hosting import caching, renditions
+from image_hosting.models import randomString, User
+
+
+@pytest.mark.django_db
+class TestCachedAuthentication:
+
+    def test_token_cached(self, api_client, get_or_create_token, get_or_create_basic_user, django_assert_num_queries):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('UploadedFile-list')
+        response = api_client.get(url)
+        assert response.status_code == 200
+
+        # only the files of the page
+        with django_assert_num_queries(1):
+            response = api_client.get(url)
+        assert response.status_code == 200
+
+    def test_deleted_token_rejected(self, api_client, get_or_create_token, get_or_create_basic_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('UploadedFile-list')
+        assert api_client.get(url).status_code == 200
+
+        token.delete()
+
+        assert api_client.get(url).status_code == 401
+
+    def test_deactivated_user_rejected(self, api_client, get_or_create_token, get_or_create_basic_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('UploadedFile-list')
+        assert api_client.get(url).status_code == 200
+
+        basic_user.is_active = False
+        basic_user.save()
+
+        assert api_client.get(url).status_code == 401
+
+    def test_library_version_not_stale(self, api_client, get_or_create_token, create_file, get_or_create_basic_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('UploadedFile-list')
+        etag = api_client.get(url)['ETag']
+
+        create_file('png', basic_user)
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert len(response.data['results']) == 1
+
+
+class WorkerProcessPool:
+    """
+    Stands in for the spawned rendition workers, which cannot open the in-memory test database: runs the jobs
+    when told to, with an in-process cache of their own like a worker process has.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.jobs.append((future, fn, args))
+        return future
+
+    def run_jobs(self):
+        for future, fn, args in self.jobs:
+            with mock.patch.object(caching, 'cache', LocMemCache('worker', {})):
+                result = fn(*args)
+            # the done callbacks run in the web process
+            future.set_result(result)
+
+
+@pytest.mark.django_db
+def test_process_pool_renders_reach_the_web_process_cache(api_client, get_or_create_token, get_or_create_basic_user, create_upload,
+                                                          media_root, settings, monkeypatch, django_capture_on_commit_callbacks):
+    settings.RENDITION_BACKEND = 'image_hosting.renditions.ProcessPoolBackend'
+    pool = WorkerProcessPool()
+    monkeypatch.setattr(renditions, '_backends', {})
+    monkeypatch.setattr(renditions, 'start_workers', lambda max_workers: pool)
+    basic_user = get_or_create_basic_user
+
+    token = get_or_create_token(basic_user)
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    url = reverse('UploadedFile-list')
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.post(url, {'new_file': create_upload('png')}, format='multipart')
+    response = api_client.get(url)
+    assert response.data['results'][0]['rendition_status'] == 'Pending'
+    etag = response['ETag']
+
+    pool.run_jobs()
+
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data['results'][0]['rendition_status'] == 'Ready'
+
+
+@pytest.mark.django_db
+class TestCachedPayloads:
+
+    def test_detail_payload_cached(self, api_client, get_or_create_token, create_file, get_or_create_premium_user, django_assert_num_queries):
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', premium_user)
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+        first = api_client.get(url)
+
+        # only the last edit date of the ETag
+        with django_assert_num_queries(1):
+            response = api_client.get(url)
+        assert response.data == first.data
+
+    def test_payload_invalidated_on_save(self, api_client, get_or_create_token, create_file, get_or_create_premium_user):
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', premium_user)
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+        api_client.get(url)
+        api_client.get(reverse('UploadedFile-list'))
+
+        file.name = 'renamed'
+        file.save()
+
+        assert api_client.get(url).data['name'] == 'renamed'
+        assert api_client.get(reverse('UploadedFile-list')).data['results'][0]['name'] == 'renamed'
+
+    def test_payload_per_tier(self, api_client, get_or_create_token, create_file, get_or_create_premium_user):
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', premium_user)
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+        assert 'image_url' in api_client.get(url).data
+
+        User.objects.filter(pk=premium_user.pk).update(tier=User.UserTiers.BASIC)
+        User.bump_library_version(premium_user.pk)
+
+        assert 'image_url' not in api_client.get(url).data
+
+
+@pytest.mark.django_db
+def test_legacy_link_cached(api_client, get_or_create_token, create_file, create_temp_url, get_or_create_enterprise_user, django_assert_num_queries):
+    enterprise_user = get_or_create_enterprise_user
+
+    token = get_or_create_token(enterprise_user)
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    file = create_file('png', enterprise_user)
+    temp_url = create_temp_url(user=enterprise_user, token=randomString(stringLength=20), file=file,
+                               expiry_date=datetime.datetime.now(tz=pytz.utc) + datetime.timedelta(seconds=400))
+    url = reverse('use_link', kwargs={'token': temp_url.token})
+    assert api_client.get(url).status_code == 302
+
+    with django_assert_num_queries(0):
+        assert api_client.get(url).status_code == 302
+
+    temp_url.delete()
+    assert api_client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+class TestRedisCache:
+
+    def test_backend(self, redis_cache):
+        cache.set('key', {'a': 1}, timeout=60)
+        cache.set_many({'one': 1, 'two': 2})
+
+        assert cache.get('key') == {'a': 1}
+        assert cache.get_many(['one', 'two', 'three']) == {'one': 1, 'two': 2}
+
+        cache.delete('key')
+        assert cache.get('key') is None
+        assert 'MGET' in redis_cache.commands
+
+    def test_authentication(self, api_client, get_or_create_token, get_or_create_basic_user, redis_cache, django_assert_num_queries):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('UploadedFile-list')
+        assert api_client.get(url).status_code == 200
+
+        with django_assert_num_queries(1):
+            assert api_client.get(url).status_code == 200
+
+        token.delete()
+        assert api_client.get(url).status_code == 401
@@ -0,0 +1,170 @@
+import io
+import multiprocessing
+import struct
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+
+from tests.asgi_client import Client
+from tests.fixtures import *
+from image_hosting import renditions, workers
+from image_hosting.models import Tier
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def make_png(width, height):
+    """
+    A 1-bit black PNG of any size, compressed to a few KB: the shape of a decompression bomb.
+    """
+    row = b'\x00' * (1 + (width + 7) // 8)
+    compressor = zlib.compressobj(9)
+    data = b''.join(compressor.compress(row) for _ in range(height)) + compressor.flush()
+    header = struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)
+    content = (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', data) + png_chunk(b'IEND', b''))
+    return SimpleUploadedFile('bomb.png', content, content_type='image/png')
+
+
+def make_jpeg(width, height):
+    """
+    A small JPEG whose frame header declares the given size.
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16)).save(buffer, format='JPEG')
+    content = buffer.getvalue()
+    sof = content.index(b'\xff\xc0')
+    # marker, segment length, sample precision, then height and width
+    content = content[:sof + 5] + struct.pack('>HH', height, width) + content[sof + 9:]
+    return SimpleUploadedFile('bomb.jpg', content, content_type='image/jpeg')
+
+
+@pytest.mark.django_db
+class TestUploadGuard:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, settings, media_root):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'
+
+    def upload(self, api_client, user, new_file):
+        token = Token.objects.get_or_create(user=user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        return api_client.post(reverse('UploadedFile-list'), {'new_file': new_file}, format='multipart')
+
+    @pytest.mark.parametrize('new_file', [make_png(20000, 20000), make_jpeg(30000, 30000)])
+    def test_decompression_bomb_rejected(self, api_client, get_or_create_enterprise_user, new_file):
+        response = self.upload(api_client, get_or_create_enterprise_user, new_file)
+
+        assert response.status_code == 400
+        assert response.data['error'].startswith('Image too large')
+        assert not UploadedFile.objects.exists()
+
+    def test_pixels_over_tier_limit(self, api_client, get_or_create_basic_user, get_or_create_enterprise_user):
+        # 36M pixels: within Enterprise's limit but not Basic's, and far below the cap of Pillow
+        response = self.upload(api_client, get_or_create_basic_user, make_png(6000, 6000))
+        assert response.status_code == 400
+        assert response.data['error'] == 'Image too large: 6000x6000 pixels, the account tier allows 25000000 pixels'
+
+        response = self.upload(api_client, get_or_create_enterprise_user, make_png(6000, 6000))
+        assert response.status_code == 201
+
+    def test_file_size_over_tier_limit(self, api_client, create_user, create_upload, tier_cache):
+        Tier.objects.create(name='Custom', thumbnail_sizes=[200], max_file_size=100)
+
+        response = self.upload(api_client, create_user(tier='Custom'), create_upload('png'))
+
+        assert response.status_code == 400
+        assert response.data['error'] == 'File too large: the account tier allows 100 bytes'
+
+    def test_format_sniffed_from_content(self, api_client, get_or_create_basic_user, create_upload):
+        upload = create_upload('jpg')
+        upload.content_type = 'image/png'
+
+        response = self.upload(api_client, get_or_create_basic_user, upload)
+        assert response.status_code == 201
+        assert response.data['file_format'] == 'JPEG'
+
+        upload = SimpleUploadedFile('fake.png', b'GIF89a' + b'0' * 100, content_type='image/png')
+        response = self.upload(api_client, get_or_create_basic_user, upload)
+        assert response.status_code == 400
+        assert response.data['error'] == 'Invalid file format'
+
+    def test_chunked_upload_limits(self, api_client, get_or_create_basic_user, upload_session_dir):
+        token = Token.objects.get_or_create(user=get_or_create_basic_user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'huge.png', 'size': 11 * 1024 * 1024})
+        assert response.status_code == 400
+
+        content = make_png(20000, 20000).read()
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'bomb.png', 'size': len(content)})
+        url = reverse('UploadSession-detail', kwargs={'pk': response.data['id']})
+
+        response = api_client.put(url, content[:1024], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-1023/{len(content)}')
+        assert response.status_code == 400
+        assert response.data['error'].startswith('Image too large')
+        assert api_client.get(url).status_code == 404
+
+    def test_async_upload_bomb_rejected(self, get_or_create_premium_user):
+        response = Client(get_or_create_premium_user).post(reverse('async_images'), {'new_file': make_png(20000, 20000)})
+
+        assert response.status_code == 400
+        assert response.json()['error'].startswith('Image too large')
+        assert not UploadedFile.objects.exists()
+
+
+class TestWorkerBudgets:
+
+    def test_time_limit(self, monkeypatch):
+        monkeypatch.setattr(workers, '_time_limit', 0.2)
+
+        with pytest.raises(workers.TaskTimeout):
+            workers.run('time.sleep', 5)
+        assert workers.run('time.sleep', 0) is None
+
+    @pytest.mark.skipif(workers.resource is None, reason="needs the resource module")
+    def test_memory_limit(self):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=workers.limit_memory, initargs=(1024 ** 3,)) as executor:
+            with pytest.raises(MemoryError):
+                executor.submit(bytearray, 2 * 1024 ** 3).result()
+            assert len(executor.submit(bytearray, 1024).result()) == 1024
+
+    @pytest.mark.django_db
+    def test_render_pending_in_process_budget(self, api_client, get_or_create_basic_user, create_upload, media_root, settings):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'
+        settings.RENDITION_TIME_LIMIT = 0.2
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=get_or_create_basic_user)[0].key)
+        response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('png')}, format='multipart')
+
+        def slow_resize(source, sizes):
+            time.sleep(5)
+            yield from ()
+
+        out = io.StringIO()
+        with mock.patch.object(renditions, 'resize_thumbnails', slow_resize):
+            call_command('render_pending', stdout=out)
+
+        assert f"file {response.data['id']}: Failed" in out.getvalue()
+        assert workers._time_limit == 0
+
+    @pytest.mark.django_db
+    def test_crashed_worker_marks_file_failed(self, create_file, get_or_create_basic_user):
+        file = create_file('png', get_or_create_basic_user)
+        future = Future()
+        future.set_exception(BrokenProcessPool("A worker died"))
+
+        renditions._render_finished(file.pk, future)
+
+        file.refresh_from_db()
+        assert file.rendition_status == UploadedFile.RenditionStatus.FAILED
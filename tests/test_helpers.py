@@ -1,8 +1,16 @@
+import asyncio
+import datetime
+import importlib
 import os
 
 import pytest
+from django.db import connection
 
-from image_hosting.models import User
+from core import settings as development_settings
+from image_hosting import tiers
+from image_hosting.links import InvalidLink, create_link, resolve_link
+from image_hosting.models import User, Tier, UploadedFile
+from tests.fixtures import tier_cache
 
 
 def get_test_files():
@@ -31,6 +39,48 @@ def test_enterprise_user_create():
     assert user.tier == User.UserTiers.ENTERPRISE
 
 
+@pytest.mark.django_db
+def test_tier_cache_invalidated_on_save(tier_cache):
+    assert tiers.get_tier('Basic').thumbnail_sizes == [200]
+
+    basic = Tier.objects.get(name='Basic')
+    basic.thumbnail_sizes = [200, 300]
+    basic.save()
+
+    assert tiers.get_tier('Basic').thumbnail_sizes == [200, 300]
+    assert tiers.all_thumbnail_sizes() == [200, 300, 400]
+
+
+@pytest.mark.django_db
+def test_expired_tiers_kept_in_event_loop(tier_cache, settings, django_assert_num_queries):
+    tiers.get_tier('Basic')
+    settings.TIER_CACHE_TIMEOUT = -1
+
+    async def lookup():
+        return tiers.get_tier('Basic')
+
+    with django_assert_num_queries(0):
+        assert asyncio.run(lookup()).thumbnail_sizes == [200]
+
+
+@pytest.mark.parametrize('link_keys', ['', 'new:rotated-secret,old:production-secret'])
+def test_production_links_not_signed_with_development_key(monkeypatch, settings, link_keys):
+    monkeypatch.setenv('DJANGO_SECRET_KEY', 'production-secret')
+    monkeypatch.setenv('EXPIRING_LINK_KEYS', link_keys)
+    production = importlib.reload(importlib.import_module('core.settings_production'))
+
+    assert development_settings.SECRET_KEY not in production.EXPIRING_LINK_KEYS.values()
+    settings.EXPIRING_LINK_KEYS = production.EXPIRING_LINK_KEYS
+    settings.EXPIRING_LINK_KEY_ID = production.EXPIRING_LINK_KEY_ID
+    link, token = create_link(1, 400)
+    assert resolve_link(token).id == link.id
+
+    # the development key cannot forge nor verify them
+    settings.EXPIRING_LINK_KEYS = {production.EXPIRING_LINK_KEY_ID: development_settings.SECRET_KEY}
+    with pytest.raises(InvalidLink):
+        resolve_link(token)
+
+
 @pytest.mark.last
 def test_clean_temp_files():
     files = get_test_files()
@@ -39,3 +89,22 @@ def test_clean_temp_files():
         os.remove(file)
 
     assert len(get_test_files()) == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('returning', [True, False])
+def test_returning_queryset(returning, monkeypatch):
+    monkeypatch.setattr(connection.features, 'can_return_columns_from_insert', returning)
+    user = User.objects.create_user('owner', 'owner@test.com', 'testpassword')
+    file = UploadedFile.objects.create(name='first.png', created_by=user, image_url='images/first.png',
+                                       renditions={'200': {'name': 'first_200.jpg'}})
+
+    updated = UploadedFile.objects.filter(pk=file.pk, created_by=user).update_returning(name='second.png',
+                                                                                       last_edited=datetime.date(2020, 1, 2))
+    assert [(item.pk, item.name, item.last_edited, item.renditions) for item in updated] == [
+        (file.pk, 'second.png', datetime.date(2020, 1, 2), {'200': {'name': 'first_200.jpg'}})]
+    assert UploadedFile.objects.filter(pk=file.pk + 1).update_returning(name='third.png') == []
+
+    assert UploadedFile.objects.filter(pk=file.pk).delete_returning('id', 'renditions') == [
+        (file.pk, {'200': {'name': 'first_200.jpg'}})]
+    assert not UploadedFile.objects.exists()
@@ -0,0 +1,59 @@
+import io
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from PIL import Image, ImageFile
+
+from tests.fixtures import *
+from image_hosting.metadata import ORIENTATION_TAG, read_metadata
+
+
+def encode(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return ContentFile(buffer.getvalue(), name=f'image.{format.lower()}')
+
+
+def test_metadata_read_from_header_only(monkeypatch):
+    loads = []
+    monkeypatch.setattr(ImageFile.ImageFile, 'load', lambda self: loads.append(self))
+    file = encode(Image.new('RGBA', (300, 200)), 'PNG')
+
+    metadata = read_metadata(file, 'f' * 64)
+
+    assert metadata == {'width': 300, 'height': 200, 'orientation': 'landscape', 'color_mode': 'RGBA',
+                        'file_size': file.size, 'sha256': 'f' * 64}
+    assert loads == []
+    assert file.tell() == 0
+
+
+def test_metadata_applies_exif_rotation():
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6
+    file = encode(Image.new('RGB', (300, 200)), 'JPEG', exif=exif.tobytes())
+
+    metadata = read_metadata(file, '')
+
+    assert (metadata['width'], metadata['height'], metadata['orientation']) == (200, 300, 'portrait')
+    assert metadata['color_mode'] == 'RGB'
+
+
+@pytest.mark.parametrize('size,orientation', [((100, 100), 'square'), ((80, 120), 'portrait')])
+def test_metadata_orientation(size, orientation):
+    assert read_metadata(encode(Image.new('L', size), 'WEBP'), '')['orientation'] == orientation
+
+
+@pytest.mark.django_db
+def test_extract_metadata_command(get_or_create_basic_user, media_root):
+    file = UploadedFile.objects.create(name='old', created_by=get_or_create_basic_user,
+                                       image_url=UploadedFile._meta.get_field('image_url').storage.save(
+                                           'images/old.png', encode(Image.new('RGB', (40, 60)), 'PNG')))
+    out = io.StringIO()
+
+    call_command('extract_metadata', stdout=out)
+
+    file.refresh_from_db()
+    assert (file.width, file.height, file.orientation, file.color_mode) == (40, 60, 'portrait', 'RGB')
+    assert len(file.sha256) == 64
+    assert 'Extracted the metadata of 1 file(s), 0 failed' in out.getvalue()
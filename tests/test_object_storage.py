@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from tests.fixtures import *
+from image_hosting import orphans
+from image_hosting.models import Blob
+from image_hosting.object_storage import S3Storage
+from image_hosting.renditions import rendition_name
+
+
+def stored(server, name):
+    return os.path.join(server.root, 'media', *name.split('/'))
+
+
+class TestS3Storage:
+
+    def test_save_open_delete(self, s3_storage):
+        content = os.urandom(100 * 1024)
+
+        source = ContentFile(content)
+        name = default_storage.save('images/photo.png', source)
+
+        assert name == 'images/photo.png'
+        # the file still belongs to the caller
+        assert not source.closed
+        with open(stored(s3_storage, name), 'rb') as file:
+            assert file.read() == content
+        assert default_storage.exists(name)
+        assert default_storage.size(name) == len(content)
+        assert default_storage.get_modified_time(name).tzinfo is not None
+        assert default_storage.url(name) == '/media/images/photo.png'
+        assert default_storage.listdir('images') == ([], ['photo.png'])
+        # names are not overwritten, like on the file system
+        assert default_storage.save('images/photo.png', ContentFile(b'other')) != name
+
+        with default_storage.open(name) as file:
+            assert file.size == len(content)
+            assert file.read() == content
+            file.seek(50_000)
+            assert file.read(10) == content[50_000:50_010]
+
+        default_storage.delete(name)
+        assert not default_storage.exists(name)
+        with pytest.raises(FileNotFoundError):
+            default_storage.size(name)
+
+    def test_large_files_uploaded_in_parallel_parts(self, s3_storage, settings):
+        settings.S3_MULTIPART_THRESHOLD = settings.S3_MULTIPART_CHUNKSIZE = 5 * 1024 * 1024
+        settings.S3_MULTIPART_CONCURRENCY = 4
+        storage = S3Storage()
+        content = os.urandom(18 * 1024 * 1024)
+
+        name = storage.save('blobs/large.png', ContentFile(content))
+
+        parts = [request for request in s3_storage.requests if request[0] == 'PUT' and 'partNumber' in request[2]]
+        assert len(parts) == 4
+        with open(stored(s3_storage, name), 'rb') as file:
+            assert file.read() == content
+
+    def test_connections_reused(self, s3_storage):
+        for i in range(20):
+            name = default_storage.save(f'images/{i}.png', ContentFile(b'x' * 1000))
+            assert default_storage.open(name).read() == b'x' * 1000
+
+        assert len(s3_storage.requests) >= 60
+        assert s3_storage.connections == 1
+
+
+@pytest.mark.django_db
+class TestImagesInS3:
+
+    def test_upload_download_delete(self, api_client, get_or_create_token, get_or_create_enterprise_user, create_upload,
+                                    s3_storage, settings, django_capture_on_commit_callbacks):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        settings.MEDIA_ACCEL_BACKEND = ''
+        token = get_or_create_token(get_or_create_enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('png')}, format='multipart')
+        assert response.status_code == 201
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        assert file.rendition_status == UploadedFile.RenditionStatus.READY
+        assert os.path.exists(stored(s3_storage, file.image_url.name))
+        assert os.path.exists(stored(s3_storage, rendition_name(file.image_url.name, 400)))
+
+        with open(stored(s3_storage, file.image_url.name), 'rb') as original:
+            content = original.read()
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == content
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}), HTTP_RANGE='bytes=10-19')
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes 10-19/{len(content)}'
+        assert b''.join(response.streaming_content) == content[10:20]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert api_client.delete(reverse('UploadedFile-detail', kwargs={'pk': file.pk})).status_code == 200
+        orphans.collect(grace=0, batch_size=100)
+        assert not os.path.exists(stored(s3_storage, file.image_url.name))
+        assert not os.path.exists(stored(s3_storage, rendition_name(file.image_url.name, 400)))
+        assert not Blob.objects.exists()
@@ -0,0 +1,154 @@
+import io
+from unittest import mock
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+
+from tests.fixtures import *
+from image_hosting import orphans
+from image_hosting.models import Blob, OrphanFile, StorageScan
+from image_hosting.renditions import rendition_name, rendition_names
+
+SHA256 = 'ab' * 32
+
+
+@pytest.fixture(params=['media_root', 's3_storage'])
+def any_storage(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.mark.django_db
+class TestOrphanCollector:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, settings, api_client, get_or_create_token, get_or_create_premium_user):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        settings.MEDIA_ACCEL_BACKEND = ''
+        self.user = get_or_create_premium_user
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + get_or_create_token(self.user).key)
+        self.client = api_client
+
+    def upload(self, content, capture):
+        with capture(execute=True):
+            response = self.client.post(reverse('UploadedFile-list'),
+                                        {'new_file': SimpleUploadedFile('photo.png', content, content_type='image/png')},
+                                        format='multipart')
+        assert response.status_code == 201
+        return UploadedFile.objects.get(pk=response.data['id'])
+
+    def delete(self, file, capture):
+        with capture(execute=True):
+            assert self.client.delete(reverse('UploadedFile-detail', kwargs={'pk': file.pk})).status_code == 200
+
+    def test_deleted_files_collected_after_grace(self, any_storage, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(create_upload('png').read(), django_capture_on_commit_callbacks)
+        names = [file.image_url.name, *rendition_names(file.renditions)]
+        size = sum(default_storage.size(name) for name in names)
+
+        self.delete(file, django_capture_on_commit_callbacks)
+
+        assert sorted(OrphanFile.objects.values_list('name', flat=True)) == sorted(names)
+        assert orphans.collect(grace=3600, batch_size=100) == (0, 0, 0, 0)
+        assert all(default_storage.exists(name) for name in names)
+
+        assert orphans.collect(grace=0, batch_size=100) == (len(names), len(names), size, 0)
+        assert not any(default_storage.exists(name) for name in names)
+        assert not OrphanFile.objects.exists()
+
+    def test_referenced_files_kept(self, media_root, create_upload, django_capture_on_commit_callbacks):
+        content = create_upload('png').read()
+        first = self.upload(content, django_capture_on_commit_callbacks)
+        self.delete(first, django_capture_on_commit_callbacks)
+        # the same content uploaded again before the collector runs is stored anew
+        second = self.upload(content, django_capture_on_commit_callbacks)
+        assert second.image_url.name != first.image_url.name
+        # and a file recorded while still referenced is not deleted
+        OrphanFile.objects.create(name=rendition_name(second.image_url.name, 200))
+
+        orphans.collect(grace=0, batch_size=100)
+
+        assert not (media_root / first.image_url.name).exists()
+        assert (media_root / second.image_url.name).exists()
+        assert (media_root / rendition_name(second.image_url.name, 200)).exists()
+        assert not OrphanFile.objects.exists()
+
+    def test_replaced_legacy_file(self, media_root, create_upload, django_capture_on_commit_callbacks):
+        # uploaded before the blobs: the file has its own original and thumbnails
+        name = default_storage.save('images/legacy.png', ContentFile(create_upload('png').read()))
+        thumbnail = default_storage.save(rendition_name(name, 200), ContentFile(b'thumbnail'))
+        file = UploadedFile.objects.create(name='legacy.png', created_by=self.user, image_url=name,
+                                           renditions={'200': {'name': thumbnail, 'width': 200, 'height': 200}})
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = self.client.put(reverse('UploadedFile-detail', kwargs={'pk': file.pk}),
+                                       {'new_file': create_upload('jpg')}, format='multipart')
+        assert response.status_code == 200
+
+        assert sorted(OrphanFile.objects.values_list('name', flat=True)) == sorted([name, thumbnail])
+        orphans.collect(grace=0, batch_size=100)
+        assert not (media_root / name).exists()
+        assert not (media_root / thumbnail).exists()
+
+    def test_failed_deletions_do_not_block_the_others(self, media_root, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(create_upload('png').read(), django_capture_on_commit_callbacks)
+        self.delete(file, django_capture_on_commit_callbacks)
+        names = set(OrphanFile.objects.values_list('name', flat=True))
+        # the first batches of the collector
+        failing = set(OrphanFile.objects.order_by('orphaned_at', '-id').values_list('name', flat=True)[:3])
+        delete = orphans.storage.delete
+
+        def flaky_delete(name):
+            if name in failing:
+                # any error of the storage, not only an OSError
+                raise RuntimeError("storage unavailable")
+            delete(name)
+
+        out = io.StringIO()
+        with mock.patch.object(orphans.storage, 'delete', side_effect=flaky_delete):
+            call_command('collect_orphans', '--grace', '0', '--batch-size', '2', '--pause', '0', stdout=out)
+
+        assert f"Deleted {len(names) - len(failing)} orphaned file(s)" in out.getvalue()
+        assert out.getvalue().rstrip().endswith(f"{len(failing)} failed")
+        assert set(OrphanFile.objects.values_list('name', flat=True)) == failing
+        assert not any((media_root / name).exists() for name in names - failing)
+
+        # retried after another grace period
+        assert orphans.collect(grace=3600, batch_size=100)[0] == 0
+        assert orphans.collect(grace=0, batch_size=100)[:2] == (len(failing), len(failing))
+        assert not OrphanFile.objects.exists()
+
+    def test_reconcile(self, any_storage, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(create_upload('png').read(), django_capture_on_commit_callbacks)
+        live = [file.image_url.name, *rendition_names(file.renditions)]
+        strays = sorted([
+            default_storage.save(f'blobs/ab/ab/{SHA256}.png', ContentFile(b'original')),
+            default_storage.save(rendition_name(f'blobs/ab/ab/{SHA256}.png', 200), ContentFile(b'thumbnail')),
+            default_storage.save('images/gone.jpg', ContentFile(b'legacy')),
+            default_storage.save('CACHE/images/images/gone/0123abcd.jpg', ContentFile(b'imagekit')),
+        ])
+
+        # a few files per run, resuming where the last run stopped
+        runs = 0
+        while True:
+            scan = orphans.reconcile(limit=3, batch_size=2)
+            runs += 1
+            if scan.finished_at:
+                break
+        assert runs == (len(live) + len(strays)) // 3 + 1
+        assert StorageScan.objects.count() == 1
+        assert (scan.scanned, scan.orphaned) == (len(live) + len(strays), len(strays))
+        assert sorted(OrphanFile.objects.values_list('name', flat=True)) == strays
+
+        out = io.StringIO()
+        call_command('collect_orphans', '--grace', '0', stdout=out)
+        assert f"Deleted {len(strays)} orphaned file(s) in 1 batch(es), reclaimed 31 bytes" in out.getvalue()
+        assert not any(default_storage.exists(name) for name in strays)
+        assert all(default_storage.exists(name) for name in live)
+        assert Blob.objects.get().ref_count == 1
+
+        # the next run starts a new scan
+        assert orphans.reconcile(limit=100).pk != scan.pk
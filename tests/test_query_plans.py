@@ -0,0 +1,41 @@
+import pytest
+
+from tests.fixtures import *
+from benchmarks.explain_queries import audit, sequential_scans
+from benchmarks.regression import benchmark_settings
+
+
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+def test_no_sequential_scans(settings, tmp_path, tier_cache):
+    for name, value in benchmark_settings(str(tmp_path)).items():
+        setattr(settings, name, value)
+
+    results = audit(images=5)
+
+    assert {name: [(sql, tables) for sql, _, tables in queries if tables]
+            for name, queries in results.items() if any(tables for _, _, tables in queries)} == {}
+
+
+def test_postgresql_plan():
+    plan = [
+        'Limit  (cost=0.28..8.30 rows=1 width=56) (actual time=0.010..0.010 rows=1 loops=1)',
+        '  ->  Seq Scan on image_hosting_tempurl  (cost=10000000000.00..10000000001.01 rows=1 width=56)',
+        '        Filter: ((token)::text = \'abc\'::text)',
+        '  ->  Seq Scan on image_hosting_tier  (cost=10000000000.00..10000000001.03 rows=3 width=120)',
+    ]
+
+    assert sequential_scans('SELECT ...', plan, 'postgresql') == ['image_hosting_tempurl']
+
+
+@pytest.mark.parametrize('sql,plan,tables', [
+    ('SELECT "id" FROM "image_hosting_tempurl" WHERE "token" = \'abc\' LIMIT 1', ['SCAN image_hosting_tempurl'],
+     ['image_hosting_tempurl']),
+    ('SELECT "id" FROM "image_hosting_user" ORDER BY "id" ASC LIMIT 101', ['SCAN image_hosting_user'], []),
+    ('SELECT "id", (SELECT COUNT(*) FROM "t" WHERE "t"."user_id" = "id") FROM "image_hosting_user" ORDER BY "id" LIMIT 101',
+     ['SCAN image_hosting_user', 'CORRELATED SCALAR SUBQUERY 1', 'SEARCH t USING COVERING INDEX t_user_id (user_id=?)'], []),
+    ('SELECT "id" FROM "image_hosting_user" ORDER BY "username" LIMIT 101',
+     ['SCAN image_hosting_user', 'USE TEMP B-TREE FOR ORDER BY'], ['image_hosting_user']),
+    ('SELECT "id" FROM "image_hosting_uploadedfile" WHERE "id" = 1', ['SEARCH image_hosting_uploadedfile USING INTEGER PRIMARY KEY (rowid=?)'], []),
+])
+def test_sqlite_plan(sql, plan, tables):
+    assert sequential_scans(sql, plan, 'sqlite') == tables
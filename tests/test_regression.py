@@ -0,0 +1,21 @@
+import pytest
+
+from tests.fixtures import *
+from benchmarks.regression import benchmark_settings, load_baselines, run, uncovered_routes
+
+
+def test_every_route_has_a_scenario():
+    assert uncovered_routes() == set()
+
+
+# autocommit like in production, so the transactions and on_commit callbacks of the views are counted as they run
+@pytest.mark.django_db(transaction=True, serialized_rollback=True)
+@pytest.mark.parametrize('images', [3, 30])
+def test_query_counts_within_baselines(settings, tmp_path, tier_cache, images):
+    for name, value in benchmark_settings(str(tmp_path)).items():
+        setattr(settings, name, value)
+    baselines = load_baselines()['endpoints']
+
+    results = run(images, iterations=2)
+
+    assert {name: result['queries'] for name, result in results.items() if result['queries'] > baselines[name]['queries']} == {}
@@ -0,0 +1,198 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+
+from tests.fixtures import *
+from image_hosting import render_cache, renditions, workers
+from image_hosting.models import Tier
+
+
+@pytest.mark.django_db
+class TestRenderView:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, settings, media_root, render_cache_dir):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'
+        settings.MEDIA_ACCEL_BACKEND = ''
+        settings.RENDER_WORKERS = 0
+
+    def upload(self, api_client, user, create_upload, size=(300, 200)):
+        token = Token.objects.get_or_create(user=user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('png', size=size)}, format='multipart')
+        return response.data['id']
+
+    def render(self, api_client, file_id, query, **headers):
+        return api_client.get(reverse('UploadedFile-render', kwargs={'pk': file_id}) + query, **headers)
+
+    def test_render_cached(self, api_client, get_or_create_enterprise_user, create_upload, render_cache_dir):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload)
+
+        response = self.render(api_client, file_id, '?w=320&h=240')
+        assert response.status_code == 200
+        assert response['X-Render-Cache'] == render_cache.MISS
+        assert response['Content-Type'] == 'image/jpeg'
+        image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        assert (image.format, image.size) == ('JPEG', (320, 240))
+
+        response = self.render(api_client, file_id, '?w=320&h=240')
+        assert response['X-Render-Cache'] == render_cache.HIT
+        assert len(list(render_cache_dir.rglob('*.jpg'))) == 1
+
+        response = self.render(api_client, file_id, '?w=320&h=240', HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+        assert render_cache.metrics()['hits'] == 1
+        assert render_cache.metrics()['misses'] == 1
+
+    def test_render_contain_png(self, api_client, get_or_create_enterprise_user, create_upload):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload, size=(1200, 400))
+
+        response = self.render(api_client, file_id, '?w=640&h=480&fit=contain&fmt=png')
+
+        assert response.status_code == 200
+        image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        assert (image.format, image.size) == ('PNG', (640, 213))
+
+    def test_render_negotiated(self, api_client, get_or_create_enterprise_user, create_upload):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload)
+
+        response = self.render(api_client, file_id, '?w=320&h=240', HTTP_ACCEPT='image/webp,*/*')
+        assert response['Content-Type'] == 'image/webp'
+        assert response['Vary'] == 'Accept'
+        assert Image.open(io.BytesIO(b''.join(response.streaming_content))).format == 'WEBP'
+
+        response = self.render(api_client, file_id, '?w=320&h=240', HTTP_ACCEPT='*/*')
+        assert response['Content-Type'] == 'image/jpeg'
+
+        response = self.render(api_client, file_id, '?w=320&h=240&fmt=png', HTTP_ACCEPT='image/webp')
+        assert response['Content-Type'] == 'image/png'
+
+    @pytest.mark.parametrize('query,status_code', [
+        ('?w=333&h=333', 403),
+        ('?w=320', 400),
+        ('?w=320&h=240&fit=stretch', 400),
+        ('?w=320&h=240&fmt=gif', 400),
+    ])
+    def test_invalid_render(self, api_client, get_or_create_enterprise_user, create_upload, query, status_code):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload)
+
+        assert self.render(api_client, file_id, query).status_code == status_code
+
+    def test_tier_without_render_sizes(self, api_client, get_or_create_premium_user, create_upload):
+        file_id = self.upload(api_client, get_or_create_premium_user, create_upload)
+
+        response = self.render(api_client, file_id, '?w=320&h=240')
+
+        assert response.status_code == 403
+        assert response.data == {'error': 'Render size 320x240 is not available for the account tier'}
+
+    def test_other_users_file(self, api_client, get_or_create_enterprise_user, create_user, create_upload):
+        file_id = self.upload(api_client, create_user(tier='Enterprise'), create_upload)
+        token = Token.objects.get_or_create(user=get_or_create_enterprise_user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        assert self.render(api_client, file_id, '?w=320&h=240').status_code == 404
+
+
+    def test_render_over_tier_pixels(self, api_client, get_or_create_enterprise_user, create_upload, tier_cache):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload)
+        # the original was uploaded before the tier lowered its limit
+        tier = Tier.objects.get(name='Enterprise')
+        tier.max_pixels = 50_000
+        tier.save()
+
+        response = self.render(api_client, file_id, '?w=320&h=240')
+
+        assert response.status_code == 400
+        assert response.data == {'error': 'Image too large: 300x200 pixels, the account tier allows 50000 pixels'}
+
+    def test_render_on_workers(self, api_client, get_or_create_enterprise_user, create_upload, settings, monkeypatch):
+        file_id = self.upload(api_client, get_or_create_enterprise_user, create_upload)
+        settings.RENDER_WORKERS = 1
+        # threads standing in for the spawned workers, which cannot see the settings of the test
+        started = []
+        monkeypatch.setattr(renditions, '_render_pool', {'executor': None})
+        monkeypatch.setattr(renditions, 'start_workers', lambda max_workers: started.append(max_workers) or ThreadPoolExecutor(max_workers))
+
+        response = self.render(api_client, file_id, '?w=320&h=240')
+        assert response.status_code == 200
+        assert started == [1]
+
+        # out of the budget of the workers
+        with mock.patch.object(renditions, 'render_original', side_effect=workers.TaskTimeout("Task exceeded its time limit")):
+            response = self.render(api_client, file_id, '?w=640&h=480')
+        assert response.status_code == 422
+        assert response.data == {'error': 'The image cannot be rendered within the limits of the server'}
+        assert started == [1]
+        renditions._render_pool['executor'].shutdown()
+
+
+class TestRenderCache:
+
+    def test_concurrent_renders_coalesced(self, render_cache_dir):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b'rendered'
+
+        outcomes = []
+        threads = [threading.Thread(target=lambda: outcomes.append(render_cache.get_or_render('ab/key.jpg', render)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert sorted(outcomes) == [render_cache.COALESCED] * 4 + [render_cache.MISS]
+        assert (render_cache_dir / 'ab' / 'key.jpg').read_bytes() == b'rendered'
+
+    def test_failed_render_retried(self, render_cache_dir):
+        def fail():
+            raise OSError("broken source")
+
+        with pytest.raises(OSError):
+            render_cache.get_or_render('ab/key.jpg', fail)
+
+        assert render_cache.get_or_render('ab/key.jpg', lambda: b'rendered') == render_cache.MISS
+
+    def test_least_recently_used_evicted(self, render_cache_dir, settings):
+        settings.RENDER_CACHE_MAX_BYTES = 350
+        for age, name in enumerate(['aa/first.jpg', 'aa/second.jpg', 'aa/third.jpg']):
+            render_cache.get_or_render(name, lambda: b'x' * 100)
+            os.utime(render_cache_dir / name, (1000 + age, 1000 + age))
+        # reading the oldest makes it the most recently used
+        assert render_cache.get_or_render('aa/first.jpg', lambda: b'') == render_cache.HIT
+
+        render_cache.get_or_render('aa/fourth.jpg', lambda: b'x' * 100)
+
+        assert sorted(path.name for path in render_cache_dir.rglob('*.jpg')) == ['first.jpg', 'fourth.jpg', 'third.jpg']
+        assert render_cache.metrics()['evictions'] == 1
+        assert render_cache.metrics()['evicted_bytes'] == 100
+
+    def test_stats_command(self, render_cache_dir, settings):
+        render_cache.get_or_render('aa/first.jpg', lambda: b'x' * 100)
+        render_cache.get_or_render('aa/first.jpg', lambda: b'')
+        out = io.StringIO()
+
+        call_command('render_cache', stdout=out)
+
+        assert out.getvalue().splitlines()[:2] == [f"1 renders, 100 of {settings.RENDER_CACHE_MAX_BYTES} bytes",
+                                                   "hits 1, misses 1, coalesced 0, hit ratio 50.0%"]
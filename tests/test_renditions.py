@@ -0,0 +1,62 @@
+import io
+
+from PIL import Image, JpegImagePlugin
+
+from image_hosting.renditions import negotiate_format, render_thumbnails
+from image_hosting.serializers import sniff_image_format
+
+
+def make_image(size, format):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=(200, 30, 30)).save(buffer, format=format)
+    buffer.seek(0)
+    return buffer
+
+
+def test_render_thumbnails_sizes():
+    thumbnails = render_thumbnails(make_image((1200, 800), 'PNG'), [(200, 200), (400, 400), (300, 100)])
+
+    assert sorted(thumbnails) == [(200, 200), (300, 100), (400, 400)]
+    for (width, height), content in thumbnails.items():
+        thumbnail = Image.open(content)
+        assert thumbnail.format == 'JPEG'
+        assert thumbnail.size == (width, height)
+
+
+def test_render_thumbnails_decodes_jpeg_once_at_reduced_scale(monkeypatch):
+    drafts = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def record_draft(self, mode, size):
+        result = draft(self, mode, size)
+        drafts.append(self.size)
+        return result
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', record_draft)
+    render_thumbnails(make_image((3200, 2400), 'JPEG'), [(200, 200), (400, 400)])
+
+    # 2400 / 400 allows decoding at 1/4 scale
+    assert drafts == [(800, 600)]
+
+
+def test_render_thumbnails_upscales_small_sources():
+    thumbnails = render_thumbnails(make_image((100, 100), 'PNG'), [(400, 400)])
+
+    assert Image.open(thumbnails[(400, 400)]).size == (400, 400)
+
+
+def test_negotiate_format():
+    chrome = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+
+    assert negotiate_format(chrome, ['avif', 'webp']) == 'avif'
+    assert negotiate_format(chrome, ['webp']) == 'webp'
+    assert negotiate_format('image/avif;q=0, image/webp;q=0.9', ['avif', 'webp']) == 'webp'
+    assert negotiate_format('image/*,*/*', ['avif', 'webp']) is None
+    assert negotiate_format(None, ['webp']) is None
+
+
+def test_sniff_webp():
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='WEBP')
+
+    assert sniff_image_format(buffer.getvalue()[:16]) == 'WEBP'
@@ -1,11 +1,24 @@
 import datetime
+import io
+import os
+import uuid
+from unittest import mock
 
 import pytest
+import pytz
 
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.urls import reverse
+from rest_framework.authtoken.models import Token
 
 from tests.fixtures import *
-from image_hosting.models import randomString
+from image_hosting import blobs, orphans, tiers
+from image_hosting.links import create_link
+from image_hosting.models import randomString, Tier, Blob, TempUrl, UploadSession
+from image_hosting.renditions import THUMBNAIL_VARIANTS, rendition_name, rendition_names
 
 
 @pytest.mark.django_db
@@ -30,6 +43,157 @@ class TestUploadedFileViewsets:
         response = api_client.get(url)
         assert response.status_code == 200
 
+    def test_list_view_paginated(self, api_client, get_or_create_token, create_file, get_or_create_basic_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        files = [create_file('png', basic_user) for _ in range(3)]
+        url = reverse('UploadedFile-list') + '?page_size=2'
+
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert [image['id'] for image in response.data['results']] == [files[2].id, files[1].id]
+        assert response.data['next'] is not None
+
+        response = api_client.get(response.data['next'])
+        assert response.status_code == 200
+        assert [image['id'] for image in response.data['results']] == [files[0].id]
+        assert response.data['next'] is None
+
+    def test_list_view_invalid_cursor(self, api_client, get_or_create_token):
+        token = get_or_create_token()
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = api_client.get(reverse('UploadedFile-list') + '?cursor=not-a-cursor')
+        assert response.status_code == 404
+
+    def test_list_view_sparse_fields(self, api_client, get_or_create_token, create_file, get_or_create_premium_user):
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        create_file('png', premium_user)
+        response = api_client.get(reverse('UploadedFile-list') + '?fields=id,image_thumbnail400')
+        assert response.status_code == 200
+        assert list(response.data['results'][0].keys()) == ['id', 'image_thumbnail400']
+
+    def test_list_view_metadata_filters(self, api_client, get_or_create_token, get_or_create_basic_user, create_upload,
+                                        media_root, settings):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'
+        token = get_or_create_token(get_or_create_basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        uploaded = {}
+        for size in [(300, 200), (200, 300), (800, 600)]:
+            response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('png', size=size)}, format='multipart')
+            assert (response.data['width'], response.data['height'], response.data['color_mode']) == (*size, 'RGB')
+            uploaded[size] = response.data['id']
+
+        def listed(query):
+            response = api_client.get(reverse('UploadedFile-list') + query)
+            assert response.status_code == 200
+            return {image['id'] for image in response.data['results']}
+
+        assert listed('?orientation=landscape') == {uploaded[(300, 200)], uploaded[(800, 600)]}
+        assert listed('?min_width=300&max_height=300') == {uploaded[(300, 200)]}
+        assert listed('?orientation=portrait&min_height=400') == set()
+        sha256 = UploadedFile.objects.get(pk=uploaded[(200, 300)]).blob.sha256
+        assert listed(f'?sha256={sha256}') == {uploaded[(200, 300)]}
+
+        assert api_client.get(reverse('UploadedFile-list') + '?orientation=diagonal').status_code == 400
+        assert api_client.get(reverse('UploadedFile-list') + '?min_width=-1').status_code == 400
+
+    def test_list_view_does_not_touch_storage(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        for _ in range(10):
+            file = create_file('png', enterprise_user)
+            file.rendition_status = UploadedFile.RenditionStatus.READY
+            file.renditions = {str(size): {'name': f'CACHE/renditions/{file.pk}/{size}.jpg', 'width': size, 'height': size, 'bytes': 1}
+                               for size in (200, 400)}
+            file.save()
+
+        storage_calls = []
+        with mock.patch.multiple(FileSystemStorage, **{method: mock.Mock(side_effect=lambda *args, method=method: storage_calls.append(method))
+                                                       for method in ('exists', 'open', 'size', 'path', 'listdir', 'get_modified_time')}):
+            response = api_client.get(reverse('UploadedFile-list'))
+
+        assert response.status_code == 200
+        assert len(response.data['results']) == 10
+        assert response.data['results'][0]['image_thumbnail400'].endswith(f"/media/CACHE/renditions/{file.pk}/400.jpg")
+        assert storage_calls == []
+
+    def test_list_view_conditional(self, api_client, get_or_create_token, create_file, get_or_create_basic_user, django_assert_num_queries):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        create_file('png', basic_user)
+        url = reverse('UploadedFile-list')
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert response['Cache-Control'] == 'private, max-age=60'
+        etag = response['ETag']
+
+        # the authentication is cached
+        with django_assert_num_queries(0):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        create_file('png', basic_user)
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert len(response.data['results']) == 2
+
+    @pytest.mark.parametrize('tier, cache_control', [
+        ('Basic', 'private, max-age=60'),
+        ('Premium', 'private, max-age=30'),
+        ('Enterprise', 'private, max-age=10'),
+    ])
+    def test_cache_control_of_the_tier(self, api_client, get_or_create_token, create_file, create_user, tier_cache, tier, cache_control):
+        user = create_user(tier=tier)
+
+        token = get_or_create_token(user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', user)
+        assert api_client.get(reverse('UploadedFile-list'))['Cache-Control'] == cache_control
+        assert api_client.get(reverse('UploadedFile-detail', kwargs={'pk': file.pk}))['Cache-Control'] == cache_control
+
+        # a tier without a max age has its metadata revalidated every time
+        Tier.objects.filter(name=tier).update(cache_max_age=0)
+        tiers.invalidate()
+        assert api_client.get(reverse('UploadedFile-list'))['Cache-Control'] == 'private, no-cache'
+
+    def test_detail_view_conditional(self, api_client, get_or_create_token, create_file, get_or_create_premium_user, django_assert_num_queries):
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', premium_user)
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+        etag = api_client.get(url)['ETag']
+
+        # the authentication is cached, only the indexed lookup of the file
+        with django_assert_num_queries(1):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        file.name = 'renamed'
+        file.save()
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data['name'] == 'renamed'
+
     def test_detail_view_unauthorized(self, client):
         url = reverse('UploadedFile-detail', kwargs={'pk': 1})
         response = client.get(url)
@@ -75,6 +239,562 @@ class TestUploadedFileViewsets:
         assert response.data.get('image_thumbnail200') is not None
         assert response.data.get('image_thumbnail400') is not None
 
+    def test_detail_view_custom_tier_authorized(self, api_client, get_or_create_token, create_file, create_user, tier_cache):
+        Tier.objects.create(name='Custom', thumbnail_sizes=[120], original_link=True)
+        custom_user = create_user(tier='Custom')
+
+        token = get_or_create_token(custom_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', custom_user)
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert response.data.get('image_thumbnail120') is not None
+        assert response.data.get('image_thumbnail200') is None
+        assert response.data.get('image_url') is not None
+
+    def test_upload_renders_thumbnails_after_commit(self, api_client, get_or_create_token, get_or_create_premium_user, create_upload,
+                                                    media_root, settings, django_capture_on_commit_callbacks):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        url = reverse('UploadedFile-list')
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(url, {'new_file': create_upload('jpg')}, format='multipart')
+
+        assert response.status_code == 201
+        assert response.data.get('rendition_status') == UploadedFile.RenditionStatus.PENDING
+        assert response.data.get('image_thumbnail400') is not None
+
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        assert file.rendition_status == UploadedFile.RenditionStatus.READY
+        assert (media_root / rendition_name(file.image_url.name, 200)).exists()
+        assert (media_root / rendition_name(file.image_url.name, 400)).exists()
+        name = rendition_name(file.image_url.name, 400)
+        assert file.renditions['400'] == {'name': name, 'width': 400, 'height': 400,
+                                          'bytes': (media_root / name).stat().st_size,
+                                          'variants': {variant: {'name': f'{name}.{variant}',
+                                                                 'bytes': (media_root / f'{name}.{variant}').stat().st_size}
+                                                       for variant in THUMBNAIL_VARIANTS}}
+        assert Image.open(media_root / f'{name}.webp').format == 'WEBP'
+
+    def test_identical_uploads_share_storage(self, api_client, get_or_create_token, get_or_create_premium_user, create_upload,
+                                             media_root, settings, django_capture_on_commit_callbacks):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        premium_user = get_or_create_premium_user
+
+        token = get_or_create_token(premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        upload = create_upload('png')
+        content = upload.read()
+        ids = []
+        for _ in range(2):
+            with django_capture_on_commit_callbacks(execute=True):
+                response = api_client.post(reverse('UploadedFile-list'),
+                                           {'new_file': SimpleUploadedFile('copy.png', content, content_type='image/png')},
+                                           format='multipart')
+            assert response.status_code == 201
+            ids.append(response.data['id'])
+
+        first, second = UploadedFile.objects.get(pk=ids[0]), UploadedFile.objects.get(pk=ids[1])
+        assert first.blob_id == second.blob_id
+        assert first.image_url.name == second.image_url.name
+        assert second.renditions == first.renditions
+        assert first.blob.ref_count == 2
+        assert len(list((media_root / 'blobs').rglob('*.png'))) == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert api_client.delete(reverse('UploadedFile-detail', kwargs={'pk': first.pk})).status_code == 200
+        assert (media_root / second.image_url.name).exists()
+        second.blob.refresh_from_db()
+        assert second.blob.ref_count == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert api_client.delete(reverse('UploadedFile-detail', kwargs={'pk': second.pk})).status_code == 200
+        # the files are kept until the collector deletes them
+        assert (media_root / second.image_url.name).exists()
+        assert orphans.collect(grace=0, batch_size=100)[1] == 1 + len(rendition_names(second.renditions))
+        assert not (media_root / second.image_url.name).exists()
+        assert not (media_root / second.renditions['200']['name']).exists()
+        assert not (media_root / second.renditions['200']['variants']['webp']['name']).exists()
+        assert not Blob.objects.exists()
+
+    def test_concurrent_identical_uploads(self, api_client, get_or_create_token, get_or_create_premium_user, create_upload,
+                                          media_root):
+        token = get_or_create_token(get_or_create_premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        content = create_upload('png').read()
+        first = api_client.post(reverse('UploadedFile-list'),
+                                {'new_file': SimpleUploadedFile('first.png', content, content_type='image/png')}, format='multipart')
+        assert first.status_code == 201
+
+        # the second upload looked the blob up before the first committed it: its insert then conflicts
+        add_reference, lookups = blobs._add_reference, []
+
+        def racing_lookup(sha256):
+            lookups.append(sha256)
+            return None if len(lookups) == 1 else add_reference(sha256)
+
+        with mock.patch.object(blobs, '_add_reference', side_effect=racing_lookup), \
+                mock.patch.object(blobs.storage, 'save', wraps=blobs.storage.save) as save:
+            second = api_client.post(reverse('UploadedFile-list'),
+                                     {'new_file': SimpleUploadedFile('second.png', content, content_type='image/png')},
+                                     format='multipart')
+
+        assert second.status_code == 201
+        assert not save.called
+        blob = Blob.objects.get()
+        assert blob.ref_count == 2
+        assert set(UploadedFile.objects.values_list('blob_id', flat=True)) == {blob.pk}
+        assert len(list((media_root / 'blobs').rglob('*.png'))) == 1
+
+    def test_bulk_upload(self, api_client, get_or_create_token, get_or_create_basic_user, create_upload, media_root,
+                         settings, django_capture_on_commit_callbacks):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        long_name = create_upload('png')
+        long_name.name = 'a' * 76 + '.png'
+        new_files = [create_upload('png'), SimpleUploadedFile('notes.txt', b'not an image', content_type='text/plain'),
+                     create_upload('jpg', size=(60, 40)), long_name]
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('UploadedFile-bulk'), {'new_files': new_files}, format='multipart')
+
+        assert response.status_code == 207
+        assert [item['status'] for item in response.data['results']] == [201, 400, 201, 400]
+        assert response.data['results'][1]['error'] == 'Invalid file format'
+        # rejected like a single upload (post) of the same file, not truncated
+        assert response.data['results'][3]['error'] == 'Ensure this field has no more than 50 characters.'
+        assert UploadedFile.objects.filter(created_by=basic_user, rendition_status=UploadedFile.RenditionStatus.READY).count() == 2
+
+    def test_replace_same_content_keeps_thumbnails(self, api_client, get_or_create_token, get_or_create_premium_user, create_upload,
+                                                   media_root, settings, django_capture_on_commit_callbacks, django_assert_num_queries):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        token = get_or_create_token(get_or_create_premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        content = create_upload('png').read()
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('UploadedFile-list'),
+                                       {'new_file': SimpleUploadedFile('first.png', content, content_type='image/png')},
+                                       format='multipart')
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+
+        # the token, then one UPDATE ... RETURNING and the bump of the library version in a transaction
+        with mock.patch('image_hosting.views.enqueue_renditions') as enqueue, django_assert_num_queries(5):
+            response = api_client.put(url, {'new_file': SimpleUploadedFile('renamed.png', content, content_type='image/png')},
+                                      format='multipart')
+        assert response.status_code == 200
+        assert response.data['name'] == 'renamed.png'
+        assert response.data['rendition_status'] == UploadedFile.RenditionStatus.READY
+        assert not enqueue.called
+        replaced = UploadedFile.objects.get(pk=file.pk)
+        assert (replaced.name, replaced.blob_id, replaced.renditions) == ('renamed.png', file.blob_id, file.renditions)
+        assert api_client.get(url).data['name'] == 'renamed.png'
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.put(url, {'new_file': create_upload('jpg')}, format='multipart')
+        assert response.status_code == 200
+        assert response.data['file_format'] == 'JPEG'
+        assert response.data['rendition_status'] == UploadedFile.RenditionStatus.PENDING
+        orphans.collect(grace=0, batch_size=100)
+        replaced = UploadedFile.objects.get(pk=file.pk)
+        assert replaced.blob_id != file.blob_id
+        assert replaced.rendition_status == UploadedFile.RenditionStatus.READY
+        assert not Blob.objects.filter(pk=file.blob_id).exists()
+        assert not (media_root / file.image_url.name).exists()
+        assert not (media_root / file.renditions['200']['name']).exists()
+
+    def test_replace_other_users_file(self, api_client, get_or_create_token, get_or_create_premium_user, create_user, create_file,
+                                      create_upload, media_root):
+        file = create_file('png', create_user())
+        token = get_or_create_token(get_or_create_premium_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = api_client.put(reverse('UploadedFile-detail', kwargs={'pk': file.pk}), {'new_file': create_upload('jpg')},
+                                  format='multipart')
+
+        assert response.status_code == 404
+        assert not Blob.objects.exists()
+        assert UploadedFile.objects.get(pk=file.pk).name == file.name
+
+    def test_delete_single_statement_per_table(self, api_client, get_or_create_token, get_or_create_enterprise_user, create_file,
+                                               create_temp_url, django_assert_num_queries):
+        user = get_or_create_enterprise_user
+        token = get_or_create_token(user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        file = create_file('png', user)
+        temp_url = create_temp_url(user=user, token=randomString(), file=file,
+                                   expiry_date=datetime.datetime.now(tz=pytz.utc) + datetime.timedelta(seconds=400))
+        url = reverse('UploadedFile-detail', kwargs={'pk': file.pk})
+
+        # the token, the DELETEs of the links and of the file in a transaction, the INSERT of the orphaned files
+        # and the bump of the library version
+        with django_assert_num_queries(7):
+            assert api_client.delete(url).status_code == 200
+
+        assert not UploadedFile.objects.exists()
+        assert not TempUrl.objects.exists()
+        assert api_client.get(reverse('use_link', kwargs={'token': temp_url.token})).status_code == 404
+        assert api_client.delete(url).status_code == 404
+
+    def test_bulk_delete(self, api_client, get_or_create_token, create_file, get_or_create_basic_user, create_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        own_files = [create_file('png', basic_user) for _ in range(2)]
+        other_file = create_file('png', create_user())
+        ids = [own_files[0].id, own_files[1].id, other_file.id]
+
+        response = api_client.post(reverse('UploadedFile-bulk_delete'), {'ids': ids}, format='json')
+        assert response.status_code == 207
+        assert [item['status'] for item in response.data['results']] == [200, 200, 404]
+        assert list(UploadedFile.objects.values_list('id', flat=True)) == [other_file.id]
+
+    def test_bulk_delete_ids_not_a_list(self, api_client, get_or_create_token, create_file, get_or_create_basic_user):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        files = [create_file('png', basic_user) for _ in range(2)]
+
+        for ids in (f'{files[0].id}{files[1].id}', files[0].id, None):
+            response = api_client.post(reverse('UploadedFile-bulk_delete'), {'ids': ids}, format='json')
+            assert response.status_code == 400
+            assert response.data.get('error') == "'ids' must be a list of image ids"
+        assert UploadedFile.objects.count() == 2
+
+    def test_render_pending_command(self, api_client, get_or_create_token, get_or_create_basic_user, create_upload,
+                                    media_root, settings, django_capture_on_commit_callbacks):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.DatabaseQueueBackend'
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        url = reverse('UploadedFile-list')
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(url, {'new_file': create_upload('png')}, format='multipart')
+
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        assert file.rendition_status == UploadedFile.RenditionStatus.PENDING
+
+        call_command('render_pending')
+
+        file.refresh_from_db()
+        assert file.rendition_status == UploadedFile.RenditionStatus.READY
+        assert (media_root / rendition_name(file.image_url.name, 200)).exists()
+
+    def test_render_pending_requeues_interrupted_files(self, create_file, get_or_create_basic_user, media_root, settings):
+        settings.RENDITION_CLAIM_TIMEOUT = 60
+        settings.RENDITION_MAX_ATTEMPTS = 2
+        long_ago = datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(seconds=120)
+        # claimed by workers killed before they finished: once, twice, and one still within the timeout
+        interrupted, retried, running = [create_file('png', get_or_create_basic_user) for _ in range(3)]
+        for file, attempts, claimed_at in ((interrupted, 1, long_ago), (retried, 2, long_ago),
+                                           (running, 1, datetime.datetime.now(tz=pytz.utc))):
+            UploadedFile.objects.filter(pk=file.pk).update(rendition_status=UploadedFile.RenditionStatus.PROCESSING,
+                                                           rendition_claimed_at=claimed_at, rendition_attempts=attempts)
+
+        with mock.patch('image_hosting.renditions.render_renditions') as render:
+            render.return_value = UploadedFile.RenditionStatus.READY
+            out = io.StringIO()
+            call_command('render_pending', stdout=out)
+
+        assert "1 interrupted file(s) requeued, 1 failed" in out.getvalue()
+        render.assert_called_once_with(interrupted.pk)
+        statuses = dict(UploadedFile.objects.values_list('pk', 'rendition_status'))
+        assert statuses[retried.pk] == UploadedFile.RenditionStatus.FAILED
+        assert statuses[running.pk] == UploadedFile.RenditionStatus.PROCESSING
+        assert UploadedFile.objects.get(pk=interrupted.pk).rendition_attempts == 2
+
+
+@pytest.mark.django_db
+class TestMediaViews:
+
+    def upload(self, api_client, user, create_upload, django_capture_on_commit_callbacks):
+        token = Token.objects.get_or_create(user=user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('png')}, format='multipart')
+        return UploadedFile.objects.get(pk=response.data['id'])
+
+    @pytest.fixture(autouse=True)
+    def synchronous_renditions(self, settings, media_root):
+        settings.RENDITION_BACKEND = 'image_hosting.renditions.SynchronousBackend'
+        settings.MEDIA_ACCEL_BACKEND = ''
+
+    def test_original_with_range_and_etag(self, api_client, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(api_client, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks)
+        content = file.image_url.read()
+        url = reverse('UploadedFile-file', kwargs={'pk': file.pk})
+
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == content
+        assert response['ETag'] == f'"{file.blob.sha256}"'
+
+        response = api_client.get(url, HTTP_RANGE='bytes=10-19')
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes 10-19/{len(content)}'
+        assert b''.join(response.streaming_content) == content[10:20]
+
+        assert api_client.get(url, HTTP_RANGE=f'bytes={len(content)}-').status_code == 416
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=f'"{file.blob.sha256}"').status_code == 304
+
+    def test_original_needs_file_link(self, api_client, get_or_create_enterprise_user, create_upload, create_temp_url,
+                                      django_capture_on_commit_callbacks):
+        user = get_or_create_enterprise_user
+        file = self.upload(api_client, user, create_upload, django_capture_on_commit_callbacks)
+        url = reverse('UploadedFile-file', kwargs={'pk': file.pk})
+        _, file_token = create_link(file.pk, 300, scope='file')
+        _, detail_token = create_link(file.pk, 300, scope='detail')
+        legacy = create_temp_url(user=user, token=randomString(), file=file,
+                                 expiry_date=datetime.datetime.now(tz=pytz.utc) + datetime.timedelta(seconds=400))
+
+        response = api_client.get(url, {'token': file_token})
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == file.image_url.read()
+
+        # links to the file information (the legacy ones included) give no access to the original
+        for token in (detail_token, legacy.token):
+            response = api_client.get(url, {'token': token})
+            assert response.status_code == 403
+            assert response.data == {"error": "This url does not give access to the file"}
+
+    def test_original_not_in_basic_tier(self, api_client, get_or_create_basic_user, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(api_client, get_or_create_basic_user, create_upload, django_capture_on_commit_callbacks)
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response.status_code == 403
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}) + '?size=200')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'image/jpeg'
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}) + '?size=400')
+        assert response.status_code == 403
+
+    def test_thumbnail_negotiated(self, api_client, get_or_create_basic_user, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(api_client, get_or_create_basic_user, create_upload, django_capture_on_commit_callbacks)
+        url = reverse('UploadedFile-file', kwargs={'pk': file.pk}) + '?size=200'
+
+        jpeg = api_client.get(url, HTTP_ACCEPT='image/*,*/*;q=0.8')
+        assert jpeg['Content-Type'] == 'image/jpeg'
+        assert jpeg['Vary'] == 'Accept'
+
+        webp = api_client.get(url, HTTP_ACCEPT='image/avif;q=0,image/webp,*/*')
+        assert webp['Content-Type'] == 'image/webp'
+        assert webp['Vary'] == 'Accept'
+        assert webp['ETag'] != jpeg['ETag']
+        content = b''.join(webp.streaming_content)
+        assert len(content) == file.renditions['200']['variants']['webp']['bytes']
+        assert Image.open(io.BytesIO(content)).size == (200, 200)
+
+        response = api_client.get(url, HTTP_ACCEPT='image/webp', HTTP_IF_NONE_MATCH=webp['ETag'])
+        assert response.status_code == 304
+        assert response['Vary'] == 'Accept'
+
+    def test_webp_upload(self, api_client, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks):
+        token = Token.objects.get_or_create(user=get_or_create_premium_user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(reverse('UploadedFile-list'), {'new_file': create_upload('webp')}, format='multipart')
+        assert response.status_code == 201
+        assert response.data['file_format'] == 'WEBP'
+
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        assert file.image_url.name.endswith('.webp')
+        assert file.rendition_status == UploadedFile.RenditionStatus.READY
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response['Content-Type'] == 'image/webp'
+
+    def test_accel_redirect(self, api_client, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks, settings):
+        file = self.upload(api_client, get_or_create_premium_user, create_upload, django_capture_on_commit_callbacks)
+        settings.MEDIA_ACCEL_BACKEND = 'nginx'
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == '/protected-media/' + file.image_url.name
+        assert response.content == b''
+
+    def test_accel_redirect_quotes_the_name(self, api_client, get_or_create_premium_user, settings):
+        # uploaded before the blobs, under the name given by the user
+        name = default_storage.save('images/my photo é.png', ContentFile(b'original'))
+        file = UploadedFile.objects.create(name='my photo é.png', created_by=get_or_create_premium_user, image_url=name)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=file.created_by)[0].key)
+        settings.MEDIA_ACCEL_BACKEND = 'nginx'
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == '/protected-media/images/my%20photo%20%C3%A9.png'
+
+    def test_other_users_file(self, api_client, get_or_create_premium_user, create_user, create_upload, django_capture_on_commit_callbacks):
+        file = self.upload(api_client, create_user(tier='Premium'), create_upload, django_capture_on_commit_callbacks)
+        token = Token.objects.get_or_create(user=get_or_create_premium_user)[0]
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = api_client.get(reverse('UploadedFile-file', kwargs={'pk': file.pk}))
+        assert response.status_code == 404
+
+
+@pytest.mark.django_db
+class TestUploadSessionViewsets:
+
+    def test_create_view_unauthorized(self, client):
+        response = client.post(reverse('UploadSession-list'))
+        assert response.status_code == 401
+
+    def test_chunked_upload(self, api_client, get_or_create_token, get_or_create_basic_user, create_upload,
+                            media_root, upload_session_dir):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        content = create_upload('png', size=(300, 300)).read()
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'chunked.png', 'size': len(content)})
+        assert response.status_code == 201
+        url = reverse('UploadSession-detail', kwargs={'pk': response.data['id']})
+
+        half = len(content) // 2
+        response = api_client.put(url, content[:half], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(content)}')
+        assert response.status_code == 200
+        assert response.data['received'] == half
+
+        # resending a chunk that was already received is rejected
+        response = api_client.put(url, content[:half], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(content)}')
+        assert response.status_code == 409
+
+        response = api_client.put(url, content[half:], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes {half}-{len(content) - 1}/{len(content)}')
+        assert response.status_code == 200
+        assert response.data['progress'] == 100
+
+        response = api_client.post(reverse('UploadSession-finalize', kwargs={'pk': response.data['id']}))
+        assert response.status_code == 201
+        assert response.data['name'] == 'chunked.png'
+        assert response.data['file_format'] == 'PNG'
+
+        file = UploadedFile.objects.get(pk=response.data['id'])
+        assert file.image_url.read() == content
+        assert list(upload_session_dir.iterdir()) == []
+
+    def test_chunked_upload_rejects_invalid_file(self, api_client, get_or_create_token, get_or_create_basic_user, upload_session_dir):
+        basic_user = get_or_create_basic_user
+
+        token = get_or_create_token(basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'fake.png', 'size': 1000})
+        url = reverse('UploadSession-detail', kwargs={'pk': response.data['id']})
+
+        response = api_client.put(url, b'GIF89a' + b'0' * 94, content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE='bytes 0-99/1000')
+        assert response.status_code == 400
+        assert response.data.get('error') == 'Invalid file format'
+        assert api_client.get(url).status_code == 404
+
+    def test_chunked_upload_rejects_corrupt_image(self, api_client, get_or_create_token, get_or_create_basic_user,
+                                                  create_upload, upload_session_dir):
+        token = get_or_create_token(get_or_create_basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        # a valid signature and header, but the image data is cut short
+        content = create_upload('png', size=(300, 300)).read()
+        content = content[:len(content) // 2]
+
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'truncated.png', 'size': len(content)})
+        url = reverse('UploadSession-detail', kwargs={'pk': response.data['id']})
+        response = api_client.put(url, content, content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}')
+        assert response.status_code == 200
+
+        response = api_client.post(reverse('UploadSession-finalize', kwargs={'pk': response.data['id']}))
+        assert response.status_code == 400
+        assert response.data['error'].startswith('Upload a valid image')
+        assert not UploadedFile.objects.exists()
+        assert not Blob.objects.exists()
+        assert list(upload_session_dir.iterdir()) == []
+
+
+    def test_expired_session_rejects_chunks(self, api_client, get_or_create_token, get_or_create_basic_user,
+                                            create_upload, upload_session_dir, settings):
+        settings.UPLOAD_SESSION_MAX_AGE = 3600
+        token = get_or_create_token(get_or_create_basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        content = create_upload('png', size=(300, 300)).read()
+        half = len(content) // 2
+
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'slow.png', 'size': len(content)})
+        session = UploadSession.objects.get(pk=response.data['id'])
+        assert response.data['expires'] == (session.created + datetime.timedelta(hours=1)).isoformat().replace('+00:00', 'Z')
+        url = reverse('UploadSession-detail', kwargs={'pk': session.pk})
+        response = api_client.put(url, content[:half], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{half - 1}/{len(content)}')
+        assert response.status_code == 200
+
+        UploadSession.objects.filter(pk=session.pk).update(created=session.created - datetime.timedelta(hours=2))
+        response = api_client.put(url, content[half:], content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes {half}-{len(content) - 1}/{len(content)}')
+        assert response.status_code == 410
+        assert response.data['error'] == 'Upload session expired'
+        assert api_client.get(url).status_code == 404
+        assert list(upload_session_dir.iterdir()) == []
+
+    def test_open_sessions_limited(self, api_client, get_or_create_token, get_or_create_basic_user, settings):
+        settings.UPLOAD_SESSION_MAX_OPEN = 2
+        token = get_or_create_token(get_or_create_basic_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        ids = [api_client.post(reverse('UploadSession-list'), {'name': 'photo.png', 'size': 1000}).data['id']
+               for _ in range(2)]
+        response = api_client.post(reverse('UploadSession-list'), {'name': 'photo.png', 'size': 1000})
+        assert response.status_code == 409
+        assert response.data['error'] == 'At most 2 uploads can be open at once'
+
+        # expired and cancelled sessions no longer count
+        UploadSession.objects.filter(pk=ids[0]).update(created=datetime.datetime(2020, 1, 1, tzinfo=pytz.utc))
+        assert api_client.post(reverse('UploadSession-list'), {'name': 'photo.png', 'size': 1000}).status_code == 201
+        assert api_client.delete(reverse('UploadSession-detail', kwargs={'pk': ids[1]})).status_code == 200
+        assert api_client.post(reverse('UploadSession-list'), {'name': 'photo.png', 'size': 1000}).status_code == 201
+
+    def test_reap_uploads(self, get_or_create_basic_user, upload_session_dir, settings):
+        settings.UPLOAD_SESSION_MAX_AGE = 3600
+        upload_session_dir.mkdir()
+        sessions = [UploadSession.objects.create(user=get_or_create_basic_user, name='photo.png', size=1000)
+                    for _ in range(5)]
+        for session in sessions:
+            (upload_session_dir / f'{session.id}.part').write_bytes(b'0' * 100)
+        long_ago = datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(hours=2)
+        UploadSession.objects.filter(pk__in=[session.pk for session in sessions[:3]]).update(created=long_ago)
+        # staged files whose session is gone: an old one and one being written
+        stray = upload_session_dir / f'{uuid.uuid4()}.part'
+        stray.write_bytes(b'0' * 10)
+        os.utime(stray, (long_ago.timestamp(), long_ago.timestamp()))
+        fresh = upload_session_dir / f'{uuid.uuid4()}.part'
+        fresh.write_bytes(b'0' * 10)
+
+        out = io.StringIO()
+        call_command('reap_uploads', '--batch-size=2', '--pause=0', stdout=out)
+
+        assert "Reaped 3 expired upload session(s) in 2 batch(es) and 1 stray file(s), reclaimed 310 bytes" in out.getvalue()
+        assert set(UploadSession.objects.values_list('pk', flat=True)) == {session.pk for session in sessions[3:]}
+        assert sorted(path.name for path in upload_session_dir.iterdir()) == sorted(
+            [f'{session.id}.part' for session in sessions[3:]] + [fresh.name])
+
 
 @pytest.mark.django_db
 class TestUserViewsets:
@@ -110,6 +830,61 @@ class TestUserViewsets:
         assert response.status_code == 200
         assert list(response.data.keys()) == ['id', 'username', 'tier', 'images', 'expiry_links']
 
+    def create_users(self, count):
+        for _ in range(count):
+            user = User.objects.create_user(str(uuid.uuid4()), password='password')
+            files = [UploadedFile.objects.create(name='image.png', created_by=user, image_url='images/image.png',
+                                                 file_format=UploadedFile.ValidFileFormat.PNG) for _ in range(2)]
+            TempUrl.objects.create(user=user, related_file=files[0], expiry_date=datetime.datetime.now(pytz.utc))
+
+    @pytest.mark.parametrize('counts', [False, True])
+    def test_list_view_constant_queries(self, api_client, get_or_create_admin_token, django_assert_num_queries, counts):
+        token = get_or_create_admin_token
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('User-list') + ('?counts=1' if counts else '')
+        # the users, or the users and the ids of their images and expiring links
+        queries = 1 if counts else 3
+
+        self.create_users(2)
+        assert api_client.get(url).status_code == 200
+        with django_assert_num_queries(queries):
+            response = api_client.get(url)
+        assert len(response.data['results']) == 3
+
+        self.create_users(10)
+        with django_assert_num_queries(queries):
+            response = api_client.get(url)
+        assert len(response.data['results']) == 13
+
+    def test_list_view_ids_and_counts(self, api_client, get_or_create_admin_token):
+        token = get_or_create_admin_token
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.create_users(1)
+        user = User.objects.latest('id')
+
+        response = api_client.get(reverse('User-list'))
+        listed = response.data['results'][-1]
+        assert listed['images'] == list(user.images.order_by('id').values_list('id', flat=True))
+        assert listed['expiry_links'] == list(user.expiry_links.values_list('id', flat=True))
+
+        response = api_client.get(reverse('User-list') + '?counts=1')
+        assert response.data['results'][0] == {'id': token.user.pk, 'username': token.user.username,
+                                               'tier': token.user.tier, 'images_count': 0, 'expiry_links_count': 0}
+        assert response.data['results'][-1] == {'id': user.pk, 'username': user.username, 'tier': user.tier,
+                                                'images_count': 2, 'expiry_links_count': 1}
+
+    def test_list_view_paginated(self, api_client, get_or_create_admin_token):
+        token = get_or_create_admin_token
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.create_users(4)
+
+        response = api_client.get(reverse('User-list') + '?counts=1&page_size=3')
+        assert [user['id'] for user in response.data['results']] == list(User.objects.order_by('id').values_list('id', flat=True)[:3])
+
+        response = api_client.get(response.data['next'])
+        assert [user['id'] for user in response.data['results']] == list(User.objects.order_by('id').values_list('id', flat=True)[3:])
+        assert response.data['next'] is None
+
 
 class TestExpiryLink:
 
@@ -214,3 +989,145 @@ class TestExpiryLink:
         assert response.status_code == 302
         assert response.url == f"/images/{file.id}/"
 
+    def test_using_signed_link_view_enterprise_authorized(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user, django_assert_num_queries):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        response = api_client.get(reverse('generate_link', kwargs={'file_id': file.pk}) + '?time=400')
+        assert response.status_code == 201
+        assert not TempUrl.objects.exists()
+
+        link_token = response.data['temp_url'].rstrip('/').rsplit('/', 1)[1]
+        url = reverse('use_link', kwargs={'token': link_token})
+        # the authentication is cached
+        with django_assert_num_queries(0):
+            response = api_client.get(url)
+
+        assert response.status_code == 302
+        assert response.url == f"/images/{file.id}/"
+
+    def test_using_signed_file_link_view(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        response = api_client.get(reverse('generate_link', kwargs={'file_id': file.pk}) + '?scope=file')
+        link_token = response.data['temp_url'].rstrip('/').rsplit('/', 1)[1]
+
+        response = api_client.get(reverse('use_link', kwargs={'token': link_token}))
+
+        assert response.status_code == 302
+        assert response.url == f"/images/{file.id}/file/?token={link_token}"
+
+    def test_generating_link_view_other_users_file(self, api_client, get_or_create_token, create_file, create_user, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', create_user(tier='Enterprise'))
+        response = api_client.get(reverse('generate_link', kwargs={'file_id': file.pk}))
+
+        assert response.status_code == 404
+
+    def test_using_tampered_signed_link_view(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        link, link_token = create_link(file.pk, 400)
+        other_link, other_token = create_link(file.pk + 1, 400)
+        # the payload of another link with this link's signature
+        forged = '.'.join(other_token.split('.')[:2] + link_token.split('.')[2:])
+
+        response = api_client.get(reverse('use_link', kwargs={'token': forged}))
+
+        assert response.status_code == 404
+
+    def test_using_expired_signed_link_view(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        link, link_token = create_link(file.pk, -1)
+
+        response = api_client.get(reverse('use_link', kwargs={'token': link_token}))
+
+        assert response.status_code == 403
+        assert response.data.get('error') == 'This url has expired'
+
+    def test_revoking_signed_link_view(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        link, link_token = create_link(file.pk, 400)
+
+        response = api_client.post(reverse('revoke_link', kwargs={'token': link_token}))
+        assert response.status_code == 200
+
+        response = api_client.get(reverse('use_link', kwargs={'token': link_token}))
+        assert response.status_code == 403
+        assert response.data.get('error') == 'This url has been revoked'
+
+    def test_revoking_link_after_downgrade(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        link, link_token = create_link(file.pk, 400)
+        enterprise_user.tier = User.UserTiers.PREMIUM
+        enterprise_user.save()
+
+        response = api_client.post(reverse('revoke_link', kwargs={'token': link_token}))
+
+        assert response.status_code == 403
+        assert response.data.get('error') == 'Given account tier does not support this feature'
+
+    def test_using_signed_link_after_key_rotation(self, api_client, get_or_create_token, create_file, get_or_create_enterprise_user, settings):
+        enterprise_user = get_or_create_enterprise_user
+
+        token = get_or_create_token(enterprise_user)
+        api_client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        file = create_file('png', enterprise_user)
+        settings.EXPIRING_LINK_KEYS = {'old': 'old-secret'}
+        settings.EXPIRING_LINK_KEY_ID = 'old'
+        link, link_token = create_link(file.pk, 400)
+
+        settings.EXPIRING_LINK_KEYS = {'old': 'old-secret', 'new': 'new-secret'}
+        settings.EXPIRING_LINK_KEY_ID = 'new'
+        response = api_client.get(reverse('use_link', kwargs={'token': link_token}))
+        assert response.status_code == 302
+
+        settings.EXPIRING_LINK_KEYS = {'new': 'new-secret'}
+        response = api_client.get(reverse('use_link', kwargs={'token': link_token}))
+        assert response.status_code == 404
+
+    def test_reaping_expired_links(self, create_file, create_temp_url, get_or_create_enterprise_user):
+        enterprise_user = get_or_create_enterprise_user
+        file = create_file('png', enterprise_user)
+        now = datetime.datetime.now(tz=pytz.utc)
+        for _ in range(5):
+            create_temp_url(user=enterprise_user, token=randomString(stringLength=20), file=file, expiry_date=now - datetime.timedelta(seconds=10))
+        active = create_temp_url(user=enterprise_user, token=randomString(stringLength=20), file=file, expiry_date=now + datetime.timedelta(seconds=400))
+
+        out = io.StringIO()
+        call_command('reap_links', '--batch-size=2', '--pause=0', stdout=out)
+
+        assert list(TempUrl.objects.all()) == [active]
+        assert "Reaped 5 expired link(s) in 3 batch(es)" in out.getvalue()
+